@@ -20,6 +20,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
 
 import time
 import warnings
+import multiprocessing
 
 from tensorflow import keras
 import tensorflow as tf
@@ -32,7 +33,11 @@ import dagger.dagger_utils as dagger_utils
 import utils.algo_utils as algo_utils
 import utils.sampler as sampler
 
-from utils.load_utils import load_obj, save_obj
+from utils.artifact_store import ArtifactStore
+from utils.catalog_index import CatalogIndex
+from utils.decision_cache import DecisionCache, tables_tag
+from utils.mi_kernel import AnswerHistograms, TrafficHistory
+from utils.mi_pool import MaxMIPool
 from dagger.model import create_model
 
 # To remove future warning from being printed out
@@ -44,6 +49,9 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 tf.flags.DEFINE_string("run_name", None, "Custom run name to save (default: none)")
 tf.flags.DEFINE_integer("threshold", 50, "Length of the final subset of products (default: 50")
 tf.flags.DEFINE_integer("in_maxMI_size", 1000, "Initial number of products to run maxMI algorithm on (default:1000)")
+tf.flags.DEFINE_string("decision_cache", "../data/decision_cache", "File of the cached teacher decisions, reused across runs (default: ../data/decision_cache)")
+tf.flags.DEFINE_integer("decision_cache_size", 100000, "Max number of cached teacher decisions (default: 100000)")
+tf.flags.DEFINE_integer("workers", multiprocessing.cpu_count(), "Number of persistent MaxMI workers of the teacher, 0 means no worker pool (default: number of cpus)")
 
 # Test parameters
 tf.flags.DEFINE_boolean("use_DAgger", False, "Whether to use DAgger (i.e. retrain iteratively) or simple training on initial training set")
@@ -71,21 +79,35 @@ for key in FLAGS.__flags.keys():
 print('====')
 
 # Loading the datasets
+store = ArtifactStore('../data')
 try:
-    products_cat = load_obj('../data/products_table')
-    traffic_cat = load_obj('../data/traffic_table')
-    purchased_cat = load_obj('../data/purchased_table')
-    filters_def_dict = load_obj('../data/filters_def_dict')
-    type_filters = load_obj('../data/type_filters')
-    question_text_df = load_obj('../data/question_text_df')
-    answer_text = load_obj('../data/answer_text')
+    products_cat = store['products_table']
+    traffic_cat = store['traffic_table']
+    purchased_cat = store['purchased_table']
+    filters_def_dict = store['filters_def_dict']
+    type_filters = store['type_filters']
+    question_text_df = store['question_text_df']
+    answer_text = store['answer_text']
     print("Loaded datasets")
 except:
     print("Create the datasets first...")
+# Downloading history for prior of the teacher
+try:
+    df_history = store['df_history']
+except:
+    df_history = algo_utils.create_history(traffic_cat, question_text_df)
+    store.save('df_history', df_history)
+    print("Created history")
+catalog = CatalogIndex(products_cat, purchased_cat)
+cache = DecisionCache(FLAGS.decision_cache_size, FLAGS.decision_cache,
+                      tag=tables_tag(catalog, len(traffic_cat), len(purchased_cat), df_history),
+                      refresh_log=store['refresh_log'] if 'refresh_log' in store else None,
+                      catalog=catalog)
 
 # ============= GETTING TEACHER DATA ========== #
 print("#"*50) #
 print('Collecting data from teacher (MaxMI algorithm)... \n')
+pool = None
 
 try:
     data = tl.files.load_npy_to_any(name='../teacher_dagger/_tmp.npy')
@@ -96,17 +118,12 @@ try:
 except:
     # Run MaxMI and get the output set of (state, question) for number of products defined in flags (default: 200)
     print("Data not found; teacher is creating it \n")
-    # Downloading history for prior of the teacher
-    try:
-        df_history = load_obj('../data/df_history')
-    except:
-        df_history = algo_utils.create_history(traffic_cat, question_text_df)
-        save_obj(df_history, '../data/df_history')
-        print("Created history")
-    
     # Get question list and state_list of the form : {"q1":[a1,a2], "q2":[a3], "q3":[a4, a6] ..}
     # Use history
     a_hist = 1
+    if FLAGS.workers > 0:
+        # Start the MaxMI workers once for all the teacher sessions
+        pool = MaxMIPool(catalog, traffic_cat, purchased_cat, FLAGS.workers)
     state_list, question_list = dagger_utils.get_data_from_teacher(products_cat,
                                                                     traffic_cat,
                                                                     purchased_cat,
@@ -115,7 +132,12 @@ except:
                                                                     question_text_df,
                                                                     answer_text,
                                                                     FLAGS.threshold,
-                                                                    FLAGS.in_maxMI_size)
+                                                                    FLAGS.in_maxMI_size,
+                                                                    catalog=catalog,
+                                                                    pool=pool,
+                                                                    cache=cache)
+    cache.save()
+    print("Teacher decision cache: {}".format(cache.stats()))
     # Save data as _tmp.npy file (to be reused in next iteration)
     if not os.path.exists(os.path.join(os.path.curdir, "../teacher_dagger/")):
         os.makedirs(os.path.join(os.path.curdir, "../teacher_dagger/"))
@@ -233,6 +255,9 @@ if FLAGS.use_DAgger:
     # ============= COLLECT MORE DATA (EXPLORING NEW STATES) & RETRAIN NETWORK AT EACH EPISODE ========== #
     output_file = open(checkpoint_dir+'/results.txt', 'w')
     n_episodes = FLAGS.n_episodes
+    # Teacher answer histograms, moved from one queried state to the next
+    histograms = AnswerHistograms(catalog, catalog.purchase_counts(purchased_cat),
+                                  history=TrafficHistory(catalog, traffic_cat))
     # Get latest checkpoint of the network
     print('Loading the latest model')
     latest = out_dir+'/cp.ckpt' 
@@ -286,7 +311,10 @@ if FLAGS.use_DAgger:
                                                                     products_cat,
                                                                     traffic_cat,
                                                                     purchased_cat,
-                                                                    FLAGS.threshold)
+                                                                    FLAGS.threshold,
+                                                                    catalog=catalog,
+                                                                    cache=cache,
+                                                                    histograms=histograms)
                 if done is True:  # stop if (# products < threshold) is True
                     break
                 else: 
@@ -374,5 +402,8 @@ if FLAGS.use_DAgger:
             model = create_model(number_filters, length_state, h1=FLAGS.h1, h2=FLAGS.h2,  h3=FLAGS.h3, h4=FLAGS.h4)
             model.load_weights(latest)
 
-
-
+# Keep the teacher decisions for the next runs
+cache.save()
+print("Teacher decision cache: {}".format(cache.stats()))
+if pool is not None:
+    pool.close()
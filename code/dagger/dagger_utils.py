@@ -21,6 +21,7 @@ import matplotlib.pyplot as plt
 
 import utils.algo_utils as algo_utils
 import greedy.MaxMI_Algo as MaxMI
+from utils.decision_cache import state_key
 from utils.sampler import sample_answers
 from utils.build_answers_utils import question_id_to_text, answer_id_to_text
 
@@ -63,7 +64,24 @@ def get_products(state, product_set, traffic_set=[], purchased_set=[]):
     return result_df, traffic_set, purchased_set
 
 
-def get_next_question_opt(state, product_set, traffic_set, purchased_set, threshold):
+def get_products_mask(state, catalog, mask=None):
+    """ Same as get_products on the compiled catalog.
+    Args:
+        state: {question1:answer1, question2: answer2, ...}
+        catalog: compiled catalog (see utils.catalog_index.CatalogIndex)
+        mask (default None): initial set of products, full catalog if None
+    
+    Returns:
+        mask: packed bitmap of the products of the catalog matching the state
+    """
+    if mask is None:
+        mask = catalog.full_mask()
+    for q, a in state.items():
+        mask = catalog.select(mask, q, a)
+    return mask
+
+
+def get_next_question_opt(state, product_set, traffic_set, purchased_set, threshold, catalog=None, pool=None, cache=None, histograms=None):
     """ For teacher. Compute the true next question, according to MaxMI principle, 
     given the history of previous questions and answers.
     
@@ -80,19 +98,33 @@ def get_next_question_opt(state, product_set, traffic_set, purchased_set, thresh
                                         Items_ProductId, 
                                         Items_ItemCount]
         threshold: max length of final set of products
+        catalog (default None): compiled catalog, if given the state is applied
+                                on the catalog index instead of product_set
+        pool (default None): persistent worker pool used by opt_step (see utils.mi_pool.MaxMIPool)
+        cache (default None): cache of the decisions per state (see utils.decision_cache.DecisionCache)
+        histograms (default None): answer histograms kept between the calls (see utils.mi_kernel.AnswerHistograms),
+                                   only the products that changed since the previous state are visited
     
     Returns:
         next_question: next optimal question to ask
         done: boolean variable to indicate if reached 
               the minimal set of remaining product
     """
-    product_set, traffic_set, purchased_set = get_products(state, 
-                                                           product_set,
-                                                           traffic_set,
-                                                           purchased_set)
-    n = len(np.unique(product_set["ProductId"]))
+    mask = None
+    if catalog is not None:
+        mask = get_products_mask(state, catalog, catalog.mask_of(product_set["ProductId"].values))
+        traffic_set = catalog.restrict(traffic_set, mask)
+        purchased_set = catalog.restrict(purchased_set, mask)
+        n = catalog.count(mask)
+        all_questions = set([float(q) for q in catalog.questions(mask)])
+    else:
+        product_set, traffic_set, purchased_set = get_products(state, 
+                                                               product_set,
+                                                               traffic_set,
+                                                               purchased_set)
+        n = len(np.unique(product_set["ProductId"]))
+        all_questions = set([float(q) for q in algo_utils.get_questions(product_set)])
     print('remaining prod {}'.format(n))
-    all_questions = set([float(q) for q in algo_utils.get_questions(product_set)])
     question_asked = [float(s) for s in state.keys()]
     # state keys is the list of questions asked 
     question_set = all_questions.difference(question_asked)
@@ -102,14 +134,22 @@ def get_next_question_opt(state, product_set, traffic_set, purchased_set, thresh
         next_question = 0
     else:
         done = False
-        next_question = MaxMI.opt_step(question_set,
-                                       product_set,
-                                       traffic_set,
-                                       purchased_set)
+        next_question = cache.get(state_key(state)) if cache is not None else None
+        if next_question is None:
+            next_question = MaxMI.opt_step(question_set,
+                                           product_set,
+                                           traffic_set,
+                                           purchased_set,
+                                           catalog=catalog,
+                                           mask=mask,
+                                           pool=pool,
+                                           histograms=histograms)
+            if cache is not None:
+                cache.put(state_key(state), next_question)
     return next_question, done
 
 
-def get_data_from_teacher(products_cat, traffic_cat, purchased_cat, a_hist, df_history, question_text_df, answer_text_df, threshold, size=200, p_idk=0.1, p_2a=0.1, p_3a=0.1):
+def get_data_from_teacher(products_cat, traffic_cat, purchased_cat, a_hist, df_history, question_text_df, answer_text_df, threshold, size=200, p_idk=0.1, p_2a=0.1, p_3a=0.1, catalog=None, pool=None, cache=None):
     """ Compute the trajectory for all the products following the entropy principle, and divide them in states and actions.
     Args:
         product_set: product table [ProductId, BrandId, ProductTypeID,
@@ -142,30 +182,44 @@ def get_data_from_teacher(products_cat, traffic_cat, purchased_cat, a_hist, df_h
                             and random other one)
         p_3a (default 0.15): probability of giving 
                              3 answers to a given question.
+        catalog (default None): compiled catalog (see utils.catalog_index.CatalogIndex)
+        pool (default None): persistent worker pool used by opt_step (see utils.mi_pool.MaxMIPool)
+        cache (default None): cache of the decisions per state (see utils.decision_cache.DecisionCache),
+                              replaces the precomputation of the first questions
     Returns:
         state_list: questions, answers made by MaxMI algorithm
         question_list: action taken for each state
     """
     # Optimization: compute first_questions outside product loop
-    first_questions = []
+    # (with a cache the first questions are cached as any other state)
+    first_questions = None if cache is not None else []
     first_question_set = set(algo_utils.get_questions(products_cat))
-    n_first_q = 3 
-    print("Optimization: computing first {} questions without history beforehand".format(n_first_q))
+    n_first_q = 3 if cache is None else 0
+    if n_first_q > 0:
+        print("Optimization: computing first {} questions without history beforehand".format(n_first_q))
     for i in range(n_first_q):
         first_question = MaxMI.opt_step(first_question_set, 
                                         products_cat,
                                         traffic_cat,
                                         purchased_cat,
                                         a_hist,
-                                        df_history)
+                                        df_history,
+                                        catalog,
+                                        catalog.full_mask() if catalog is not None else None,
+                                        pool=pool)
         first_questions.append(first_question)
         first_question_set = first_question_set.difference(set(first_questions))
 
     # Select a subset of size products from the y_distribution
     state_list = []
     all_questions_list = []
-    p_y = algo_utils.get_proba_Y_distribution(products_cat, purchased_cat, alpha=1)["final_proba"].values
-    y_array = np.random.choice(products_cat["ProductId"].drop_duplicates().values, size = size, p = p_y)
+    if catalog is not None:
+        product_ids, p_y = algo_utils.get_proba_Y_distribution_index(catalog, catalog.full_mask(),
+                                                                     catalog.purchase_counts(purchased_cat), alpha=1)
+    else:
+        product_ids = products_cat["ProductId"].drop_duplicates().values
+        p_y = algo_utils.get_proba_Y_distribution(products_cat, purchased_cat, alpha=1)["final_proba"].values
+    y_array = np.random.choice(product_ids, size = size, p = p_y)
 
     # For each product compute the trajectory following the MaxMI algorithm
     for y in y_array:
@@ -180,7 +234,10 @@ def get_data_from_teacher(products_cat, traffic_cat, purchased_cat, a_hist, df_h
                                                         answers_y,
                                                         a_hist,
                                                         df_history,
-                                                        first_questions)
+                                                        first_questions,
+                                                        catalog,
+                                                        pool,
+                                                        cache)
         # Divide the entire trajectory in {state, action}
         history = {}     # first state is state zero
         state_list.append(history.copy())
@@ -271,7 +328,7 @@ def plot_history(epochs, metric_history_val, metric_history_train, x_breaks, tit
     plt.yticks(fontsize=12)
     plt.savefig(filename, dpi=300)
 
-def dagger_get_questions(y, answers_y, model, question_text_df, answer_text_df, filters_def_dict, products_cat, number_filters):
+def dagger_get_questions(y, answers_y, model, question_text_df, answer_text_df, filters_def_dict, products_cat, number_filters, catalog=None):
     """ This function returns the list of questions for one sampled user with
     one trained instance of dagger.
 
@@ -290,6 +347,8 @@ def dagger_get_questions(y, answers_y, model, question_text_df, answer_text_df,
                           is array of all possible (modified) answers
         products_cat: extract of product catalog for category 6
         number_filters: number of available questions
+        catalog (default None): compiled catalog, if given the products are
+                                filtered on the catalog index
     
     Returns:
         final_question_list: sequence of questionId to ask
@@ -304,6 +363,8 @@ def dagger_get_questions(y, answers_y, model, question_text_df, answer_text_df,
     # Restore the model from the checkpoint
     # Initial state
     state = {}  
+    if catalog is not None:
+        mask = catalog.full_mask()
     # Loop until # products in products set < threshold
     while True: 
         # Get list of questions already asked
@@ -344,9 +405,16 @@ def dagger_get_questions(y, answers_y, model, question_text_df, answer_text_df,
                                                         answer_text))
         answer_text_list.append(answer_text)
         state[q_pred] = list(answers_to_pred)
-        product_set, _, _ = get_products(state, products_cat,[], [])
-        if len(np.unique(product_set['ProductId']))<50:
-            break
+        if catalog is not None:
+            mask = catalog.select(mask, q_pred, state[q_pred])
+            if catalog.count(mask)<50:
+                break
+        else:
+            product_set, _, _ = get_products(state, products_cat,[], [])
+            if len(np.unique(product_set['ProductId']))<50:
+                break
+    if catalog is not None:
+        product_set = catalog.product_table(mask)
     print('DAGGER: Return {} products.'.format(len(np.unique(product_set['ProductId']))))
     return final_question_list, product_set, y, final_question_text_list, answer_text_list
 
@@ -394,26 +462,29 @@ if __name__=="__main__":
     See ReadMe for more details.
     """
     import tensorlayer as tl
-    from utils.load_utils import load_obj, save_obj
+    from utils.artifact_store import ArtifactStore
+    from utils.catalog_index import CatalogIndex
     import argparse
+    store = ArtifactStore('../data')
     try:
-        products_cat = load_obj('../data/products_table')
-        traffic_cat = load_obj('../data/traffic_table')
-        purchased_cat = load_obj('../data/purchased_table')
-        filters_def_dict = load_obj('../data/filters_def_dict')
-        type_filters = load_obj('../data/type_filters')
-        question_text_df = load_obj('../data/question_text_df')
-        answer_text = load_obj('../data/answer_text')
+        products_cat = store['products_table']
+        traffic_cat = store['traffic_table']
+        purchased_cat = store['purchased_table']
+        filters_def_dict = store['filters_def_dict']
+        type_filters = store['type_filters']
+        question_text_df = store['question_text_df']
+        answer_text = store['answer_text']
         print("Loaded datasets")
     except:
         print("Data not found. Create datasets first please")
     try:
-        df_history = load_obj('../data/df_history')
+        df_history = store['df_history']
     except:
         df_history = algo_utils.create_history(traffic_cat, question_text_df)
-        save_obj(df_history, '../data/df_history')
+        store.save('df_history', df_history)
         print("Created history")
 
+    catalog = CatalogIndex(products_cat)
     
     threshold = 50
     parser = argparse.ArgumentParser()
@@ -441,7 +512,8 @@ if __name__=="__main__":
                                                     question_text_df,
                                                     answer_text,
                                                     threshold,
-                                                    size)
+                                                    size,
+                                                    catalog=catalog)
     if not os.path.exists(os.path.join(os.path.curdir, "../teacher_dagger/")):
             os.makedirs(os.path.join(os.path.curdir, "../teacher_dagger/"))
     print("Saving dagger to {}\n".format(os.path.join(os.path.curdir, "../teacher_dagger/")))
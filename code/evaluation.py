@@ -27,13 +27,17 @@ import warnings
 
 import dagger.dagger_utils as dagger_utils
 import utils.algo_utils as algo_utils
-from utils.algo_utils import get_proba_Y_distribution
-from utils.load_utils import load_obj, save_obj
+from utils.algo_utils import get_proba_Y_distribution_index
+from utils.artifact_store import ArtifactStore
 from utils.init_dataframes import init_df
+from utils.catalog_index import CatalogIndex
+from utils.mi_pool import MaxMIPool
+from utils.decision_cache import DecisionCache, tables_tag
 
 from utils.sampler import sample_answers
 from greedy.MaxMI_Algo import max_info_algorithm, opt_step
 from greedy.RandomBaseline import random_baseline
+from greedy.PolicyTree import PolicyTree
 from dagger.dagger_utils import dagger_get_questions, get_products
 from utils.build_answers_utils import question_id_to_text, answer_id_to_text
 from dagger.model import create_model
@@ -59,6 +63,11 @@ parser.add_argument("-p3a", "--p3a",
                     help="proba of user giving 3 answers to a question", type=float)
 parser.add_argument("-r", "--run", help="checkpoint subfolder name", type=str)
 parser.add_argument("-algo", "--algo", help="which algo to evalute choose 'MaxMI' or 'Dagger'", type=str)
+parser.add_argument("-w", "--workers", help="number of persistent MaxMI workers, 0 means no worker pool", type=int)
+parser.add_argument("-c", "--cache", help="file where the MaxMI decisions are cached across runs", type=str)
+parser.add_argument("-m", "--mode", help="MaxMI scoring mode of opt_step, e.g. 'prune' for branch and bound", type=str)
+parser.add_argument("-rq", "--reduce", help="drop the constant and duplicated questions before each MaxMI step", action="store_true")
+parser.add_argument("-pt", "--policy", help="file of the MaxMI policy tree built with greedy/PolicyTree.py", type=str)
 
 args = parser.parse_args()
 size_test = args.size if args.size else 25
@@ -67,6 +76,11 @@ p_idk = args.pidk if args.pidk else 0.0
 p_2a = args.p2a if args.p2a else 0.0
 p_3a = args.p3a if args.p3a else 0.0
 run = args.run if args.run else 'default'
+workers = args.workers if args.workers else 0
+cache_file = args.cache if args.cache else None
+policy_file = args.policy if args.policy else None
+mode = args.mode if args.mode else None
+reduce_questions = args.reduce
 use = args.algo if args.algo else 'maxMI'
 
 print('Using {} algorithm'.format(use))
@@ -83,35 +97,42 @@ print('Saving to ' + checkpoint_dir)
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 # ============== LOAD DATA ============= #
+# the tables are read from the artifact store (see utils/artifact_store.py)
+# when first used, the DAgger tables are only read for the DAgger evaluation
+store = ArtifactStore('../data')
 try:
-    products_cat = load_obj('../data/products_table')
-    traffic_cat = load_obj('../data/traffic_table')
-    purchased_cat = load_obj('../data/purchased_table')
-    question_text_df = load_obj('../data/question_text_df')
-    answer_text_df = load_obj('../data/answer_text')
-    filters_def_dict = load_obj('../data/filters_def_dict')
+    products_cat = store['products_table']
+    traffic_cat = store['traffic_table']
+    purchased_cat = store['purchased_table']
+    question_text_df = store['question_text_df']
+    answer_text_df = store['answer_text']
     print("Loaded datasets")
 except:
     print("Creating datasets...")
     products_cat, traffic_cat, purchased_cat, filters_def_dict, type_filters, question_text_df, answer_text = init_df()
-    save_obj(products_cat, '../data/products_table')
-    save_obj(traffic_cat, '../data/traffic_table')
-    save_obj(purchased_cat, '../data/purchased_table')
-    save_obj(filters_def_dict, '../data/filters_def_dict')
-    save_obj(type_filters, '../data/type_filters')
-    save_obj(question_text_df, '../data/question_text_df')
-    save_obj(answer_text, '../data/answer_text')
+    store.save('products_table', products_cat)
+    store.save('traffic_table', traffic_cat)
+    store.save('purchased_table', purchased_cat)
+    store.save('filters_def_dict', filters_def_dict)
+    store.save('type_filters', type_filters)
+    store.save('question_text_df', question_text_df)
+    store.save('answer_text', answer_text)
     print("Created datasets")
 
 df_history = 0
 if a_hist > 0 and use=='maxMI':
     try:
-        df_history = load_obj('../data/df_history')
+        df_history = store['df_history']
     except:
         df_history = algo_utils.create_history(traffic_cat, question_text_df)
-        save_obj(df_history, '../data/df_history')
+        store.save('df_history', df_history)
         print("Created history")
 
+# Compile the catalog index once for all the simulated users (products with the
+# same answers and sales are compressed to one weighted position)
+catalog = CatalogIndex(products_cat, purchased_cat)
+pool = None
+
 # ============= INITIALIZE VARIABLES ========== #
 if use=='maxMI':
     with open(checkpoint_dir +'/parameters.txt', 'w+') as f:
@@ -127,8 +148,8 @@ else:
         f.write('Loading the latest model from {}'.format(checkpoint_model))   
 
 # Get Probabilities of products given traffic
-p_y = get_proba_Y_distribution(products_cat, purchased_cat, alpha=1)["final_proba"].values
-y_array = np.random.choice(products_cat["ProductId"].drop_duplicates().values, size = size_test, p = p_y)
+product_ids, p_y = get_proba_Y_distribution_index(catalog, catalog.full_mask(), catalog.purchase_counts(purchased_cat), alpha=1)
+y_array = np.random.choice(product_ids, size = size_test, p = p_y)
 threshold = 50
 
 # Initialize all the placeholders
@@ -152,17 +173,29 @@ with open(checkpoint_dir +'/{}.csv'.format(use), 'w+') as f:
     f.write("QuestionId, QuestionText, AnswerText \n")
 
 if use=='maxMI':
-    # Optimization: compute first_questions outside product loop
-    first_questions = []
-    first_question_set = set(algo_utils.get_questions(products_cat))
-    n_first_q = 3 
-    print("Optimization: computing first {} questions without history beforehand".format(n_first_q))
-    for i in range(n_first_q):
-        first_question = opt_step(first_question_set, products_cat, traffic_cat, purchased_cat, a_hist, df_history)
-        first_questions.append(first_question)
-        first_question_set = first_question_set.difference(set(first_questions))
+    if workers > 0:
+        # Start the MaxMI workers once for the whole evaluation
+        pool = MaxMIPool(catalog, traffic_cat, purchased_cat, workers)
+    # Optimization: cache the decisions per state, shared by all the products
+    # (replaces the precomputation of the first questions for IDK answers)
+    first_questions = None
+    tag = tables_tag(catalog, len(traffic_cat), len(purchased_cat),
+                     store['df_history'] if 'df_history' in store else None)
+    # the pre-pass changes the candidates, hence the decisions
+    # (after a refresh of the tables, only the decisions it affects are dropped)
+    cache = DecisionCache(filename=cache_file, tag=tag + (reduce_questions,),
+                          refresh_log=store['refresh_log'] if 'refresh_log' in store else None,
+                          catalog=catalog)
+    # Offline-compiled decisions, live computation only outside of the tree
+    policy = None
+    if policy_file is not None:
+        policy = PolicyTree.load(policy_file)
+        if policy.tag != tag or policy.a_hist != a_hist:
+            print("The policy tree {} was built on other tables or parameters, ignoring it".format(policy_file))
+            policy = None
 
 else:
+    filters_def_dict = store['filters_def_dict']
     print('Loading the latest model from {}'.format(checkpoint_model))
     length_state = len(dagger_utils.get_onehot_state({}, filters_def_dict))
     number_filters = len(filters_def_dict.keys())
@@ -186,7 +219,13 @@ for y in y_array:
                                                                                                          answers_y,
                                                                                                          a_hist,
                                                                                                          df_history,
-                                                                                                         first_questions)
+                                                                                                         first_questions,
+                                                                                                         catalog,
+                                                                                                         pool,
+                                                                                                         cache,
+                                                                                                         policy,
+                                                                                                         mode,
+                                                                                                         reduce_questions)
     else:
         final_question_list, product_set, y, final_question_text_list, answer_text_list = dagger_get_questions(y,
                                                                                                     answers_y,
@@ -195,7 +234,8 @@ for y in y_array:
                                                                                                     answer_text_df,
                                                                                                     filters_def_dict,
                                                                                                     products_cat,
-                                                                                                    number_filters)       
+                                                                                                    number_filters,
+                                                                                                    catalog)       
     # Save results for MaxMI
     print('{}: the length of optimal eliminate filter was {}'.format(use, len(final_question_list)))
     opt_prod_nb.append(len(np.unique(product_set["ProductId"])))
@@ -213,7 +253,8 @@ for y in y_array:
                                                                                                         answer_text_df,
                                                                                                         threshold,
                                                                                                         y,
-                                                                                                        answers_y)
+                                                                                                        answers_y,
+                                                                                                        catalog)
     rdm_prod_nb.append(len(np.unique(rb_product_set["ProductId"])))
     
     # Save results for random baseline
@@ -232,6 +273,13 @@ for y in y_array:
     with open(checkpoint_dir +'/rdm.csv', 'a+') as f:
          f.write('{}, {}, {} \n'.format(rdm_quest[-1], rdm_quest_text[-1],  rdm_answer_text_list[-1]))
 
+if pool is not None:
+    pool.close()
+if use=='maxMI':
+    print("MaxMI decision cache: {}".format(cache.stats()))
+    if cache_file is not None:
+        cache.save()
+
 # Save the summary statistics of the run in summary.txt
 with open(checkpoint_dir +'/summary.txt', 'w+') as f:
     f.write('Test set size: {} \n Probability of answering I dont know: {} \n'.format(size_test, p_idk) +
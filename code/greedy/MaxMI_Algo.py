@@ -17,10 +17,14 @@ import parmap
 import time
 import warnings
 import multiprocessing
+import math
 
 from utils.load_utils import *
+from utils.artifact_store import ArtifactStore
 from utils.init_dataframes import init_df
 import utils.algo_utils as algo_utils
+import utils.mi_kernel as mi_kernel
+from utils.decision_cache import state_key
 from utils.build_answers_utils import question_id_to_text, answer_id_to_text
 from utils.sampler import sample_answers
 
@@ -29,7 +33,8 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 
 
 
-def conditional_entropy(answer, question, product_set, traffic_set, purchased_set):
+def conditional_entropy(answer, question, product_set, traffic_set, purchased_set, catalog=None, mask=None,
+                        sold=None, alpha_y=1):
     """Compute conditional entropy for one particular answer of a question:
         Args:
             answer: given answer
@@ -37,15 +42,30 @@ def conditional_entropy(answer, question, product_set, traffic_set, purchased_se
             product_set: product table [ProductId	BrandId	ProductTypeId	PropertyValue	PropertyDefinitionId	PropertyDefinitionOptionId	answer]
             traffic_set: traffic table [SessionId	answers_selected	Items_ProductId]
             purchased_set: purchased table [	ProductId	UserId	OrderId	SessionId	Items_ProductId	Items_ItemCount]
+            catalog (default None): compiled catalog, if given the products are filtered on the catalog
+                                    index and product_set is ignored
+            mask (default None): remaining products of the catalog
+            sold (default None): items sold per product of the catalog, aggregated once for all the
+                                 answers (see CatalogIndex.purchase_counts), from purchased_set if None
+            alpha_y (default 1): weight of the purchases in the product distribution
         Returns:
             cond_entropy_y: conditional entropy of the answer
          """
+    if catalog is not None:
+        if np.array_equal(["idk"], answer):
+            sold = np.zeros(catalog.n_products)
+        else:
+            mask = catalog.select(mask, question, answer)
+            if sold is None:
+                sold = catalog.purchase_counts(purchased_set)
+        _, prob_y_given_a = algo_utils.get_proba_Y_distribution_index(catalog, mask, sold, alpha_y)
+        return np.sum(prob_y_given_a*np.log(prob_y_given_a))
     product_set, traffic_set, purchased_set = algo_utils.select_subset(question=question, answer=answer,
                                                             product_set=product_set, traffic_set =traffic_set,
                                                             purchased_set = purchased_set)
     product_ids = product_set["ProductId"].drop_duplicates().values
     try:
-        p_product_given_a = algo_utils.get_proba_Y_distribution(product_set, purchased_set, alpha=1)["final_proba"]
+        p_product_given_a = algo_utils.get_proba_Y_distribution(product_set, purchased_set, alpha=alpha_y)["final_proba"]
     except ZeroDivisionError:
         print('pbm only {} product left'.format(product_ids))
         print(answer)
@@ -56,7 +76,7 @@ def conditional_entropy(answer, question, product_set, traffic_set, purchased_se
     return cond_entropy_y
 
 
-def mutual_inf(question, product_set, traffic_set, purchased_set):
+def mutual_inf(question, product_set, traffic_set, purchased_set, catalog=None, mask=None, sold=None):
     """Compute mutual information for a given question:
         Args:
             question: question considered for computing mutual info
@@ -76,9 +96,18 @@ def mutual_inf(question, product_set, traffic_set, purchased_set):
                                             SessionId,
                                             Items_ProductId,
                                             Items_ItemCount]
+            catalog (default None): compiled catalog (see utils.catalog_index.CatalogIndex)
+            mask (default None): remaining products of the catalog
+            sold (default None): items sold per product of the catalog (see CatalogIndex.purchase_counts),
+                                 aggregated from purchased_set if None
         Returns:
             short_mutual_info: mutual info for that given question
          """
+    if catalog is not None:
+        # all the answers are scored in one pass on the catalog index
+        if sold is None:
+            sold = catalog.purchase_counts(purchased_set)
+        return mi_kernel.mutual_inf_kernel(catalog, mask, question, sold, traffic_set, alpha=1)
     proba_A = algo_utils.get_proba_A_distribution_none(question, product_set, traffic_set, alpha=1)["final_proba"]
     possible_answers = proba_A.index
     short_mutual_info = proba_A.loc[possible_answers]
@@ -87,7 +116,8 @@ def mutual_inf(question, product_set, traffic_set, purchased_set):
     return (short_mutual_info)
 
 
-def opt_step(question_set, product_set, traffic_set, purchased_set, a_hist = 0, df_history = 0):
+def opt_step(question_set, product_set, traffic_set, purchased_set, a_hist = 0, df_history = 0, catalog = None, mask = None,
+             mode = None, pool = None, histograms = None):
     """Maximal mutual information greedy step to select the best questions to ask given the history:
     Args:
         question_set: set of questions already asked
@@ -104,19 +134,73 @@ def opt_step(question_set, product_set, traffic_set, purchased_set, a_hist = 0,
         a_hist: (default = 0) parameter to determine the importance of history filters, 
                               the higher the more important history is. 0 means no history
         df_history (default = 0): history table [ProductId, text, frequency]
+        catalog (default = None): compiled catalog, if given the remaining products 
+                                  are given by mask instead of product_set
+        mask (default = None): remaining products of the catalog
+        mode (default = None): 'parmap' scores each question in a separate task,
+                               'batch' scores all the questions at once on the catalog,
+                               'pool' scores them in the persistent workers of pool,
+                               'incremental' scores them from the answer histograms,
+                               'prune' scores them from the answer histograms by branch and
+                               bound, skipping the questions that cannot be chosen,
+                               'sample' estimates them from a sample of the products (see approx_opt_step).
+                               Defaults to 'pool' if a pool is given, 'incremental' if
+                               histograms are given, 'batch' if a catalog is given,
+                               'parmap' otherwise.
+        pool (default = None): persistent worker pool (see utils.mi_pool.MaxMIPool), the
+                               workers restrict their own traffic and purchased tables to mask
+        histograms (default = None): answer histograms of the catalog (see utils.mi_kernel.AnswerHistograms),
+                                     moved to mask before scoring, their exploded traffic table
+                                     (if any) replaces traffic_set in every mode on the catalog
     
     Returns:
         next_question: questionId to ask
      """
+    if mode is None:
+        if pool is not None:
+            mode = 'pool'
+        elif histograms is not None:
+            mode = 'incremental'
+        else:
+            mode = 'batch' if catalog is not None else 'parmap'
+    # exploded traffic table of the histograms, the sessions being selected by mask
+    history = histograms.history if histograms is not None else None
+    if mode == 'sample':
+        next_question, confidence = approx_opt_step(question_set, traffic_set, purchased_set, catalog, mask,
+                                                    a_hist, df_history, history=history)
+        print("{} (confidence {:.3f})".format(next_question, confidence))
+        return next_question
     MI_matrix = np.zeros([len(question_set), 2])
-    mutual_array = np.asarray(parmap.map(mutual_inf,
-                                        question_set,
-                                        product_set=product_set,
-                                        traffic_set=traffic_set,
-                                        purchased_set=purchased_set,
-                                        pm_pbar=True,
-                                        pm_parallel=True,
-                                        pm_processes = multiprocessing.cpu_count()))
+    if mode == 'pool':
+        mutual_array = pool.score(mask, list(question_set))
+    elif mode == 'incremental':
+        histograms.update(mask)
+        mutual_array = histograms.score(list(question_set), traffic_set)
+    elif mode == 'prune':
+        histograms.update(mask)
+        prior = None
+        if a_hist > 0:
+            prior = algo_utils.get_proba_Q_distribution(list(question_set), df_history, a_hist)
+        mutual_array, n_pruned = histograms.score_pruned(list(question_set), traffic_set, prior=prior)
+        print("Pruned {} of {} questions".format(n_pruned, len(question_set)))
+    elif mode == 'batch':
+        sold = catalog.purchase_counts(purchased_set)
+        mutual_array = mi_kernel.score_questions(catalog, mask, list(question_set), sold, traffic_set,
+                                                 history=history)
+    else:
+        # with the catalog the purchases are aggregated once for all the questions
+        sold = catalog.purchase_counts(purchased_set) if catalog is not None else None
+        mutual_array = np.asarray(parmap.map(mutual_inf,
+                                            question_set,
+                                            product_set=product_set,
+                                            traffic_set=traffic_set,
+                                            purchased_set=purchased_set,
+                                            catalog=catalog,
+                                            mask=mask,
+                                            sold=sold,
+                                            pm_pbar=True,
+                                            pm_parallel=True,
+                                            pm_processes = multiprocessing.cpu_count()))
     MI_matrix[:,0] = list(question_set)
 
     # Prior on filters already been used by users (more user-friendly)
@@ -132,10 +216,133 @@ def opt_step(question_set, product_set, traffic_set, purchased_set, a_hist = 0,
     return int(next_question)
 
 
+def deadline_opt_step(question_set, product_set, traffic_set, purchased_set, time_budget, a_hist = 0, df_history = 0,
+                      catalog = None, mask = None, histograms = None, priority = 'bound'):
+    """Anytime greedy step for interactive serving: the questions are scored one by one in a
+    priority order and the best question found when the time budget expires is returned.
+    Args:
+        question_set: set of candidate questions
+        product_set: product table [ProductId, BrandId, ProductTypeId, PropertyValue,
+                                    PropertyDefinitionId, PropertyDefinitionOptionId, answer]
+        traffic_set: traffic table [SessionId, answers_selected, Items_ProductId]
+        purchased_set: purchased table [ProductId, UserId, OrderId, SessionId,
+                                        Items_ProductId, Items_ItemCount]
+        time_budget: seconds after which no new question is scored (at least one question is scored)
+        a_hist (default = 0): parameter to determine the importance of history filters
+        df_history (default = 0): history table [ProductId, text, frequency]
+        catalog (default = None): compiled catalog, if given the remaining products are given by mask
+        mask (default = None): remaining products of the catalog
+        histograms (default = None): answer histograms of the catalog (see utils.mi_kernel.AnswerHistograms),
+                                     created from purchased_set if None and a catalog is given
+        priority (default = 'bound'): 'bound' scores the questions by decreasing upper bound of their
+                                      score (needs a catalog), 'history' by decreasing frequency
+                                      of the filters in df_history
+
+    Returns:
+        next_question: best questionId found before the deadline
+        n_evaluated: number of questions scored
+     """
+    deadline = time.time() + time_budget
+    questions = list(question_set)
+    prior = np.ones(len(questions))
+    if a_hist > 0:
+        prior = algo_utils.get_proba_Q_distribution(questions, df_history, a_hist)
+    order = None
+    if priority == 'history' or catalog is None:
+        frequency = np.zeros(len(questions))
+        if not isinstance(df_history, int):
+            frequency = algo_utils.get_proba_Q_distribution(questions, df_history, 1)
+        order = np.argsort(-frequency, kind='stable')
+
+    if catalog is not None:
+        if histograms is None:
+            histograms = mi_kernel.AnswerHistograms(catalog, catalog.purchase_counts(purchased_set), mask)
+        histograms.update(mask)
+        mutual_array, n_evaluated = histograms.score_anytime(questions, deadline, traffic_set,
+                                                             order=order, prior=prior)
+    else:
+        mutual_array = np.full(len(questions), -np.inf)
+        n_evaluated = 0
+        for i in order:
+            if n_evaluated > 0 and time.time() > deadline:
+                break
+            mutual_array[i] = mutual_inf(questions[i], product_set, traffic_set, purchased_set)
+            n_evaluated += 1
+    next_question = int(questions[np.argmax(mutual_array * prior)])
+    print("{} ({} of {} questions evaluated)".format(next_question, n_evaluated, len(questions)))
+    return next_question, n_evaluated
+
+
+def approx_opt_step(question_set, traffic_set, purchased_set, catalog, mask, a_hist = 0, df_history = 0,
+                    confidence = 0.95, time_budget = 1.0, sample_size = 256, seed = None, history = None):
+    """Approximate greedy step for large catalogs: the mutual information is estimated from
+    a sample of the remaining products drawn from the product distribution, and the sample
+    is doubled until the lead of the best question over the second one is significant
+    (normal approximation) or the time budget is spent. If the sample becomes larger than
+    the number of remaining products the exact scores are used.
+    Args:
+        question_set: set of candidate questions
+        traffic_set: traffic table restricted to the remaining products
+        purchased_set: purchased table restricted to the remaining products
+        catalog: compiled catalog (see utils.catalog_index.CatalogIndex)
+        mask: remaining products of the catalog
+        a_hist (default = 0): parameter to determine the importance of history filters
+        df_history (default = 0): history table [ProductId, text, frequency]
+        confidence (default = 0.95): probability that the best question is ahead of the second one
+        time_budget (default = 1.0): seconds after which the current estimate is returned
+        sample_size (default = 256): size of the first sample
+        seed (default = None): seed of the draws
+        history (default = None): exploded traffic table replacing traffic_set (see utils.mi_kernel.TrafficHistory)
+
+    Returns:
+        next_question: questionId to ask
+        confidence: estimated probability that next_question is ahead of the second best question
+     """
+    start_time = time.time()
+    questions = list(question_set)
+    sold = catalog.purchase_counts(purchased_set)
+    prior = np.ones(len(questions))
+    if a_hist > 0:
+        prior = algo_utils.get_proba_Q_distribution(questions, df_history, a_hist)
+    rng = np.random.RandomState(seed)
+    n = catalog.count(mask)
+    while True:
+        if sample_size >= n:
+            scores = mi_kernel.score_questions(catalog, mask, questions, sold, traffic_set, history=history) * prior
+            return int(questions[np.argmax(scores)]), 1.0
+        mutual_array, std_error = mi_kernel.sample_score_questions(catalog, mask, questions, sold, sample_size,
+                                                                    traffic_set, rng=rng, history=history)
+        scores, std_error = mutual_array * prior, std_error * prior
+        order = np.argsort(-scores, kind='stable')
+        if len(questions) == 1:
+            return int(questions[order[0]]), 1.0
+        lead = scores[order[0]] - scores[order[1]]
+        spread = math.sqrt(std_error[order[0]] ** 2 + std_error[order[1]] ** 2)
+        lead_confidence = 0.5 * (1 + math.erf(lead / spread / math.sqrt(2))) if spread > 0 else 1.0
+        if lead_confidence >= confidence or time.time() - start_time > time_budget:
+            return int(questions[order[0]]), lead_confidence
+        sample_size *= 2
+
+
+def informative_questions(catalog, mask, question_set, a_hist = 0, df_history = 0):
+    """Pre-pass dropping the candidate questions that cannot change the state and the duplicates
+    of other questions (see CatalogIndex.informative_questions). With a history prior the kept
+    duplicate is the one with the highest prior, which opt_step would prefer among them.
+    Returns:
+        question_set: set of kept questions
+    """
+    questions = list(question_set)
+    priority = None
+    if a_hist > 0:
+        priority = algo_utils.get_proba_Q_distribution(questions, df_history, a_hist)
+    return set(catalog.informative_questions(mask, questions, priority))
+
+
 def max_info_algorithm(product_set, traffic_set, purchased_set,
                        question_text_df, answer_text_df, threshold,
                        y, answers_y, a_hist = 1, df_history = 0,
-                       first_questions = None):
+                       first_questions = None, catalog = None, pool = None, cache = None, policy = None,
+                       mode = None, reduce_questions = False):
     """Maximan mutual information algorithm to select the best subset of questions to ask:
     Args:
         product_set: product table [ProductId, BrandId,
@@ -158,6 +365,19 @@ def max_info_algorithm(product_set, traffic_set, purchased_set,
         a_hist (default = 0): parameter to determine the importance of history filters
         df_history (default = 0): history table [ProductId, text, frequency]
         first_questions (default = None): optimization step, precompute the firsts questions, create new if there are none
+        catalog (default = None): compiled catalog (see utils.catalog_index.CatalogIndex), if given the
+                                  products are filtered on the catalog index instead of product_set
+        pool (default = None): persistent worker pool used by opt_step (see utils.mi_pool.MaxMIPool)
+        cache (default = None): cache of the decisions per state (see utils.decision_cache.DecisionCache),
+                                if given the first questions are not precomputed, the all-idk
+                                states being cached as any other state
+        policy (default = None): offline-compiled decisions (see greedy.PolicyTree.PolicyTree), the
+                                 next question is computed only for the states outside the tree
+        mode (default = None): scoring mode of opt_step (see opt_step)
+        reduce_questions (default = False): if True (and a catalog is given), the questions that cannot
+                                            change the state and the duplicates of other questions are
+                                            dropped from the candidates after every answer
+                                            (see informative_questions)
     
     Returns:
         final_question_list: sequence of questionId to ask
@@ -166,17 +386,37 @@ def max_info_algorithm(product_set, traffic_set, purchased_set,
         final_question_text_list:  sequence of questionText to ask
         answer_text_list: answers for each final question
      """
+    mask = None
+    histograms = None
+    if catalog is not None:
+        mask = catalog.mask_of(product_set["ProductId"].values)
+        if pool is None:
+            # answer histograms updated with the products removed at each step, the
+            # historical answers being counted from the traffic table exploded once
+            histograms = mi_kernel.AnswerHistograms(catalog, catalog.purchase_counts(purchased_set), mask,
+                                                    history=mi_kernel.TrafficHistory(catalog, traffic_set))
     question_set = set(algo_utils.get_questions(product_set))
+    reduce_questions = reduce_questions and catalog is not None
+    n_candidates, n_kept = 0, 0
+    if reduce_questions:
+        n_candidates += len(question_set)
+        question_set = informative_questions(catalog, mask, question_set, a_hist, df_history)
+        n_kept += len(question_set)
     final_question_list=[]
     final_question_text_list=[]
     answer_text_list = []
-    distinct_products = product_set.ProductId.unique()
+    distinct_products = len(product_set.ProductId.unique())
     print("There are {} questions we can ask".format(len(question_set)))
-    print("There are {} possible products to choose from".format(len(distinct_products)))
+    print("There are {} possible products to choose from".format(distinct_products))
     iter = 1
+    state = {}
+    # the sampled decisions are cached apart from the exact ones
+    scoring = 'sample' if mode == 'sample' else 'exact'
 
     # Compute the first 3 optimized questions for IDK answers (speed-up)
-    if first_questions is None:
+    if first_questions is None and (cache is not None or policy is not None):
+        first_questions = []
+    elif first_questions is None:
         first_questions = []
         first_question_set = question_set
         n_first_q = 3 
@@ -187,7 +427,12 @@ def max_info_algorithm(product_set, traffic_set, purchased_set,
                                       traffic_set,
                                       purchased_set,
                                       a_hist,
-                                      df_history)
+                                      df_history,
+                                      catalog,
+                                      mask,
+                                      mode=mode,
+                                      pool=pool,
+                                      histograms=histograms)
             first_questions.append(first_question)
             first_question_set = first_question_set.difference(set(first_questions))
 
@@ -199,61 +444,103 @@ def max_info_algorithm(product_set, traffic_set, purchased_set,
     while(idk and i < n_first_q):
         next_question = first_questions[i]
         i += 1
+        if cache is not None and state_key(state, a_hist, scoring=scoring) not in cache:
+            cache.put(state_key(state, a_hist, scoring=scoring), next_question)
         print("Next question is filter : {}".format(next_question))
         question_text = question_id_to_text(next_question, question_text_df)
         print("Question is: {}".format(question_text))
         final_question_list.append(int(next_question))
         final_question_text_list.append(question_text)
         answer = answers_y.get(next_question)
-        if not answer == ["idk"]:
+        state[next_question] = answer
+        if not np.array_equal(answer, ["idk"]):
             idk = False
         answer_text = answer_id_to_text(answer, next_question, answer_text_df)
         print("Answer given was: {}".format(answer))
         print("Answer was: {}".format(answer_text))
         answer_text_list.append(answer_text)
-        product_set, traffic_set, purchased_set = algo_utils.select_subset(
-                                                    question=next_question,
-                                                    answer=answer,
-                                                    product_set=product_set,
-                                                    traffic_set =traffic_set,
-                                                    purchased_set = purchased_set)
-        question_set_new = set(product_set["PropertyDefinitionId"].values)
+        if catalog is not None:
+            mask = catalog.select(mask, next_question, answer)
+            traffic_set = catalog.restrict(traffic_set, mask)
+            purchased_set = catalog.restrict(purchased_set, mask)
+            question_set_new = set(catalog.questions(mask))
+            distinct_products = catalog.count(mask)
+        else:
+            product_set, traffic_set, purchased_set = algo_utils.select_subset(
+                                                        question=next_question,
+                                                        answer=answer,
+                                                        product_set=product_set,
+                                                        traffic_set =traffic_set,
+                                                        purchased_set = purchased_set)
+            question_set_new = set(product_set["PropertyDefinitionId"].values)
+            distinct_products = len(product_set.ProductId.unique()) # faster
         question_set = question_set_new.difference(final_question_list)
-        distinct_products = len(product_set.ProductId.unique()) # faster
+        if reduce_questions:
+            n_candidates += len(question_set)
+            question_set = informative_questions(catalog, mask, question_set, a_hist, df_history)
+            n_kept += len(question_set)
         print("There are {} more questions we can ask".format(len(question_set)))
         print("There are {} possible products to choose from".format(distinct_products))
         iter+=1
 
     # Perform greedy step until the subset of products is smaller than a certain threshold
     while not (distinct_products < threshold or len(question_set) == 0):
-        next_question = opt_step(question_set,
-                                product_set,
-                                traffic_set,
-                                purchased_set,
-                                a_hist,
-                                df_history)
+        next_question = policy.next_question(state) if policy is not None else None
+        if next_question is None and cache is not None:
+            next_question = cache.get(state_key(state, a_hist, scoring=scoring))
+        if next_question is None:
+            next_question = opt_step(question_set,
+                                    product_set,
+                                    traffic_set,
+                                    purchased_set,
+                                    a_hist,
+                                    df_history,
+                                    catalog,
+                                    mask,
+                                    mode=mode,
+                                    pool=pool,
+                                    histograms=histograms)
+            if cache is not None:
+                cache.put(state_key(state, a_hist, scoring=scoring), next_question)
         print("Next question is filter : {}".format(next_question))
         question_text = question_id_to_text(next_question, question_text_df)
         print("Question is: {}".format(question_text))
         final_question_list.append(int(next_question))
         final_question_text_list.append(question_text)
         answer = answers_y.get(next_question)
+        state[next_question] = answer
         answer_text = answer_id_to_text(answer, next_question, answer_text_df)
         print("Answer given was: {}".format(answer))
         print("Answer was: {}".format(answer_text))
         answer_text_list.append(answer_text)    
-        product_set, traffic_set, purchased_set = algo_utils.select_subset(
-                                                    question=next_question,
-                                                    answer=answer,
-                                                    product_set=product_set,
-                                                    traffic_set =traffic_set,
-                                                    purchased_set = purchased_set)
-        question_set_new = set(product_set["PropertyDefinitionId"].values) 
+        if catalog is not None:
+            mask = catalog.select(mask, next_question, answer)
+            traffic_set = catalog.restrict(traffic_set, mask)
+            purchased_set = catalog.restrict(purchased_set, mask)
+            question_set_new = set(catalog.questions(mask))
+            distinct_products = catalog.count(mask)
+        else:
+            product_set, traffic_set, purchased_set = algo_utils.select_subset(
+                                                        question=next_question,
+                                                        answer=answer,
+                                                        product_set=product_set,
+                                                        traffic_set =traffic_set,
+                                                        purchased_set = purchased_set)
+            question_set_new = set(product_set["PropertyDefinitionId"].values)
+            distinct_products = len(product_set.ProductId.unique()) # faster
         question_set = question_set_new.difference(final_question_list)
-        distinct_products = len(product_set.ProductId.unique()) # faster
+        if reduce_questions:
+            n_candidates += len(question_set)
+            question_set = informative_questions(catalog, mask, question_set, a_hist, df_history)
+            n_kept += len(question_set)
         print("There are {} more questions we can ask".format(len(question_set)))
         print("There are {} possible products to choose from".format(distinct_products))
         iter+=1
+    if reduce_questions:
+        print("Question pre-pass kept {} of {} candidate questions ({:.1f}% fewer)".format(
+            n_kept, n_candidates, 100.0 * (n_candidates - n_kept) / max(n_candidates, 1)))
+    if catalog is not None:
+        product_set = catalog.product_table(mask)
     return final_question_list, product_set, y, final_question_text_list, answer_text_list
 
 
@@ -262,22 +549,23 @@ if __name__=='__main__':
     Just for testing purposes
     """
     # Upload all the data tables
+    store = ArtifactStore('../data')
     try:
-        products_cat = load_obj('../data/products_table')
-        traffic_cat = load_obj('../data/traffic_table')
-        purchased_cat = load_obj('../data/purchased_table')
-        question_text_df = load_obj('../data/question_text_df')
-        answer_text_df = load_obj('../data/answer_text')
+        products_cat = store['products_table']
+        traffic_cat = store['traffic_table']
+        purchased_cat = store['purchased_table']
+        question_text_df = store['question_text_df']
+        answer_text_df = store['answer_text']
         print("Loaded datsets")
     except:
         print("The dataset is not found...")
 
     # Upload history of filters used from traffic_cat
     try:
-        df_history = load_obj('../data/df_history')
+        df_history = store['df_history']
     except:
         df_history = algo_utils.create_history(traffic_cat, question_text_df)
-        save_obj(df_history, '../data/df_history')
+        store.save('df_history', df_history)
         print("Created history")
 
     # Select a product
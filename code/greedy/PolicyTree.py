@@ -0,0 +1,222 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+This module defines the offline-compiled MaxMI policy tree ("opening book").
+
+The first_questions optimization precomputes the greedy decisions of the
+all-idk path. Here the MaxMI decision tree is expanded offline, the most
+probable states first: the probability of a state is the product of the
+probabilities of its answers (see algo_utils.get_proba_A_distribution_index).
+The tree is saved to disk and the next question of a session is then found
+by following its answers from the root. Sessions leaving the tree fall back
+to the live computation with opt_step.
+
+Usage:
+    python PolicyTree.py -n 2000 -a 1 -t 50
+"""
+
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import argparse
+import heapq
+import time
+import numpy as np
+
+from utils.load_utils import load_obj, save_obj
+from utils.artifact_store import ArtifactStore
+import utils.algo_utils as algo_utils
+import utils.mi_kernel as mi_kernel
+from utils.catalog_index import CatalogIndex
+from utils.decision_cache import answers_key, tables_tag
+from greedy.MaxMI_Algo import opt_step
+
+
+class PolicyTree(object):
+    """ MaxMI decisions for the most probable states.
+
+    Each node stores the question asked in its state, its children are the
+    states reached by answering this question (one child per answer key).
+
+    Example:
+        >>> policy = PolicyTree.load('../data/policy_tree')
+        >>> next_question = policy.next_question(state)
+        >>> if next_question is None:
+        ...     next_question = opt_step(...)
+    """
+    def __init__(self, a_hist=0, tag=None):
+        """
+        Args:
+            a_hist (default 0): importance of the history filters used to build the tree
+            tag (default None): description of the tables the tree was built on
+        """
+        self.a_hist = a_hist
+        self.tag = tag
+        self.questions = []     # question asked at each node
+        self.probas = []        # probability of reaching each node
+        self.children = {}      # (node, answers key) -> child node
+
+    def __len__(self):
+        return len(self.questions)
+
+    def add_node(self, question, proba, parent=-1, answers=None):
+        """ Adds the decision of a state.
+        Args:
+            question: question to ask in this state
+            proba: probability of reaching the state
+            parent (default -1): node of the previous state, -1 for the root
+            answers (default None): answers given to the question of parent
+        Returns:
+            node: index of the new node
+        """
+        node = len(self.questions)
+        self.questions.append(int(question))
+        self.probas.append(proba)
+        if parent >= 0:
+            self.children[(parent, answers_key(answers))] = node
+        return node
+
+    def next_question(self, state):
+        """ Follows the state from the root of the tree.
+        Args:
+            state: {question1: answers1, question2: answers2, ...} in the order the questions were asked
+        Returns:
+            next_question: question to ask, None if the state is not in the tree
+        """
+        if len(self.questions) == 0:
+            return None
+        node = 0
+        for q, answers in state.items():
+            if int(float(q)) != self.questions[node]:
+                return None
+            node = self.children.get((node, answers_key(answers)))
+            if node is None:
+                return None
+        return self.questions[node]
+
+    def save(self, filename):
+        """ Saves the tree as arrays to filename.pkl. """
+        edges = list(self.children.items())
+        save_obj({"a_hist": self.a_hist,
+                  "tag": self.tag,
+                  "questions": np.asarray(self.questions, dtype=np.int64),
+                  "probas": np.asarray(self.probas),
+                  "edge_parent": np.asarray([e[0][0] for e in edges], dtype=np.int32),
+                  "edge_answers": [e[0][1] for e in edges],
+                  "edge_child": np.asarray([e[1] for e in edges], dtype=np.int32)}, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """ Loads a tree saved with save. """
+        saved = load_obj(filename)
+        tree = cls(saved["a_hist"], saved["tag"])
+        tree.questions = saved["questions"].tolist()
+        tree.probas = saved["probas"].tolist()
+        tree.children = dict(zip(zip(saved["edge_parent"].tolist(), saved["edge_answers"]),
+                                 saved["edge_child"].tolist()))
+        return tree
+
+
+def build_policy_tree(product_set, traffic_set, purchased_set, threshold, catalog,
+                      a_hist=0, df_history=0, max_nodes=1000, max_answers=None, min_proba=0.0,
+                      pool=None, tag=None):
+    """ Expands the MaxMI decision tree, the most probable states first.
+    Args:
+        product_set: product table [ProductId, BrandId, ProductTypeId, PropertyValue,
+                                    PropertyDefinitionId, PropertyDefinitionOptionId, answer]
+        traffic_set: traffic table [SessionId, answers_selected, Items_ProductId]
+        purchased_set: purchased table [ProductId, UserId, OrderId, SessionId,
+                                        Items_ProductId, Items_ItemCount]
+        threshold: max length of final set of products
+        catalog: compiled catalog (see utils.catalog_index.CatalogIndex)
+        a_hist (default 0): importance of the history filters
+        df_history (default 0): history table [ProductId, text, frequency]
+        max_nodes (default 1000): number of decisions computed (budget of the tree)
+        max_answers (default None): number of most probable answers expanded per node, all if None
+        min_proba (default 0.0): states less probable than min_proba are not expanded
+        pool (default None): persistent worker pool used by opt_step (see utils.mi_pool.MaxMIPool)
+        tag (default None): description of the tables, stored in the tree
+    Returns:
+        tree: PolicyTree
+    """
+    tree = PolicyTree(a_hist, tag)
+    # traffic table exploded once, the answer histograms follow the expanded states
+    history = mi_kernel.TrafficHistory(catalog, traffic_set)
+    histograms = None
+    if pool is None:
+        histograms = mi_kernel.AnswerHistograms(catalog, catalog.purchase_counts(purchased_set), history=history)
+    # heap of the states to expand: (-proba, counter, mask, questions asked, parent node, answers)
+    heap = [(-1.0, 0, catalog.mask_of(product_set["ProductId"].values), [], -1, None)]
+    counter = 1
+    while heap and len(tree) < max_nodes:
+        neg_proba, _, mask, asked, parent, answers = heapq.heappop(heap)
+        question_set = set(catalog.questions(mask)).difference(asked)
+        if catalog.count(mask) < threshold or len(question_set) == 0:
+            # the algorithm stops in this state
+            continue
+        traffic = catalog.restrict(traffic_set, mask)
+        purchased = catalog.restrict(purchased_set, mask)
+        question = opt_step(question_set, product_set, traffic, purchased, a_hist, df_history,
+                            catalog, mask, pool=pool, histograms=histograms)
+        node = tree.add_node(question, -neg_proba, parent, answers)
+        print("Node {}: question {} (proba {:.4f})".format(node, question, -neg_proba))
+
+        # children: the most probable answers to the question
+        proba_A = algo_utils.get_proba_A_distribution_index(question, catalog, mask, traffic,
+                                                            history=history)["final_proba"]
+        proba_A = proba_A.sort_values(ascending=False, kind='stable')
+        if max_answers is not None:
+            proba_A = proba_A[:max_answers]
+        for answer, p in zip(proba_A.index, proba_A.values):
+            child_proba = -neg_proba * p
+            if child_proba < min_proba:
+                continue
+            child_answers = ['idk'] if answer == 'idk' else [answer]
+            heapq.heappush(heap, (-child_proba, counter, catalog.select(mask, question, child_answers),
+                                  asked + [question], node, child_answers))
+            counter += 1
+    return tree
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--nodes", help="number of decisions in the tree", type=int)
+    parser.add_argument("-a", "--a_hist",
+                        help="alpha parameter, the bigger it is the more importance is given to history, 0 means no history", type=float)
+    parser.add_argument("-t", "--threshold", help="max length of final set of products", type=int)
+    parser.add_argument("-o", "--output", help="file of the policy tree (without .pkl)", type=str)
+    args = parser.parse_args()
+    max_nodes = args.nodes if args.nodes else 1000
+    a_hist = args.a_hist if args.a_hist else 0.0
+    threshold = args.threshold if args.threshold else 50
+    output = args.output if args.output else '../data/policy_tree'
+
+    store = ArtifactStore('../data')
+    try:
+        products_cat = store['products_table']
+        traffic_cat = store['traffic_table']
+        purchased_cat = store['purchased_table']
+        question_text_df = store['question_text_df']
+        print("Loaded datsets")
+    except:
+        print("The dataset is not found...")
+
+    df_history = 0
+    if a_hist > 0:
+        try:
+            df_history = store['df_history']
+        except:
+            df_history = algo_utils.create_history(traffic_cat, question_text_df)
+            store.save('df_history', df_history)
+            print("Created history")
+
+    catalog = CatalogIndex(products_cat, purchased_cat)
+    start_time = time.time()
+    tree = build_policy_tree(products_cat, traffic_cat, purchased_cat, threshold, catalog,
+                             a_hist, df_history, max_nodes,
+                             tag=tables_tag(catalog, len(traffic_cat), len(purchased_cat),
+                                            store['df_history'] if 'df_history' in store else None))
+    tree.save(output)
+    print("Saved {} decisions to {} in {}s.".format(len(tree), output, time.time() - start_time))
@@ -13,6 +13,7 @@ import numpy as np
 import pandas as pd
 
 from utils.load_utils import *
+from utils.artifact_store import ArtifactStore
 from utils.init_dataframes import init_df
 import utils.algo_utils as algo_utils
 import utils.build_answers_utils as build_answers_utils
@@ -21,7 +22,7 @@ import utils.sampler as sampler
 
 def random_baseline(product_set, traffic_set, purchased_set, 
                     question_text_df, answer_text_df,
-                    threshold, y, answers_y):
+                    threshold, y, answers_y, catalog=None):
     """Random baseline algorithm.
     Note: 
         at each timestep sample randomly one question among the remaining questions.
@@ -35,6 +36,8 @@ def random_baseline(product_set, traffic_set, purchased_set,
         threshold: stopping criteria of the algorithm
         y: target product
         answers_y: sampled answers for target product
+        catalog (default None): compiled catalog (see utils.catalog_index.CatalogIndex), if given
+                                the products are filtered on the catalog index instead of product_set
 
     Returns:
         final_question_list: final list of asked questionsIds
@@ -43,6 +46,8 @@ def random_baseline(product_set, traffic_set, purchased_set,
         final_question_text_list: final list of asked question (string)
         answer_text_list: final list of given answers (as string)
     """
+    if catalog is not None:
+        mask = catalog.mask_of(product_set["ProductId"].values)
     question_set = set(product_set["PropertyDefinitionId"].values)
     quest_answer_y = answers_y
     final_question_list=[]
@@ -61,28 +66,36 @@ def random_baseline(product_set, traffic_set, purchased_set,
         answer_text = build_answers_utils.answer_id_to_text(answer, next_question, answer_text_df)
         print("RDM: Answer given was: {}".format(answer))
         print("RDM: Answer was: {}".format(answer_text))
-        product_set, traffic_set, purchased_set = algo_utils.select_subset(
-                                                        question=int(next_question),
-                                                        answer=answer,
-                                                        product_set=product_set,
-                                                        traffic_set=traffic_set,
-                                                        purchased_set = purchased_set)
-        question_set_new = set(product_set["PropertyDefinitionId"].values) 
+        if catalog is not None:
+            mask = catalog.select(mask, next_question, answer)
+            question_set_new = set(catalog.questions(mask))
+            distinct_products = catalog.count(mask)
+        else:
+            product_set, traffic_set, purchased_set = algo_utils.select_subset(
+                                                            question=int(next_question),
+                                                            answer=answer,
+                                                            product_set=product_set,
+                                                            traffic_set=traffic_set,
+                                                            purchased_set = purchased_set)
+            question_set_new = set(product_set["PropertyDefinitionId"].values)
+            distinct_products = len(product_set.ProductId.unique())
         question_set = question_set_new.difference(final_question_list)
-        distinct_products = len(product_set.ProductId.unique())
         print('RDM: There are still {} products to choose from'.format(distinct_products))
+    if catalog is not None:
+        product_set = catalog.product_table(mask)
     return final_question_list, product_set, y, final_question_text_list, answer_text_list
 
 
 
 if __name__=='__main__':
     """ Just for testing purposes; """
+    store = ArtifactStore('../data')
     try:
-        products_cat = load_obj('../data/products_table')
-        traffic_cat = load_obj('../data/traffic_table')
-        purchased_cat = load_obj('../data/purchased_table')
-        question_text_df = load_obj('../data/question_text_df')
-        answer_text_df = load_obj('../data/answer_text')
+        products_cat = store['products_table']
+        traffic_cat = store['traffic_table']
+        purchased_cat = store['purchased_table']
+        question_text_df = store['question_text_df']
+        answer_text_df = store['answer_text']
         print("Loaded datsets")
     except:
         print("Creating datasets...")
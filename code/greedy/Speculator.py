@@ -0,0 +1,102 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+This module defines the speculative precomputation of the next questions.
+
+While the user reads a question and selects the answers, the next question
+is computed in background threads for the most likely answers. The results
+are kept for a short time in a cache keyed by state, so that the next
+question is ready when the user presses "Next" with one of these answers.
+"""
+
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.decision_cache import state_key
+
+
+class Speculator(object):
+    """ Background computation of the next question for the likely answers.
+
+    Example:
+        >>> speculator = Speculator(max_workers=2)
+        >>> speculator.speculate(state, question, proba_A, compute)
+        >>> ...  # the user answers
+        >>> next_question = speculator.get(state)   # None if not speculated
+        >>> speculator.stats()
+    """
+    def __init__(self, max_workers=2, max_answers=3, ttl=60.0):
+        """
+        Args:
+            max_workers (default 2): number of background threads
+            max_answers (default 3): number of most likely answers speculated per question
+            ttl (default 60.0): seconds after which a speculated question is dropped
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_answers = max_answers
+        self.ttl = ttl
+        self._futures = {}      # state key -> (submission time, future)
+        self.hits = 0
+        self.misses = 0
+        self.submitted = 0
+        self.wasted = 0         # speculations never used
+
+    def speculate(self, state, question, proba_A, compute):
+        """ Starts computing the next question for the most likely answers to question.
+        The speculations of the previous question that were not used are dropped.
+        Args:
+            state: {question1: answers1, ...} before answering question
+            question: question shown to the user
+            proba_A: probability of each answer to question, indexed by answer
+                     ('idk' included, see algo_utils.get_proba_A_distribution_none)
+            compute: function computing the next question from the answers given to question
+        """
+        self._drop_all()
+        for answer in proba_A.sort_values(ascending=False, kind='stable').index[:self.max_answers]:
+            answers = ['idk'] if answer == 'idk' else [answer]
+            child_state = dict(state)
+            child_state[question] = answers
+            self._futures[state_key(child_state)] = (time.time(), self.executor.submit(compute, answers))
+            self.submitted += 1
+
+    def get(self, state):
+        """ Returns the speculated next question for state (waiting for it if it is still
+        being computed), None if state was not speculated, has expired or gave no question
+        (e.g. the child state is below the threshold). """
+        entry = self._futures.pop(state_key(state), None)
+        next_question = None
+        if entry is not None and time.time() - entry[0] <= self.ttl:
+            next_question = entry[1].result()
+        if next_question is None:
+            self.misses += 1
+            if entry is not None:
+                self.wasted += 1
+            return None
+        self.hits += 1
+        return next_question
+
+    def _drop_all(self):
+        """ Cancels (or forgets) the pending speculations and counts them as wasted. """
+        for _, future in self._futures.values():
+            future.cancel()
+            self.wasted += 1
+        self._futures = {}
+
+    def stats(self):
+        """ Returns a dict with the hits, misses, hit rate, submitted and wasted speculations. """
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / float(total) if total > 0 else 0.0,
+                "submitted": self.submitted,
+                "wasted": self.wasted}
+
+    def close(self):
+        """ Drops the pending speculations and stops the threads. """
+        self._drop_all()
+        self.executor.shutdown(wait=False)
@@ -4,7 +4,7 @@ Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
 This file defines the interactive user interface.
 
 You can choose to use dagger or maxMI the algorithm
-that computes the next question. By default it uses 
+that computes the next question (-algo option). By default it uses 
 our best dagger trained dagger model in the backend.
 It assumes the best dagger model is saved in the 
 'default' subfolder of the 'training_dagger' folder.
@@ -25,16 +25,21 @@ import random as rd
 from PIL import Image
 
 
-from utils.load_utils import load_obj, save_obj
+from utils.artifact_store import ArtifactStore
 from utils.sampler import sample_answers
+from utils.catalog_index import CatalogIndex
+from utils.decision_cache import tables_tag
 import utils.algo_utils as algo_utils
 import dagger.dagger_utils as dagger_utils
 import utils.build_answers_utils as build_answers_utils
 
 from utils.sampler import sample_answers
-from greedy.MaxMI_Algo import max_info_algorithm, opt_step
+from greedy.MaxMI_Algo import max_info_algorithm, opt_step, deadline_opt_step
+from utils.mi_kernel import AnswerHistograms, TrafficHistory
 from utils.build_answers_utils import question_id_to_text, answer_id_to_text, process_answers_filter
 from greedy.RandomBaseline import random_baseline
+from greedy.PolicyTree import PolicyTree
+from greedy.Speculator import Speculator
 from dagger.model import create_model
 
 # To remove future warning from being printed out
@@ -44,8 +49,8 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 class MyApplication(Frame):
     """ This class defines the Tkinter application
     """
-    def __init__(self, product_set, traffic_set, purchased_set, question_text_df, answer_text_df, threshold, filters_def_dict, type_filters):
-        self.use='dagger'
+    def __init__(self, product_set, traffic_set, purchased_set, question_text_df, answer_text_df, threshold, filters_def_dict, type_filters, catalog=None, policy=None, time_budget=None, speculate_workers=0, use='dagger'):
+        self.use=use
         # load the trained model if necessary
         if self.use=='dagger':
             run = 'default'
@@ -56,7 +61,7 @@ class MyApplication(Frame):
             self.number_filters = len(filters_def_dict.keys())
             self.model = create_model(self.number_filters, self.length_state)
             self.model.load_weights(checkpoint_model)
-            self.state = {}
+        self.state = {}
 
         # include all necessary data
         self.product_set = product_set
@@ -69,6 +74,23 @@ class MyApplication(Frame):
         self.type_filters = type_filters
         self.final_question_list = []
         self.question_set = set(algo_utils.get_questions(self.product_set))
+        # compiled catalog: the remaining products are stored as a mask
+        self.catalog = catalog
+        self.mask = None
+        if self.catalog is not None:
+            self.mask = self.catalog.mask_of(self.product_set["ProductId"].values)
+        # offline-compiled MaxMI decisions (see greedy/PolicyTree.py)
+        self.policy = policy
+        # latency budget of a MaxMI step in seconds (None to score every question)
+        self.time_budget = time_budget
+        self.histograms = None
+        if self.catalog is not None and self.time_budget is not None:
+            self.histograms = AnswerHistograms(self.catalog, self.catalog.purchase_counts(self.purchased_set), self.mask,
+                                               history=TrafficHistory(self.catalog, self.traffic_set))
+        # next questions computed in background while the user answers
+        self.speculator = None
+        if self.catalog is not None and speculate_workers > 0:
+            self.speculator = Speculator(max_workers=speculate_workers)
 
         self.root = Tk()
         self.root.title("User Interface - Max_MI algo Test")
@@ -87,12 +109,7 @@ class MyApplication(Frame):
         
         # get first question
         if self.use=='maxMI':
-            self.next_question = opt_step(self.question_set, 
-                                     self.product_set, 
-                                     self.traffic_set, 
-                                     self.purchased_set, 
-                                     a_hist=1, 
-                                     df_history=df_history)
+            self.next_question = self.get_next_question_maxMI()
         else:
             self.next_question = dagger_utils.dagger_one_step(self.model, self.state, self.number_filters, self.filters_def_dict)
 
@@ -103,7 +120,7 @@ class MyApplication(Frame):
 
 
         # multiple choice list of answers
-        self.answer_set = self.product_set.loc[self.product_set["PropertyDefinitionId"] == int(self.question.get()), "answer"].drop_duplicates().values
+        self.answer_set = self.get_answer_set()
         print("answer set: {}".format(self.answer_set))
         print("answer set: {}".format(type(self.answer_set)))
         print('int(self.question.get()): {}'.format(int(self.question.get())))
@@ -123,7 +140,7 @@ class MyApplication(Frame):
 
 
         # Labels
-        self.nb_product_left = len(self.product_set["ProductId"].unique())
+        self.nb_product_left = self.get_nb_product_left()
         self.nb_question_asked = 1
         self.product_left = StringVar()
         self.product_left.set('Nb products left {}'.format(self.nb_product_left))
@@ -136,6 +153,7 @@ class MyApplication(Frame):
 
         # Main button Next question
         self.NextButton = ttk.Button(self.mainframe, text="Next", command=self.next).grid(column=7, row=6, sticky=W)
+        self.speculate()
 
 
 
@@ -162,12 +180,17 @@ class MyApplication(Frame):
         print(self.state)
         print("self.question.get(): {}".format(self.question.get()))
         # Updating product_set, traffic_set, purchased_set, answer_set and question set
-        self.product_set, self.traffic_set, self.purchased_set = algo_utils.select_subset(question=self.question.get(), answer=values, product_set=self.product_set, traffic_set=self.traffic_set, purchased_set=self.purchased_set)
-        self.question_set = set(algo_utils.get_questions(self.product_set))
+        if self.catalog is not None:
+            self.mask = self.catalog.select(self.mask, self.question.get(), values)
+            self.traffic_set = self.catalog.restrict(self.traffic_set, self.mask)
+            self.purchased_set = self.catalog.restrict(self.purchased_set, self.mask)
+            question_set_new = set(self.catalog.questions(self.mask))
+        else:
+            self.product_set, self.traffic_set, self.purchased_set = algo_utils.select_subset(question=self.question.get(), answer=values, product_set=self.product_set, traffic_set=self.traffic_set, purchased_set=self.purchased_set)
+            print("Length Product set: {}".format(len(self.product_set)))
+            question_set_new = set(algo_utils.get_questions(self.product_set))
 
         self.final_question_list.append(int(self.question.get()))
-        print("Length Product set: {}".format(len(self.product_set)))
-        question_set_new = set(algo_utils.get_questions(self.product_set))
         print("Length Question set new: {}".format(len(question_set_new)))
         print("Length Final question list: {}".format(len(self.final_question_list)))
         self.question_set = question_set_new.difference(self.final_question_list)
@@ -175,12 +198,7 @@ class MyApplication(Frame):
 
         # Getting next question from our algo's opt_step
         if self.use=='maxMI':
-            self.next_question = opt_step(self.question_set, 
-                                     self.product_set, 
-                                     self.traffic_set, 
-                                     self.purchased_set, 
-                                     a_hist=1, 
-                                     df_history=df_history)
+            self.next_question = self.get_next_question_maxMI()
         else:
             self.next_question = dagger_utils.dagger_one_step(self.model, self.state, 
                                                          self.number_filters, self.filters_def_dict)
@@ -194,7 +212,7 @@ class MyApplication(Frame):
         self.title.set("Question {}".format(self.nb_question_asked))
 
         # Updating number of products left
-        self.nb_product_left = len(self.product_set["ProductId"].unique())
+        self.nb_product_left = self.get_nb_product_left()
         self.product_left.set('Nb products left {}'.format(self.nb_product_left))
 
         # Updating question asked and question set
@@ -202,18 +220,18 @@ class MyApplication(Frame):
         self.question_text.set(next_question_text)
 
         # Getting the answers
-        self.answer_set = self.product_set.loc[self.product_set["PropertyDefinitionId"] == int(self.question.get()), "answer"].drop_duplicates().values
+        self.answer_set = self.get_answer_set()
         self.text_answers = build_answers_utils.answer_id_to_text(self.answer_set, int(self.question.get()), self.answer_text_df)
         
         # If number of products lower than threshold, display final set of products
-        print("Number products left: {}".format(len(self.product_set["ProductId"].drop_duplicates())))
-        if (len(self.product_set["ProductId"].unique()) < self.threshold) or (len(self.text_answers)==1):
+        print("Number products left: {}".format(self.nb_product_left))
+        if (self.nb_product_left < self.threshold) or (len(self.text_answers)==1):
             print("Threshold reached")
             win = Toplevel(self.root)
             win.title('Here is what we can offer you!')
             self.title.set("----   Your final Product Set   ----")
             self.titleLabel = ttk.Label(win, textvariable=self.title, font=("Helvetica", 18)).grid(column=2, row=1, columnspan=10,sticky=(W, E))
-            self.final_productsLabel = ttk.Label(win, text="\n".join(map(str, self.product_set['ProductId'].unique()))) \
+            self.final_productsLabel = ttk.Label(win, text="\n".join(map(str, self.get_final_products()))) \
                                                 .grid(column=2, row=4,columnspan=3, sticky=(W, E))
             self.quit()
             return 1
@@ -231,35 +249,134 @@ class MyApplication(Frame):
         listbox.select_set(0)  # sets the first element
         self.answerList = listbox
         self.answerList.grid(column=2, row=6, columnspan=5, sticky=W)
-        self.answer_set = self.product_set.loc[self.product_set["PropertyDefinitionId"] == int(float(self.question.get())), "answer"].drop_duplicates().values.astype(float)
+        self.answer_set = self.get_answer_set().astype(float)
+        self.speculate()
+
+    def get_next_question_maxMI(self):
+        """ Returns the next question of the policy tree, computed with opt_step outside of the tree
+        (within the time budget if one is given). """
+        next_question = self.policy.next_question(self.state) if self.policy is not None else None
+        if next_question is None and self.speculator is not None:
+            next_question = self.speculator.get(self.state)
+        if next_question is None and self.time_budget is not None:
+            next_question, _ = deadline_opt_step(self.question_set,
+                                                 self.product_set,
+                                                 self.traffic_set,
+                                                 self.purchased_set,
+                                                 self.time_budget,
+                                                 a_hist=1,
+                                                 df_history=df_history,
+                                                 catalog=self.catalog,
+                                                 mask=self.mask,
+                                                 histograms=self.histograms)
+        elif next_question is None:
+            next_question = opt_step(self.question_set, 
+                                     self.product_set, 
+                                     self.traffic_set, 
+                                     self.purchased_set, 
+                                     a_hist=1, 
+                                     df_history=df_history,
+                                     catalog=self.catalog,
+                                     mask=self.mask)
+        return next_question
+
+    def speculate(self):
+        """ Starts computing the next question for the most likely answers to the current question. """
+        if self.use != 'maxMI' or self.speculator is None:
+            return
+        question = self.question.get()
+        mask, traffic_set, purchased_set = self.mask, self.traffic_set, self.purchased_set
+        asked = self.final_question_list + [int(question)]
+        catalog = self.catalog
+
+        def compute(answers):
+            child_mask = catalog.select(mask, question, answers)
+            question_set = set(catalog.questions(child_mask)).difference(asked)
+            if catalog.count(child_mask) < self.threshold or len(question_set) == 0:
+                return None
+            return opt_step(question_set,
+                            self.product_set,
+                            catalog.restrict(traffic_set, child_mask),
+                            catalog.restrict(purchased_set, child_mask),
+                            a_hist=1,
+                            df_history=df_history,
+                            catalog=catalog,
+                            mask=child_mask,
+                            mode='batch')
+
+        proba_A = algo_utils.get_proba_A_distribution_index(question, catalog, mask, traffic_set)["final_proba"]
+        self.speculator.speculate(self.state, question, proba_A, compute)
+
+    def get_answer_set(self):
+        """ Returns the possible answers to the current question among the remaining products. """
+        if self.catalog is not None:
+            return self.catalog.answer_set(self.mask, self.question.get())
+        return self.product_set.loc[self.product_set["PropertyDefinitionId"] == int(float(self.question.get())), "answer"].drop_duplicates().values
+
+    def get_nb_product_left(self):
+        """ Returns the number of remaining products. """
+        if self.catalog is not None:
+            return self.catalog.count(self.mask)
+        return len(self.product_set["ProductId"].unique())
+
+    def get_final_products(self):
+        """ Returns the ProductIds of the remaining products. """
+        if self.catalog is not None:
+            return self.catalog.products(self.mask)
+        return self.product_set['ProductId'].unique()
 
     def run(self):
         self.root.mainloop()
 
     def quit(self):
+        if self.speculator is not None:
+            print("Speculation: {}".format(self.speculator.stats()))
+            self.speculator.close()
         self.mainframe.destroy()
 
 if __name__ == '__main__':
     """ Run the application. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-algo", "--algo", help="which algo computes the next question choose 'maxMI' or 'dagger' (default)",
+                        type=str, choices=['maxMI', 'dagger'])
+    parser.add_argument("-b", "--budget", help="latency budget of a MaxMI step in seconds", type=float)
+    parser.add_argument("-sw", "--speculate", help="number of threads computing the next questions in advance", type=int)
+    args = parser.parse_args()
+    use = args.algo if args.algo else 'dagger'
+    time_budget = args.budget if args.budget else None
+    if time_budget is not None and use != 'maxMI':
+        print("The latency budget is only used by the maxMI algorithm (-algo maxMI)")
+    speculate_workers = args.speculate if args.speculate else 0
+    if speculate_workers > 0 and use != 'maxMI':
+        print("The speculation is only used by the maxMI algorithm (-algo maxMI)")
+
+    store = ArtifactStore('../data')
     try:
-        products_cat = load_obj('../data/products_table')
-        traffic_cat = load_obj('../data/traffic_table')
-        purchased_cat = load_obj('../data/purchased_table')
-        question_text_df = load_obj('../data/question_text_df')
-        answer_text_df = load_obj('../data/answer_text')
-        filters_def_dict = load_obj('../data/filters_def_dict')
-        type_filters = load_obj('../data/type_filters')
+        products_cat = store['products_table']
+        traffic_cat = store['traffic_table']
+        purchased_cat = store['purchased_table']
+        question_text_df = store['question_text_df']
+        answer_text_df = store['answer_text']
+        filters_def_dict = store['filters_def_dict']
+        type_filters = store['type_filters']
     except:
         print("Missing datasets...")
 
     try:
-        df_history = load_obj('../data/df_history')
+        df_history = store['df_history']
     except:
         df_history = algo_utils.create_history(traffic_cat, question_text_df)
-        save_obj(df_history, '../data/df_history')
+        store.save('df_history', df_history)
         print("Created history")
         print("Loaded datasets")
     threshold = 50
+    catalog = CatalogIndex(products_cat, purchased_cat)
+    policy = None
+    if os.path.exists('../data/policy_tree.pkl'):
+        policy = PolicyTree.load('../data/policy_tree')
+        if policy.a_hist != 1 or policy.tag != tables_tag(catalog, len(traffic_cat), len(purchased_cat), df_history):
+            print("The policy tree was built on other tables or parameters, ignoring it")
+            policy = None
     
     # Init application
     app = MyApplication(products_cat, 
@@ -269,6 +386,11 @@ if __name__ == '__main__':
                         answer_text_df,
                         threshold,
                         filters_def_dict,
-                        type_filters)
+                        type_filters,
+                        catalog,
+                        policy,
+                        time_budget,
+                        speculate_workers,
+                        use)
     # Start the application
     app.run()
\ No newline at end of file
@@ -0,0 +1,161 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+This module builds a small SQLite database with the tables of the Digitec
+database used by the extraction (product_purchase, product_only_ids,
+traffic, product), to run the preprocessing without the server, and small
+preprocessed tables to test the algorithms.
+
+Example:
+    >>> make_database('/tmp/digitec.db')
+    >>> init_df('/tmp/data', url='sqlite:////tmp/digitec.db')
+    >>> products_cat, traffic_cat, purchased_cat = make_tables()
+"""
+import os.path
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# Questions of the products: an option, a value and a second option
+QUESTIONS = [(30, 'option'), (10, 'option'), (20, 'value')]
+BRANDS = ['Acer', 'Apple', 'Asus', 'Dell', 'Lenovo']
+
+
+def make_database(filename, n_products=60, n_orders=400, seed=0):
+    """ Creates the database.
+    Args:
+        filename: SQLite file
+        n_products (default 60): number of products, the first two thirds in category 6
+        n_orders (default 400): number of orders (OrderId 1 to n_orders)
+        seed (default 0): seed of the random content
+    """
+    rng = np.random.RandomState(seed)
+    connection = sqlite3.connect(filename)
+    connection.executescript('''
+    CREATE TABLE product_purchase ("UserId" INTEGER, "OrderId" INTEGER, "SessionId" INTEGER,
+                                   "Items_ProductId" INTEGER, "Items_ItemCount" INTEGER, "Timestamp" TEXT);
+    CREATE TABLE product_only_ids ("ProductId" INTEGER, "BrandId" INTEGER, "ProductTypeId" INTEGER,
+                                   "PropertyValue" REAL, "PropertyDefinitionId" INTEGER,
+                                   "PropertyDefinitionOptionId" REAL);
+    CREATE TABLE traffic ("RequestUrl" TEXT, "Timestamp" TEXT, "SessionId" INTEGER);
+    CREATE TABLE product ("ProductId" INTEGER, "ProductTypeId" INTEGER, "PropertyDefinition" TEXT,
+                          "PropertyDefinitionId" INTEGER, "PropertyDefinitionOption" TEXT,
+                          "PropertyDefinitionOptionId" REAL);
+    ''')
+    rows = []
+    for p in range(1, n_products + 1):
+        brand = int(rng.randint(1, len(BRANDS) + 1))
+        category = 6 if p <= n_products * 2 // 3 else 7
+        for question, kind in QUESTIONS:
+            if kind == 'value':
+                row = (p, brand, category, float(rng.randint(1, 50)), question, None)
+            else:
+                row = (p, brand, category, None, question, float(question * 10 + rng.randint(0, 4)))
+            rows.append(row)
+            # the catalog repeats some properties of a product
+            if rng.rand() < 0.2:
+                rows.append(row)
+    connection.executemany('INSERT INTO product_only_ids VALUES (?,?,?,?,?,?)', rows)
+    connection.executemany('INSERT INTO product VALUES (?,?,?,?,?,?)',
+                           [(p, c, 'Question {}'.format(q), q, None if o is None else 'Option {}'.format(int(o)), o)
+                            for (p, b, c, v, q, o) in rows])
+    connection.commit()
+    connection.close()
+    add_orders(filename, 1, n_orders, n_products, seed)
+
+
+def add_orders(filename, first, last, n_products=60, seed=1):
+    """ Adds the orders first to last (OrderId), with the traffic of their sessions.
+    Args:
+        filename: SQLite file created by make_database
+        first: first OrderId
+        last: last OrderId
+        n_products (default 60): number of products of the database
+        seed (default 1): seed of the random content
+    """
+    rng = np.random.RandomState(seed)
+    purchases = []
+    traffic = []
+    for order in range(first, last + 1):
+        session = 1000 + order
+        day = '2018-10-{:02d}'.format(1 + order % 28)
+        purchases.append((int(rng.randint(1, 50)), order, session, int(rng.randint(1, n_products + 1)),
+                          int(rng.randint(1, 3)), day))
+        # orders of several products are not used
+        if rng.rand() < 0.3:
+            purchases.append((1, order, session, int(rng.randint(1, n_products + 1)), 1, day))
+        for _ in range(rng.randint(0, 3)):
+            traffic.append(('pdo=1-10:{}'.format(100 + rng.randint(0, 4)), day, session))
+            traffic.append(('pdo=1-30:{}'.format(300 + rng.randint(0, 4)), day, session))
+            traffic.append(('/en/s1/producttype/notebook-6?nothing=1', day, session))
+    connection = sqlite3.connect(filename)
+    connection.executemany('INSERT INTO product_purchase VALUES (?,?,?,?,?,?)', purchases)
+    connection.executemany('INSERT INTO traffic VALUES (?,?,?)', traffic)
+    connection.commit()
+    connection.close()
+
+
+def write_brands(folder):
+    """ Writes the brands.csv file read by init_df to folder. """
+    with open(os.path.join(folder, 'brands.csv'), 'w') as f:
+        f.write('BrandId,Name\n')
+        for i, name in enumerate(BRANDS):
+            f.write('{},{}\n'.format(i + 1, name))
+
+
+def make_tables(n_products=60, n_questions=8, n_sessions=120, seed=0):
+    """ Builds preprocessed tables (as loaded by load_dataframes) with the cases the
+    algorithms have to handle: missing (NaN) answers, products with several answers
+    or duplicated rows, questions without answer for some products, a question
+    splitting the products as another one, identical products and unsold products.
+    Args:
+        n_products (default 60): number of products
+        n_questions (default 8): number of questions (PropertyDefinitionId 100 to 100 + n_questions - 1)
+        n_sessions (default 120): number of sessions of the traffic and purchased tables
+        seed (default 0): seed of the random content
+    Returns:
+        products_cat: product table [ProductId, BrandId, ProductTypeId, PropertyValue,
+                                     PropertyDefinitionId, PropertyDefinitionOptionId, answer]
+        traffic_cat: traffic table [SessionId, answers_selected, Items_ProductId]
+        purchased_cat: purchased table [ProductId, UserId, OrderId, SessionId,
+                                        Items_ProductId, Items_ItemCount]
+    """
+    rng = np.random.RandomState(seed)
+    questions = list(range(100, 100 + n_questions))
+    rows = []
+    for p in range(1, n_products + 1):
+        # the last products copy the answers of the first ones
+        source = p - n_products + 5 if p > n_products - 5 else p
+        answers = {}
+        for k, q in enumerate(questions[:-1]):
+            r = np.random.RandomState(seed * 1000 + source * 10 + k).rand(3)
+            if r[0] < 0.1:
+                continue
+            first = np.nan if r[1] < 0.1 else float(int(r[1] * 100) % (k + 2))
+            answers[q] = [first] + ([float(k + 2)] if r[2] < 0.15 else []) + ([first] if r[2] > 0.9 else [])
+        # the last question is a renaming of the first one
+        if questions[0] in answers:
+            answers[questions[-1]] = [a + 50 for a in answers[questions[0]]]
+        for q, values in answers.items():
+            for a in values:
+                rows.append((p, 1 + p % 3, 6, np.nan, q, a, a))
+    products_cat = pd.DataFrame(rows, columns=["ProductId", "BrandId", "ProductTypeId", "PropertyValue",
+                                               "PropertyDefinitionId", "PropertyDefinitionOptionId", "answer"])
+
+    # the copied products and their sources are never sold (same class in a compressed catalog)
+    sold = rng.randint(6, n_products - 4, n_sessions)
+    purchased_cat = pd.DataFrame({"ProductId": sold, "UserId": rng.randint(1, 20, n_sessions),
+                                  "OrderId": np.arange(n_sessions), "SessionId": 1000 + np.arange(n_sessions),
+                                  "Items_ProductId": sold, "Items_ItemCount": rng.randint(1, 3, n_sessions)})
+    selected = []
+    for p in sold:
+        r_dict = {}
+        for q in rng.choice(questions, size=rng.randint(1, 4), replace=False):
+            given = products_cat.loc[(products_cat["ProductId"] == p) & (products_cat["PropertyDefinitionId"] == q),
+                                     "answer"].dropna().values
+            # the true answer, an other answer or an answer unknown to the catalog
+            r_dict[str(q)] = [str(a) for a in given[:1]] + [str(rng.choice([0.0, 1.0, 999.0]))]
+        selected.append(r_dict)
+    traffic_cat = pd.DataFrame({"SessionId": purchased_cat["SessionId"].values, "answers_selected": selected,
+                                "Items_ProductId": sold})
+    return products_cat, traffic_cat, purchased_cat
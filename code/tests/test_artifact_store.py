@@ -0,0 +1,53 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+Tests of the artifact store (utils/artifact_store.py).
+
+Usage:
+    python -m pytest code/tests
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.artifact_store import ArtifactStore
+
+
+class Interrupted(Exception):
+    pass
+
+
+def table(first, last):
+    return pd.DataFrame({"OrderId": np.arange(first, last), "answers_selected": [{'1': ['2']}] * (last - first)})
+
+
+def test_interrupted_append_keeps_the_table(tmp_path, monkeypatch):
+    store = ArtifactStore(str(tmp_path))
+    store.save('purchased_table', table(0, 10))
+    assert isinstance(store.column('purchased_table', 'OrderId'), np.memmap)
+
+    # the table saved as a whole is converted to parts: interrupted while writing the new part
+    save = ArtifactStore.save
+
+    def interrupted_save(self, name, obj):
+        if name.startswith('part_'):
+            raise Interrupted()
+        save(self, name, obj)
+    with monkeypatch.context() as patch:
+        patch.setattr(ArtifactStore, 'save', interrupted_save)
+        with pytest.raises(Interrupted):
+            store.append('purchased_table', table(10, 15))
+    store = ArtifactStore(str(tmp_path))
+    assert store.manifest('purchased_table')["kind"] == "frame"
+    pd.testing.assert_frame_equal(store.load('purchased_table'), table(0, 10))
+
+    store.append('purchased_table', table(10, 15))
+    store.append('purchased_table', table(15, 20))
+    assert store.manifest('purchased_table')["parts"] == 3
+    assert store.length('purchased_table') == 20
+    pd.testing.assert_frame_equal(store.load('purchased_table'), table(0, 20))
@@ -0,0 +1,56 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+Tests of the definition of the new answers (utils/build_answers_utils.py).
+
+Usage:
+    python -m pytest code/tests
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import numpy as np
+import pandas as pd
+
+from utils.build_answers_utils import answer_definitions, create_categories, BIN_PERCENTILES
+
+
+def product_table(n_products=200, seed=0):
+    """ Products with an option, two binned values, a short value, a mixed and an empty filter. """
+    rng = np.random.RandomState(seed)
+    rows = []
+    for p in range(n_products):
+        rows.append((p, np.nan, 1.0, float(rng.randint(0, 5))))
+        rows.append((p, rng.rand() * 100, 2.0, np.nan))
+        rows.append((p, float(rng.randint(0, 1000)), 3.0, np.nan))
+        rows.append((p, float(rng.randint(0, 4)), 4.0, np.nan))
+        if p % 2:
+            rows.append((p, float(rng.randint(0, 3)), 5.0, np.nan))
+        else:
+            rows.append((p, np.nan, 5.0, float(rng.randint(50, 53))))
+        rows.append((p, np.nan, 6.0, np.nan))
+    df = pd.DataFrame(rows, columns=["ProductId", "PropertyValue", "PropertyDefinitionId",
+                                     "PropertyDefinitionOptionId"])
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def test_answer_definitions_match_the_filters():
+    df = product_table()
+    definitions = answer_definitions(df)
+    assert list(definitions.columns) == ["filter", "PropertyDefinitionId", "type", "answer"]
+    assert definitions["type"].dtype.name == 'category'
+    assert definitions["answer"].dtype == np.float64
+    types = definitions.groupby("PropertyDefinitionId", sort=True)["type"].first()
+    assert list(types.astype(str)) == ['option', 'bin', 'bin', 'value', 'mixed', 'no_answer']
+
+    filters_def_dict, type_filters = create_categories(df)
+    for f in [2.0, 3.0]:
+        values = df.loc[df["PropertyDefinitionId"] == f, "PropertyValue"].unique()
+        np.testing.assert_array_equal(filters_def_dict[str(f)], np.percentile(values, BIN_PERCENTILES))
+    options = df.loc[df["PropertyDefinitionId"] == 1.0, "PropertyDefinitionOptionId"].unique()
+    assert sorted(filters_def_dict['1.0']) == sorted(options)
+    assert filters_def_dict['5.0'].item() == set(df.loc[df["PropertyDefinitionId"] == 5.0, "PropertyValue"].dropna()) \
+        | set(df.loc[df["PropertyDefinitionId"] == 5.0, "PropertyDefinitionOptionId"].dropna())
+    assert type_filters['6.0'] == 'no_answer' and '6.0' not in filters_def_dict
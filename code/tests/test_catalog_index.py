@@ -0,0 +1,53 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+Tests of the compiled catalog (utils/catalog_index.py) against the
+DataFrame functions of utils/algo_utils.py.
+
+Usage:
+    python -m pytest code/tests
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import numpy as np
+import pytest
+
+from utils import algo_utils
+from utils.catalog_index import CatalogIndex
+from fixture_db import make_tables
+
+
+@pytest.fixture(params=[False, True], ids=['plain', 'compressed'])
+def tables(request):
+    products_cat, traffic_cat, purchased_cat = make_tables()
+    catalog = CatalogIndex(products_cat, purchased_cat if request.param else None)
+    return catalog, products_cat, traffic_cat, purchased_cat
+
+
+def test_select_matches_select_subset(tables):
+    catalog, products_cat, traffic_cat, purchased_cat = tables
+    assert products_cat["answer"].isnull().any()
+    rng = np.random.RandomState(0)
+    for question in catalog.question_ids:
+        answers = products_cat.loc[products_cat["PropertyDefinitionId"] == question, "answer"].drop_duplicates().values
+        for given in [answers[:1], answers, [np.nan], [1., np.nan, 0.], ['nan', '2.0'], [999.], ['idk']]:
+            mask = catalog.select(catalog.full_mask(), question, given)
+            product_set, traffic_set, purchased_set = algo_utils.select_subset(products_cat, traffic_cat, question,
+                                                                               given, purchased_cat)
+            assert sorted(catalog.products(mask)) == sorted(product_set["ProductId"].unique())
+            if not np.array_equal(['idk'], given):
+                assert len(catalog.restrict(traffic_cat, mask)) == len(traffic_set)
+                assert len(catalog.restrict(purchased_cat, mask)) == len(purchased_set)
+        # a second answer on the remaining products
+        given = rng.choice(answers, size=2)
+        mask = catalog.select(catalog.full_mask(), question, given)
+        product_set, _, _ = algo_utils.select_subset(products_cat, [], question, given)
+        other = catalog.question_ids[(catalog.question_index(question) + 1) % catalog.n_questions]
+        assert sorted(map(str, catalog.answer_set(mask, other))) == \
+            sorted(map(str, product_set.loc[product_set["PropertyDefinitionId"] == other, "answer"].unique()))
+        mask = catalog.select(mask, other, [np.nan])
+        product_set, _, _ = algo_utils.select_subset(product_set, [], other, [np.nan])
+        assert catalog.count(mask) == product_set["ProductId"].nunique()
@@ -0,0 +1,156 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+Tests of the streaming extraction (utils/sql_extract.py) and of the
+preprocessing (utils/init_dataframes.py) on a SQLite copy of the schema.
+
+Usage:
+    python -m pytest code/tests
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import init_dataframes
+from utils.artifact_store import ArtifactStore, ChunkWriter
+from fixture_db import make_database, write_brands
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(monkeypatch, n_commits):
+    """ Makes the extraction stop (as if killed) at the commit number n_commits + 1. """
+    commit = ChunkWriter.commit
+    done = [0]
+
+    def interrupted_commit(self, watermark):
+        if done[0] == n_commits:
+            raise Interrupted()
+        done[0] += 1
+        commit(self, watermark)
+    monkeypatch.setattr(ChunkWriter, 'commit', interrupted_commit)
+
+
+def assert_same(a, b):
+    """ Checks that two outputs of the preprocessing are identical. """
+    if isinstance(a, pd.DataFrame):
+        pd.testing.assert_frame_equal(a, b)
+    elif isinstance(a, dict):
+        assert list(a.keys()) == list(b.keys())
+        for key in a:
+            assert_same(a[key], b[key])
+    elif isinstance(a, np.ndarray) and a.shape == ():
+        assert a.item() == b.item()
+    elif isinstance(a, np.ndarray):
+        np.testing.assert_array_equal(a, b)
+    else:
+        assert a == b
+
+
+@pytest.fixture
+def database(tmp_path):
+    filename = str(tmp_path / 'digitec.db')
+    make_database(filename)
+    return filename
+
+
+def store_in(tmp_path, name):
+    folder = tmp_path / name
+    folder.mkdir()
+    write_brands(str(folder))
+    return ArtifactStore(str(folder), mmap_mode=None)
+
+
+def test_extraction_matches_sql(database, tmp_path):
+    store = store_in(tmp_path, 'data')
+    connection = init_dataframes.connect('sqlite:///' + database)
+    init_dataframes.extract_purchased(connection, store, chunksize=9)
+    init_dataframes.extract_products(connection, store, chunksize=7)
+    purchased = store.load('purchased_table')
+    init_dataframes.extract_traffic(connection, store, purchased, batch_size=20, chunksize=10)
+
+    raw = sqlite3.connect(database)
+    expected = pd.read_sql_query('''
+        SELECT p."Items_ProductId" AS "ProductId", p."UserId", p."OrderId", p."SessionId",
+               p."Items_ProductId", p."Items_ItemCount"
+        FROM product_purchase p
+        WHERE p."OrderId" IN (SELECT "OrderId" FROM product_purchase GROUP BY "OrderId"
+                              HAVING count(distinct "Items_ProductId") = 1)
+          AND p."Items_ProductId" IN (SELECT "ProductId" FROM product_only_ids WHERE "ProductTypeId" = 6)
+        ORDER BY p."OrderId"''', raw)
+    pd.testing.assert_frame_equal(purchased, expected)
+    products = pd.read_sql_query('SELECT "ProductId" FROM product_only_ids WHERE "ProductTypeId" = 6', raw)
+    assert sorted(store.load('raw_products_table')["ProductId"]) == sorted(products["ProductId"])
+    traffic = store.load('raw_traffic_table')
+    assert set(traffic["SessionId"]) <= set(purchased["SessionId"])
+    assert traffic["RequestUrl"].str.startswith('pdo').all()
+
+
+def test_resumed_extraction_matches_uninterrupted(database, tmp_path, monkeypatch):
+    connection = init_dataframes.connect('sqlite:///' + database)
+    reference = store_in(tmp_path, 'reference')
+    init_dataframes.extract_purchased(connection, reference, chunksize=50)
+    init_dataframes.extract_products(connection, reference, chunksize=50)
+    init_dataframes.extract_traffic(connection, reference, reference.load('purchased_table'),
+                                    batch_size=20, chunksize=50)
+
+    store = store_in(tmp_path, 'data')
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 4)
+        with pytest.raises(Interrupted):
+            init_dataframes.extract_purchased(connection, store, chunksize=9)
+    init_dataframes.extract_purchased(connection, store, chunksize=9)
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 3)
+        with pytest.raises(Interrupted):
+            init_dataframes.extract_products(connection, store, chunksize=7)
+    init_dataframes.extract_products(connection, store, chunksize=7)
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 2)
+        with pytest.raises(Interrupted):
+            init_dataframes.extract_traffic(connection, store, store.load('purchased_table'),
+                                            batch_size=20, chunksize=10)
+    init_dataframes.extract_traffic(connection, store, store.load('purchased_table'), batch_size=20, chunksize=10)
+
+    for name in ['purchased_table', 'raw_products_table', 'raw_traffic_table']:
+        assert_same(store.load(name), reference.load(name))
+        assert store.digest(name) == reference.digest(name)
+
+
+def test_init_df_resumes_and_skips(database, tmp_path, monkeypatch):
+    url = 'sqlite:///' + database
+    reference = init_dataframes.init_df(str(store_in(tmp_path, 'reference').folder), url=url)
+
+    folder = str(store_in(tmp_path, 'data').folder)
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 0)
+        with pytest.raises(Interrupted):
+            init_dataframes.init_df(folder, url=url)
+    tables = init_dataframes.init_df(folder, url=url)
+    for a, b in zip(tables, reference):
+        assert_same(a, b)
+
+    # Every stage is up to date: the database is not even opened
+    tables = init_dataframes.init_df(folder, url='sqlite:///' + str(tmp_path / 'missing' / 'digitec.db'))
+    for a, b in zip(tables, reference):
+        assert_same(a, b)
+
+
+def test_pushdown_gives_the_same_tables(database, tmp_path):
+    url = 'sqlite:///' + database
+    plain = store_in(tmp_path, 'plain')
+    pushdown = store_in(tmp_path, 'pushdown')
+    tables = init_dataframes.init_df(str(plain.folder), url=url)
+    pushdown_tables = init_dataframes.init_df(str(pushdown.folder), url=url, pushdown=True)
+    for a, b in zip(tables, pushdown_tables):
+        assert_same(a, b)
+    for name in ['purchased_table', 'raw_products_table', 'raw_traffic_table']:
+        assert_same(plain.load(name), pushdown.load(name))
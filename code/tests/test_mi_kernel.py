@@ -0,0 +1,151 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+Tests of the mutual information kernels (utils/mi_kernel.py) against
+the DataFrame implementation of greedy/MaxMI_Algo.py.
+
+Usage:
+    python -m pytest code/tests
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import algo_utils, mi_kernel
+from utils.catalog_index import CatalogIndex
+from greedy.MaxMI_Algo import mutual_inf, conditional_entropy, opt_step
+from fixture_db import make_tables
+
+# Answers given before scoring: (question, answers) applied in order
+ANSWERS = [[], [(100, [1.])], [(101, [np.nan, 0.]), (103, [2., 3.])]]
+
+
+@pytest.fixture(params=[False, True], ids=['plain', 'compressed'])
+def tables(request):
+    products_cat, traffic_cat, purchased_cat = make_tables()
+    catalog = CatalogIndex(products_cat, purchased_cat if request.param else None)
+    return catalog, products_cat, traffic_cat, purchased_cat
+
+
+def states(catalog, products_cat, traffic_cat, purchased_cat):
+    """ Yields the states after the answers of ANSWERS, as tables and as a mask. """
+    for answers in ANSWERS:
+        product_set, traffic_set, purchased_set = products_cat, traffic_cat, purchased_cat
+        mask = catalog.full_mask()
+        for question, given in answers:
+            product_set, traffic_set, purchased_set = algo_utils.select_subset(product_set, traffic_set, question,
+                                                                               given, purchased_set)
+            mask = catalog.select(mask, question, given)
+        yield product_set, traffic_set, purchased_set, mask
+
+
+def baseline_mutual_inf(question, product_set, traffic_set, purchased_set, alpha_y):
+    """ MaxMI_Algo.mutual_inf with the weight alpha_y of the purchases. """
+    proba_A = algo_utils.get_proba_A_distribution_none(question, product_set, traffic_set, alpha=1)["final_proba"]
+    return sum(proba_A.loc[a] * conditional_entropy(np.asarray([a]), question, product_set, traffic_set,
+                                                    purchased_set, alpha_y=alpha_y) for a in proba_A.index)
+
+
+def test_kernel_matches_mutual_inf(tables):
+    catalog, products_cat, traffic_cat, purchased_cat = tables
+    history = mi_kernel.TrafficHistory(catalog, traffic_cat)
+    questions = list(catalog.question_ids)
+    with_idk = 0
+    for product_set, traffic_set, purchased_set, mask in states(*tables):
+        sold = catalog.purchase_counts(purchased_set)
+        expected = [mutual_inf(q, product_set, traffic_set, purchased_set) for q in questions]
+        assert len(traffic_set) > 0
+        for q, value in zip(questions, expected):
+            assert mi_kernel.mutual_inf_kernel(catalog, mask, q, sold, traffic_set) == pytest.approx(value, abs=1e-12)
+            assert mi_kernel.mutual_inf_kernel(catalog, mask, q, sold, history=history) == \
+                pytest.approx(value, abs=1e-12)
+            with_idk += mi_kernel.answer_tables(catalog, mask, q, sold)[3] > 0
+        np.testing.assert_allclose(mi_kernel.score_questions(catalog, mask, questions, sold, traffic_set),
+                                   expected, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(mi_kernel.score_questions(catalog, mask, questions, sold, history=history),
+                                   expected, rtol=0, atol=1e-12)
+    # the 'idk' answer of the products without answer is part of the scores
+    assert with_idk > 0
+
+
+def test_kernel_matches_conditional_entropy(tables):
+    catalog = tables[0]
+    questions = list(catalog.question_ids)
+    for product_set, traffic_set, purchased_set, mask in states(*tables):
+        sold = catalog.purchase_counts(purchased_set)
+        for alpha_y in [0, 0.5, 3]:
+            for q in questions:
+                codes, _, neg_entropy_a, _, _ = mi_kernel.answer_tables(catalog, mask, q, sold, alpha_y=alpha_y)
+                expected = [conditional_entropy(np.asarray([a]), q, product_set, traffic_set, purchased_set,
+                                                alpha_y=alpha_y) for a in catalog.decode_answers(q, codes)]
+                np.testing.assert_allclose(neg_entropy_a, expected, rtol=0, atol=1e-12)
+            expected = [baseline_mutual_inf(q, product_set, traffic_set, purchased_set, alpha_y) for q in questions]
+            np.testing.assert_allclose(mi_kernel.score_questions(catalog, mask, questions, sold, traffic_set,
+                                                                 alpha_y=alpha_y), expected, rtol=0, atol=1e-12)
+
+
+def test_histograms_follow_the_answers(tables):
+    catalog, products_cat, traffic_cat, purchased_cat = tables
+    sold = catalog.purchase_counts(purchased_cat)
+    questions = list(catalog.question_ids)
+    histograms = mi_kernel.AnswerHistograms(catalog, sold)
+    with_history = mi_kernel.AnswerHistograms(catalog, sold, history=mi_kernel.TrafficHistory(catalog, traffic_cat))
+    rng = np.random.RandomState(0)
+    for _ in range(3):
+        mask = catalog.full_mask()
+        masks = [mask]
+        # a session: answers to random questions
+        for _ in range(10):
+            question = rng.choice(questions)
+            answers = catalog.answer_set(mask, question)
+            given = rng.choice(answers, size=min(len(answers), rng.randint(1, 3)), replace=False)
+            if 0 < catalog.count(catalog.select(mask, question, given)) < catalog.count(mask):
+                mask = catalog.select(mask, question, given)
+                masks.append(mask)
+        # then back to earlier states, which adds products again
+        for mask in masks + masks[-2::-2]:
+            traffic_set = catalog.restrict(traffic_cat, mask)
+            expected = mi_kernel.score_questions(catalog, mask, questions, sold, traffic_set)
+            histograms.update(mask)
+            np.testing.assert_allclose(histograms.score(questions, traffic_set), expected, rtol=0, atol=1e-12)
+            with_history.update(mask)
+            np.testing.assert_allclose(with_history.score(questions), expected, rtol=0, atol=1e-12)
+
+
+def test_prune_chooses_the_question_of_the_exhaustive_scan(tables):
+    catalog, products_cat, traffic_cat, purchased_cat = tables
+    histograms = mi_kernel.AnswerHistograms(catalog, catalog.purchase_counts(purchased_cat))
+    questions = list(catalog.question_ids)
+    # the scores are negative: the questions used in the history weigh their score up
+    histories = [None,
+                 {q: 1.0 for q in questions if q not in [100, 107]},
+                 {q: 1.0 for q in questions if q not in [101, 104]},
+                 {q: 1.0 for q in questions}]
+    chosen = set()
+    n_pruned = 0
+    for _, traffic_set, purchased_set, mask in states(*tables):
+        # without traffic, question 107 splits the products as question 100: same score
+        for traffic_set in [catalog.restrict(traffic_cat, mask), []]:
+            for frequency in histories:
+                a_hist, df_history = 0, 0
+                if frequency is not None:
+                    a_hist = 10
+                    df_history = pd.DataFrame({"questionId": [str(q) for q in frequency],
+                                               "text": ['Question {}'.format(q) for q in frequency],
+                                               "frequency": np.ones(len(frequency)) / len(frequency)})
+                for question_set in [questions, questions[::-1]]:
+                    batch = opt_step(question_set, None, traffic_set, purchased_set, a_hist, df_history,
+                                     catalog=catalog, mask=mask, mode='batch')
+                    pruned = opt_step(question_set, None, traffic_set, purchased_set, a_hist, df_history,
+                                      catalog=catalog, mask=mask, mode='prune', histograms=histograms)
+                    assert pruned == batch
+                    chosen.add(batch)
+            n_pruned += histograms.score_pruned(questions, traffic_set)[1]
+    # the first of the tied questions wins, in both orders
+    assert {100, 107, 104, 106} <= chosen
+    assert n_pruned > 0
@@ -0,0 +1,65 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+Tests of the incremental refresh of the tables (utils/refresh.py) on a
+SQLite copy of the schema.
+
+Usage:
+    python -m pytest code/tests
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import pandas as pd
+
+from utils import algo_utils
+from utils.artifact_store import ArtifactStore
+from utils.init_dataframes import init_df
+from utils.refresh import refresh
+from fixture_db import make_database, add_orders, write_brands
+
+
+def canonical_traffic(traffic):
+    """ Rows of the traffic table, independent of their order and of the order of the answers. """
+    return sorted((int(s), sorted((q, sorted(a)) for q, a in answers.items()), int(p))
+                  for s, answers, p in traffic[["SessionId", "answers_selected", "Items_ProductId"]].values)
+
+
+def canonical_history(df_history):
+    return df_history.sort_values("questionId").reset_index(drop=True)
+
+
+def test_refresh_matches_full_build(tmp_path):
+    database = str(tmp_path / 'digitec.db')
+    url = 'sqlite:///' + database
+    make_database(database, n_orders=250)
+    folder = str(tmp_path / 'data')
+    os.makedirs(folder)
+    write_brands(folder)
+    init_df(folder, url=url)
+
+    add_orders(database, 251, 300, seed=2)
+    assert refresh(folder, url, batch_size=20, chunksize=10) > 0
+    # The tables are rebuilt with more purchases than the last refresh saw
+    add_orders(database, 301, 350, seed=3)
+    init_df(folder, force=['extract_purchased', 'extract_traffic'], url=url)
+    assert refresh(folder, url) == 0
+    add_orders(database, 351, 400, seed=4)
+    assert refresh(folder, url, batch_size=20, chunksize=10) > 0
+
+    reference_folder = str(tmp_path / 'reference')
+    os.makedirs(reference_folder)
+    write_brands(reference_folder)
+    init_df(reference_folder, url=url)
+
+    store = ArtifactStore(folder, mmap_mode=None)
+    reference = ArtifactStore(reference_folder, mmap_mode=None)
+    pd.testing.assert_frame_equal(store.load('purchased_table'), reference.load('purchased_table'))
+    traffic = store.load('traffic_table')
+    assert canonical_traffic(traffic) == canonical_traffic(reference.load('traffic_table'))
+    assert sorted(store.load('raw_traffic_table')["RequestUrl"]) == \
+        sorted(reference.load('raw_traffic_table')["RequestUrl"])
+    expected = algo_utils.create_history(reference.load('traffic_table'), reference.load('question_text_df'))
+    pd.testing.assert_frame_equal(canonical_history(store.load('df_history')), canonical_history(expected))
@@ -0,0 +1,56 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+Tests of the speculative precomputation of the next questions (greedy/Speculator.py).
+
+Usage:
+    python -m pytest code/tests
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import pandas as pd
+
+from greedy.Speculator import Speculator
+
+
+def test_get_returns_the_speculated_question():
+    # next question for the answers given to question 100, None below the threshold
+    next_questions = {'1.0': 101, '2.0': 102, 'idk': None}
+    speculator = Speculator(max_workers=2, max_answers=3)
+    try:
+        state = {200: ['3.0']}
+        proba_A = pd.Series([0.1, 0.5, 0.3, 0.1], index=['idk', '1.0', '2.0', '3.0'])
+        speculator.speculate(state, 100, proba_A, lambda answers: next_questions[answers[0]])
+        assert speculator.submitted == 3
+
+        # speculated answer: the state is independent of the order and types of the ids
+        assert speculator.get({'100': ['1.0'], 200.0: ['3.0']}) == 101
+        # answer not speculated (not among the 3 most likely)
+        assert speculator.get({200: ['3.0'], 100: ['3.0']}) is None
+        # speculated answer without a next question: a miss, and a wasted speculation
+        assert speculator.get({200: ['3.0'], 100: ['idk']}) is None
+        # a speculation is used only once
+        assert speculator.get({200: ['3.0'], 100: ['1.0']}) is None
+        assert speculator.stats() == {"hits": 1, "misses": 3, "hit_rate": 0.25, "submitted": 3, "wasted": 1}
+
+        # the speculations of the previous question are dropped
+        speculator.speculate({200: ['3.0'], 100: ['1.0']}, 101, pd.Series([1.0], index=['4.0']), lambda answers: 103)
+        assert speculator.stats()["wasted"] == 2
+        assert speculator.get({200: ['3.0'], 100: ['2.0']}) is None
+        assert speculator.get({200: ['3.0'], 100: ['1.0'], 101: ['4.0']}) == 103
+        assert speculator.stats() == {"hits": 2, "misses": 4, "hit_rate": 2 / 6., "submitted": 4, "wasted": 2}
+    finally:
+        speculator.close()
+
+
+def test_get_drops_the_expired_questions():
+    speculator = Speculator(max_workers=1, ttl=-1.0)
+    try:
+        speculator.speculate({}, 100, pd.Series([1.0], index=['1.0']), lambda answers: 101)
+        assert speculator.get({100: ['1.0']}) is None
+        assert speculator.stats()["misses"] == 1 and speculator.stats()["hits"] == 0
+    finally:
+        speculator.close()
@@ -14,33 +14,48 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
 
 import pandas as pd
 import numpy as np
+from collections import Counter
 
 from utils.build_answers_utils import question_id_to_text
 
 
-def create_history(traffic_cat, question_text_df):
-    """ Create history dataframe of filters used with their frequency:
+def history_counts(traffic_cat):
+    """ Counts how often each filter was used in the traffic table.
         Args:
             traffic_cat: traffic table [SessionId	answers_selected	Items_ProductId]
+        Returns:
+            counts: Counter {questionId: number of rows where it was used}
+    """
+    return Counter(k for t in traffic_cat["answers_selected"] for k in t.keys())
+
+def history_from_counts(counts, question_text_df):
+    """ Builds the history dataframe from the filter counts (see history_counts),
+    the counts of several traffic tables can be added to merge them.
+        Args:
+            counts: Counter {questionId: number of uses}
             question_text_df: table to link questionId to text [PropertyDefinition	PropertyDefinitionId]
         Returns:
             df_history: history dataframe of filters used [QuestionId	text	frequency]
     """
-    # Compute the list of all the filters used in history
-    list_filters_used = []
-    [list_filters_used.append(k) for t in traffic_cat["answers_selected"] for k in t.keys()]
-    unique_filters = set(list_filters_used)
-    df_history = pd.DataFrame(columns=["questionId", "text", "frequency"])
-    total_freq = 0
-    for f in unique_filters:
+    rows = []
+    for f, freq in counts.items():
         question_text = question_id_to_text(f, question_text_df)
         if not question_text == 'No text equivalent for question':
-            freq = list_filters_used.count(f)
-            total_freq += freq
-            df_history.loc[len(df_history)] = [f, question_text, freq]
-    df_history["frequency"] = df_history["frequency"] / total_freq
+            rows.append([f, question_text, freq])
+    df_history = pd.DataFrame(rows, columns=["questionId", "text", "frequency"])
+    df_history["frequency"] = df_history["frequency"] / df_history["frequency"].sum()
     return df_history
 
+def create_history(traffic_cat, question_text_df):
+    """ Create history dataframe of filters used with their frequency:
+        Args:
+            traffic_cat: traffic table [SessionId	answers_selected	Items_ProductId]
+            question_text_df: table to link questionId to text [PropertyDefinition	PropertyDefinitionId]
+        Returns:
+            df_history: history dataframe of filters used [QuestionId	text	frequency]
+    """
+    return history_from_counts(history_counts(traffic_cat), question_text_df)
+
 def select_subset(product_set, traffic_set = [], question = None, answer = None, purchased_set = []):
     """Select the products corresponding to the answer given a filter and restrict the corresponding tables.
        Call init_dataframe to get the right product_set and traffic_set!:
@@ -93,7 +108,7 @@ def get_proba_Y_distribution(products_cat, purchased_cat, alpha=1):
 
     # step 2 take history into accounts
     if len(purchased_cat) > 0:
-        sold_by_product = purchased_cat.groupby('ProductId').sum()["Items_ItemCount"]
+        sold_by_product = purchased_cat.groupby('ProductId')["Items_ItemCount"].sum()
         prod_ids = sold_by_product.index.values
         total_sold = np.sum(sold_by_product.values)
         adjust_proba_by_product = sold_by_product.values/float(total_sold)
@@ -105,6 +120,31 @@ def get_proba_Y_distribution(products_cat, purchased_cat, alpha=1):
     return(distribution)
 
 
+def get_proba_Y_distribution_index(catalog, mask, sold, alpha=1):
+    """Same as get_proba_Y_distribution for the remaining products of the catalog index, the purchases
+    being aggregated once per product (no groupby, only a masked normalization):
+        Args:
+            catalog: compiled catalog (see utils.catalog_index.CatalogIndex)
+            mask: packed bitmap of the remaining products of the catalog
+            sold: number of items sold per product of the catalog (see CatalogIndex.purchase_counts),
+                  the products outside of mask are ignored
+            alpha: alpha = 0 means uniform distribution for all the products, otherwise the bigger it is the more history is taken into account
+        Returns:
+            product_ids: ProductIds of the remaining products (see CatalogIndex.products)
+            final_proba: probability of each product of product_ids
+    """
+    in_mask = catalog.to_bool(mask)
+    members = catalog.product_weight
+    sold_left = np.where(in_mask, sold, 0.0)
+    total_sold = np.sum(sold_left)
+    # items sold of a class of products are shared by its members
+    proportion_sold = sold_left/members/float(total_sold) if total_sold > 0 else np.zeros(len(sold_left))
+    unormalized_final_proba = 1.0/catalog.count(mask) + alpha*proportion_sold
+    final_proba = unormalized_final_proba/np.sum((members*unormalized_final_proba)[in_mask])
+    selected = in_mask[catalog.member_position]
+    return(catalog.member_ids[selected], final_proba[catalog.member_position[selected]])
+
+
 def get_questions(product_set):
     """Compute all possible filters used in product_set:
         Args:
@@ -149,15 +189,17 @@ def get_proba_Q_distribution(question_list, df_history, alpha):
     n = len(question_list)
     # Step 1: uniform distribution
     Q_proba = np.ones(n)/n
-    # Step 2: taking into account history
+    # Step 2: taking into account history (first frequency found for each questionId,
+    # the ids being str in create_history but possibly int or float in a stored table)
+    frequency = {}
+    for q, f in zip(df_history["questionId"].values, df_history["frequency"].values):
+        try:
+            frequency.setdefault(str(int(float(q))), f)
+        except (TypeError, ValueError):
+            continue
     for i in range(n):
         q_id = int(float(question_list[i]))
-        try:
-            Q_proba[i] += alpha * df_history.loc[df_history["questionId"]== str(q_id), "frequency"].values[0]      
-        except TypeError:
-            Q_proba[i] += alpha * df_history.loc[df_history["questionId"] == q_id, "frequency"].values[0]
-        except IndexError:
-            pass
+        Q_proba[i] += alpha * frequency.get(str(q_id), 0)
     # Step 3: renormalizing
     Q_proba = Q_proba / Q_proba.sum()
     return Q_proba
@@ -184,12 +226,74 @@ def get_proba_A_distribution_none(question, products_cat, traffic_processed, alp
     nb_prod_with_answer = len(np.unique(products_cat["ProductId"]))
     distribution["nb_prod"] = products_cat[['ProductId','answer']].groupby(['answer']).count()["ProductId"]
     distribution.index = distribution.index.astype(float)
+    return(_combine_answer_distribution(distribution, question, number_products_total,
+                                        nb_prod_with_answer, traffic_processed, alpha))
+
+def get_proba_A_distribution_index(question, catalog, mask, traffic_processed, alpha=1, history=None):
+    """Same as get_proba_A_distribution_none but the remaining products are given as a mask of the catalog index:
+        Args:
+            question: selected question, the algorithm computes the probabilities of its possible answers
+            catalog: compiled catalog (see utils.catalog_index.CatalogIndex)
+            mask: packed bitmap of the remaining products of the catalog
+            traffic_processed: traffic table restricted to the remaining products [SessionId	answers_selected	Items_ProductId]
+            alpha: alpha = 0 means fraction of products per answer without the history data, otherwise the bigger it is the more history is taken into account
+            history (default None): exploded traffic table replacing traffic_processed (see utils.mi_kernel.TrafficHistory)
+        Returns:
+            distribution: probability distribution of answers given a question
+    """
+    distribution = pd.DataFrame()
+    number_products_total = catalog.count(mask)
+
+    if (number_products_total==0):
+        print('Nothing to return there is no product left with this filter')
+        return(distribution)
+
+    # step 1: probas is number of product per answer to the question (no history)
+    rows = catalog.question_rows(question)
+    keep = catalog.to_bool(mask)[catalog.row_product[rows]]
+    codes = catalog.row_code[rows][keep]
+    products = catalog.row_product[rows][keep]
+    nb_prod_with_answer = catalog.product_weight[np.unique(products)].sum()
+    known = codes >= 0
+    counts = np.bincount(codes[known], weights=catalog.row_count[rows][keep][known] * catalog.product_weight[products[known]])
+    present = np.nonzero(counts)[0]
+    values = catalog.decode_answers(question, present).astype(float)
+    order = np.argsort(values, kind='stable')
+    distribution["nb_prod"] = pd.Series(counts[present][order].astype(int), index=values[order])
+    history_proba = None
+    if history is not None:
+        # historical answers of the sessions of the remaining products: masked bincount
+        hist_counts, hist_totals = history.answer_counts(mask)
+        j = catalog.question_index(question)
+        history_proba = pd.Series(0.0, index=distribution.index)
+        if hist_totals[j] > 0:
+            history_proba[:] = hist_counts[catalog.code_offsets[j] + present[order]]/hist_totals[j]
+    return(_combine_answer_distribution(distribution, question, number_products_total,
+                                        nb_prod_with_answer, traffic_processed, alpha, history_proba))
+
+def _combine_answer_distribution(distribution, question, number_products_total, nb_prod_with_answer, traffic_processed, alpha,
+                                 history_proba=None):
+    """Steps shared by the answer distributions: add the history and the idk answer, then renormalize.
+        Args:
+            distribution: dataframe indexed by answer with the column nb_prod
+            question: selected question
+            number_products_total: number of remaining products
+            nb_prod_with_answer: number of remaining products having the question
+            traffic_processed: traffic table [SessionId	answers_selected	Items_ProductId]
+            alpha: weight of the history data
+            history_proba (default None): fraction of the historical answers per answer of distribution,
+                                          replaces the scan of traffic_processed
+        Returns:
+            distribution: probability distribution of answers given a question
+    """
     nb_prod_without_answer = number_products_total - nb_prod_with_answer
     distribution["catalog_proba"] = distribution["nb_prod"]/number_products_total
     
     # step 2: add the history if available just for KNOWN answers
     distribution["history_proba"] = 0
-    if (len(traffic_processed)>0):
+    if history_proba is not None:
+        distribution["history_proba"] = history_proba.values
+    elif (len(traffic_processed)>0):
         history_answered = []
         response = traffic_processed["answers_selected"].values
         for r_dict in response:
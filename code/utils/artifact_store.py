@@ -0,0 +1,369 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+This module defines the artifact store of the preprocessed tables.
+
+The tables under data/ used to be pickled as a whole and every script
+unpickled all of them at startup. Here every DataFrame is saved as a folder
+with one .npy file per column (columns of Python objects, e.g. the
+answers_selected dicts of the traffic table, are pickled per column) and a
+manifest with the format version, the columns, their storage and the index.
+The .npy columns read with column() are memory-mapped: their pages are
+shared between the processes reading the same artifact. load() builds a
+DataFrame, which holds its own copy of the columns, so they are read in
+memory. A table (or a column) is only read when a script first uses it.
+Other objects (dicts, lists) are pickled in the store. Tables only
+available as the former .pkl files are still loaded.
+Tables extracted in chunks (see utils/sql_extract.py) are written part by
+part with a ChunkWriter and read back as one table, rows are appended to a
+table the same way (see utils/refresh.py).
+
+Usage:
+    python artifact_store.py ../data    # converts the .pkl tables of ../data
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import argparse
+import hashlib
+import pickle as pkl
+import shutil
+import numpy as np
+import pandas as pd
+
+from utils.load_utils import load_obj
+
+# Version of the layout of an artifact, stored in its manifest
+FORMAT_VERSION = 1
+
+# Tables written by init_dataframes.py and the scripts
+TABLES = ['products_table', 'traffic_table', 'purchased_table', 'filters_def_dict', 'type_filters',
+          'question_text_df', 'answer_text', 'df_history']
+
+
+def _dump(obj, filename):
+    with open(filename, 'wb') as f:
+        pkl.dump(obj, f, pkl.HIGHEST_PROTOCOL)
+
+
+def _load(filename):
+    with open(filename, 'rb') as f:
+        return pkl.load(f)
+
+
+class ArtifactStore(object):
+    """ Versioned folder of tables, loaded lazily.
+
+    Example:
+        >>> store = ArtifactStore('../data')
+        >>> store.save('products_table', products_cat)
+        >>> products_cat = store['products_table']      # read on first access only
+        >>> counts = store.column('purchased_table', 'Items_ItemCount')     # memory-mapped
+    """
+    def __init__(self, folder, mmap_mode='r'):
+        """
+        Args:
+            folder: folder of the artifacts (created if needed when saving)
+            mmap_mode (default 'r'): passed to np.load for the .npy columns returned by column(),
+                                     None to read them in memory
+        """
+        self.folder = folder
+        self.mmap_mode = mmap_mode
+        self._tables = {}
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def manifest(self, name):
+        """ Returns the manifest of an artifact, None if it is not in the store.
+        Raises:
+            ValueError: if the artifact was written with another format version
+        """
+        filename = os.path.join(self._path(name), 'manifest.pkl')
+        if not os.path.exists(filename):
+            return None
+        manifest = _load(filename)
+        if manifest["version"] != FORMAT_VERSION:
+            raise ValueError("Artifact {} has format version {}, expected {}".format(
+                name, manifest["version"], FORMAT_VERSION))
+        return manifest
+
+    def __contains__(self, name):
+        return self.manifest(name) is not None or os.path.exists(self._path(name) + '.pkl')
+
+    def __getitem__(self, name):
+        """ Returns the table, loading it on the first access. """
+        if name not in self._tables:
+            self._tables[name] = self.load(name)
+        return self._tables[name]
+
+    def save(self, name, obj):
+        """ Writes a table (or any picklable object) to the store.
+        The artifact is written to a temporary folder first, so that an
+        interrupted save never leaves a partial artifact behind.
+        Args:
+            name: name of the artifact, e.g. 'products_table'
+            obj: DataFrame, saved column by column, or any other object (pickled)
+        """
+        folder = self._path(name)
+        tmp = folder + '.tmp'
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        manifest = {"version": FORMAT_VERSION}
+        if isinstance(obj, pd.DataFrame):
+            storage = []
+            for i in range(obj.shape[1]):
+                values = obj.iloc[:, i].values
+                if isinstance(values, np.ndarray) and values.dtype != object:
+                    np.save(os.path.join(tmp, 'column_{}.npy'.format(i)), values)
+                    storage.append('npy')
+                else:
+                    _dump(values, os.path.join(tmp, 'column_{}.pkl'.format(i)))
+                    storage.append('pkl')
+            _dump(obj.index, os.path.join(tmp, 'index.pkl'))
+            manifest.update({"kind": "frame", "columns": list(obj.columns), "storage": storage,
+                             "dtypes": [str(dtype) for dtype in obj.dtypes], "length": len(obj)})
+        else:
+            _dump(obj, os.path.join(tmp, 'object.pkl'))
+            manifest["kind"] = "object"
+        _dump(manifest, os.path.join(tmp, 'manifest.pkl'))
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        os.rename(tmp, folder)
+        self._tables.pop(name, None)
+
+    def column(self, name, column):
+        """ Returns one column of a table without reading the others.
+        Args:
+            name: name of the artifact
+            column: column name
+        Returns:
+            values: memory-mapped array (unpickled for the object columns)
+        """
+        return self._read_column(name, column, self.mmap_mode)
+
+    def _read_column(self, name, column, mmap_mode):
+        """ Reads one column, the .npy columns with np.load(mmap_mode=mmap_mode). """
+        manifest = self.manifest(name)
+        if manifest is not None and manifest["kind"] == "chunks":
+            parts = [self._read_column(part, column, mmap_mode) for part in self._parts(name, manifest)]
+            return np.concatenate(parts) if len(parts) > 0 else np.array([])
+        if manifest is None or manifest["kind"] != "frame":
+            return self[name][column].values
+        i = manifest["columns"].index(column)
+        if manifest["storage"][i] == 'npy':
+            return np.load(os.path.join(self._path(name), 'column_{}.npy'.format(i)), mmap_mode=mmap_mode)
+        return _load(os.path.join(self._path(name), 'column_{}.pkl'.format(i)))
+
+    def load(self, name, columns=None):
+        """ Reads a table from the store (or from the former name.pkl file).
+        Args:
+            name: name of the artifact
+            columns (default None): columns to read, all if None
+        Returns:
+            obj: the saved DataFrame (or object), its columns are read in memory
+        """
+        manifest = self.manifest(name)
+        if manifest is None:
+            obj = load_obj(self._path(name))
+            return obj[columns] if columns is not None else obj
+        if manifest["kind"] == "object":
+            return _load(os.path.join(self._path(name), 'object.pkl'))
+        if manifest["kind"] == "chunks":
+            parts = [self.load(part, columns) for part in self._parts(name, manifest)]
+            if len(parts) == 0:
+                return pd.DataFrame(columns=manifest["columns"] if columns is None else list(columns))
+            return pd.concat(parts, ignore_index=True)
+        columns = manifest["columns"] if columns is None else list(columns)
+        # the DataFrame copies the columns to its blocks: no memory-mapping
+        data = {column: self._read_column(name, column, None) for column in columns}
+        index = _load(os.path.join(self._path(name), 'index.pkl'))
+        return pd.DataFrame(data, index=index, columns=columns)
+
+
+    def length(self, name):
+        """ Returns the number of rows of a table, without reading it if it is in the store format. """
+        manifest = self.manifest(name)
+        if manifest is None or manifest["kind"] == "object":
+            return len(self[name])
+        return manifest["length"]
+
+    def append(self, name, frame):
+        """ Appends rows to a table without rewriting it: the rows are written as a new part
+        (a table saved as a whole becomes the first part). A missing table is created.
+        Args:
+            name: name of the artifact
+            frame: DataFrame with the columns of the table
+        """
+        manifest = self.manifest(name)
+        if manifest is None:
+            writer = ChunkWriter(self, name)
+            writer.write(frame)
+            writer.close()
+            return
+        folder = self._path(name)
+        target = folder
+        if manifest["kind"] == "frame":
+            # The table becomes the first part of a new artifact written to a temporary
+            # folder (its files are linked, not copied), that replaces it as in save
+            target = folder + '.tmp'
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            os.makedirs(target)
+            try:
+                shutil.copytree(folder, os.path.join(target, 'part_00000'), copy_function=os.link)
+            except OSError:
+                shutil.rmtree(os.path.join(target, 'part_00000'), ignore_errors=True)
+                shutil.copytree(folder, os.path.join(target, 'part_00000'))
+            manifest = {"version": FORMAT_VERSION, "kind": "chunks", "parts": 1,
+                        "columns": manifest["columns"], "length": manifest["length"]}
+        if len(frame) > 0:
+            ArtifactStore(target).save('part_{:05d}'.format(manifest["parts"]), frame[manifest["columns"]])
+            manifest["parts"] += 1
+            manifest["length"] += len(frame)
+        # the manifest is replaced at once: an interrupted append leaves the table unchanged
+        _dump(manifest, os.path.join(target, 'manifest.pkl.tmp'))
+        os.replace(os.path.join(target, 'manifest.pkl.tmp'), os.path.join(target, 'manifest.pkl'))
+        if target != folder:
+            shutil.rmtree(folder)
+            os.rename(target, folder)
+        self._tables.pop(name, None)
+
+    def _parts(self, name, manifest):
+        return [os.path.join(name, 'part_{:05d}'.format(i)) for i in range(manifest["parts"])]
+
+    def digest(self, name):
+        """ Returns the md5 of the files of an artifact (or of the former .pkl file).
+        A table written in parts is hashed by its content, column by column, so that
+        it does not depend on the parts it was written in (e.g. by a resumed extraction). """
+        md5 = hashlib.md5()
+        manifest = self.manifest(name)
+        if manifest is not None and manifest["kind"] == "chunks":
+            md5.update(repr(manifest["columns"]).encode())
+            for column in manifest["columns"]:
+                values = np.asarray(self.column(name, column))
+                md5.update(str(values.dtype).encode())
+                md5.update(pd.util.hash_array(values, categorize=False).tobytes())
+            return md5.hexdigest()
+        path = self._path(name)
+        if not os.path.isdir(path):
+            path = path + '.pkl'
+            with open(path, 'rb') as f:
+                md5.update(f.read())
+            return md5.hexdigest()
+        for root, dirs, files in sorted(os.walk(path)):
+            dirs.sort()
+            for filename in sorted(files):
+                md5.update(os.path.relpath(os.path.join(root, filename), path).encode())
+                with open(os.path.join(root, filename), 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        md5.update(block)
+        return md5.hexdigest()
+
+
+class ChunkWriter(object):
+    """ Writes a table part by part, so that it never has to be held in memory.
+
+    The parts are written to name.parts/ and become the artifact name on close().
+    A watermark (e.g. the last key fully extracted) can be committed with the
+    parts written so far: if the extraction is interrupted, a new ChunkWriter
+    with the same signature drops the parts written after the last commit and
+    the extraction can resume after its watermark.
+
+    Example:
+        >>> writer = ChunkWriter(store, 'traffic_table', signature=query)
+        >>> for chunk in chunks_after(writer.watermark):
+        ...     writer.write(chunk)
+        ...     writer.commit(chunk["SessionId"].iloc[-1])
+        >>> writer.close()
+    """
+    def __init__(self, store, name, signature=None):
+        """
+        Args:
+            store: ArtifactStore
+            name: name of the artifact
+            signature (default None): identifies the extraction (e.g. its query and parameters),
+                                      the progress of another signature is discarded
+        """
+        self.store = store
+        self.name = name
+        self.signature = signature
+        self.folder = store._path(name) + '.parts'
+        self.columns = None
+        progress = None
+        if os.path.exists(os.path.join(self.folder, 'progress.pkl')):
+            progress = _load(os.path.join(self.folder, 'progress.pkl'))
+            if progress["signature"] != signature:
+                progress = None
+        if progress is None:
+            if os.path.exists(self.folder):
+                shutil.rmtree(self.folder)
+            os.makedirs(self.folder)
+            progress = {"signature": signature, "watermark": None, "parts": 0, "columns": None}
+            _dump(progress, os.path.join(self.folder, 'progress.pkl'))
+        else:
+            # Parts written after the last commit are extracted again
+            for entry in os.listdir(self.folder):
+                if entry.startswith('part_') and int(entry[5:10]) >= progress["parts"]:
+                    shutil.rmtree(os.path.join(self.folder, entry))
+        self.watermark = progress["watermark"]
+        self.parts = progress["parts"]
+        self.columns = progress["columns"]
+
+    def write(self, chunk):
+        """ Writes one DataFrame part (empty parts are skipped). """
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+        if len(chunk) == 0:
+            return
+        ArtifactStore(self.folder).save('part_{:05d}'.format(self.parts), chunk)
+        self.parts += 1
+
+    def commit(self, watermark):
+        """ Records that everything up to watermark is written. """
+        self.watermark = watermark
+        _dump({"signature": self.signature, "watermark": watermark, "parts": self.parts,
+               "columns": self.columns},
+              os.path.join(self.folder, 'progress.pkl'))
+
+    def close(self):
+        """ Turns the parts into the artifact and returns its number of rows. """
+        length = 0
+        for i in range(self.parts):
+            length += ArtifactStore(self.folder).manifest('part_{:05d}'.format(i))["length"]
+        os.remove(os.path.join(self.folder, 'progress.pkl'))
+        _dump({"version": FORMAT_VERSION, "kind": "chunks", "parts": self.parts,
+               "columns": self.columns if self.columns is not None else [], "length": length},
+              os.path.join(self.folder, 'manifest.pkl'))
+        folder = self.store._path(self.name)
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        os.rename(self.folder, folder)
+        self.store._tables.pop(self.name, None)
+        return length
+
+
+def migrate(folder, names=TABLES):
+    """ Converts the .pkl tables of folder to the artifact store (the .pkl files are kept).
+    Args:
+        folder: data folder
+        names (default TABLES): tables to convert, missing ones are skipped
+    Returns:
+        store: ArtifactStore of folder
+    """
+    store = ArtifactStore(folder)
+    for name in names:
+        if os.path.exists(os.path.join(folder, name + '.pkl')):
+            store.save(name, load_obj(os.path.join(folder, name)))
+            print("Converted {}".format(name))
+    return store
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folder", help="data folder holding the .pkl tables", nargs='?', default='../data')
+    args = parser.parse_args()
+    migrate(args.folder)
@@ -38,62 +38,150 @@ def keep_only_useful_URLs(df):
             new = new.drop(i)
     return(new)
 
-def create_categories(df_category):
-    """ Defines the new answers. 
+# Types of the filters, codes of the column 'type' of answer_definitions
+ANSWER_TYPES = ['option', 'bin', 'value', 'mixed', 'no_answer']
+# Percentiles of the edges of the 10 bins of the filters with more than 10 values
+BIN_PERCENTILES = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+
+def distinct_per_filter(df_category, column, filters):
+    """ Distinct non-null values of column for every filter, in one pass over the table.
+    Args:
+        df_category: the product table
+        column: 'PropertyDefinitionOptionId' or 'PropertyValue'
+        filters: pd.Index of the filters
+    Returns:
+        values: array of the distinct values grouped by filter (in order of first
+                appearance within a filter, as drop_duplicates)
+        bounds: array of len(filters) + 1 offsets, the values of filters[k]
+                are values[bounds[k]:bounds[k+1]]
+    """
+    pairs = df_category[["PropertyDefinitionId", column]].dropna().drop_duplicates()
+    codes = filters.get_indexer(pairs["PropertyDefinitionId"].values)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(filters) + 1))
+    return pairs[column].values[order], bounds
+
+def grouped_percentiles(values, bounds, percentiles):
+    """ Percentiles of several groups of values together.
     Note:
-        This is a helper function.
+        Same linear interpolation (and same rounding) as np.percentile.
+    Args:
+        values: array of the values sorted within each group
+        bounds: offsets of the groups, values[bounds[k]:bounds[k+1]] is the group k (not empty)
+        percentiles: list of percentiles between 0 and 100
+    Returns:
+        array (number of groups, len(percentiles)) of the percentiles of every group
+    """
+    last = np.diff(bounds)[:, None] - 1
+    virtual = last * (np.asarray(percentiles, dtype=float) / 100)
+    previous = np.floor(virtual).astype(np.intp)
+    gamma = virtual - previous
+    start = bounds[:-1, None]
+    a = values[start + previous]
+    b = values[start + np.minimum(previous + 1, last)]
+    diff = b - a
+    return np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+
+def answer_definitions(df_category):
+    """ Defines the new answers of all the filters together.
+    Note:
+        The distinct options and values of the filters are sliced from the
+        deduplicated (filter, answer) pairs (see distinct_per_filter) and
+        the bins of all the 'bin' filters are computed in one call.
     Args:
         df_category: the product table restricted to one single category.
 
+    Returns:
+        definitions: dataframe with one row per new answer, grouped by filter (in order of
+                     appearance in df_category), columns
+                     filter: position of the filter
+                     PropertyDefinitionId: the filter
+                     type: categorical in ANSWER_TYPES ('option'|'bin'|'value'|'mixed'|'no_answer')
+                     answer: the answer, the edges of the bins for a 'bin' filter, NaN for 'no_answer'
+    """
+    filters = pd.Index(df_category["PropertyDefinitionId"].drop_duplicates().values)
+    options, option_bounds = distinct_per_filter(df_category, 'PropertyDefinitionOptionId', filters)
+    values, value_bounds = distinct_per_filter(df_category, 'PropertyValue', filters)
+    n_options = np.diff(option_bounds)
+    n_values = np.diff(value_bounds)
+    # 'option': only optionIds, 'value': only values (10 bins if more than 10 of them),
+    # 'mixed': the answer is sometimes an id and sometimes a value, keep the original answers
+    types = np.select([n_values == 0, (n_options == 0) & (n_values > 10), n_options == 0],
+                      [np.where(n_options > 0, 0, 4), 1, 2], default=3)
+
+    # New answers of the 'bin' filters are 10 bins constructed based on percentiles
+    is_bin = types == 1
+    group = np.repeat(np.arange(len(filters)), n_values)
+    binned = is_bin[group]
+    order = np.lexsort((values[binned], group[binned]))
+    bin_bounds = np.concatenate([[0], np.cumsum(n_values[is_bin])])
+    bins = grouped_percentiles(values[binned][order], bin_bounds, BIN_PERCENTILES)
+
+    pieces = []
+    bin_rows = iter(bins)
+    for k, t in enumerate(types):
+        option_values = options[option_bounds[k]:option_bounds[k+1]]
+        value_values = values[value_bounds[k]:value_bounds[k+1]]
+        if t == 0:
+            pieces.append(option_values)
+        elif t == 1:
+            pieces.append(next(bin_rows))
+        elif t == 2:
+            pieces.append(value_values)
+        elif t == 3:
+            pieces.append(pd.unique(np.concatenate([option_values, value_values])))
+        else:
+            pieces.append([np.nan])
+    for f in filters[types == 4]:
+        print('No answer is provided for filter {}'.format(f))
+    print('Have to categorize {} filters out of {}'.format(is_bin.sum(), len(filters)))
+
+    position = np.repeat(np.arange(len(filters)), [len(piece) for piece in pieces])
+    return pd.DataFrame({"filter": position,
+                         "PropertyDefinitionId": filters.values[position],
+                         "type": pd.Categorical.from_codes(types[position], ANSWER_TYPES),
+                         "answer": np.concatenate(pieces) if pieces else np.empty(0)})
+
+def definitions_to_dicts(definitions):
+    """ Dicts of the new answers used by the rest of the code.
+    Args:
+        definitions: table of the new answers (see answer_definitions)
     Returns:
         filters_def_dict: a dict mapping filtersId to new set of possible answers
-        type_filters: a dict mapping filters to type of filters (option, bin or value or mixed)
+        type_filters: a dict mapping filters to type of filters
                       {'questionid':'option'|'bin'|'value'|'mixed'|'no_answer'}
     """
     filters_def_dict = {}
     type_filters = {}
-    c = 0
-    q = 0
-    for f in df_category["PropertyDefinitionId"].drop_duplicates().values:
-        c+=1
-        values_defOpt = df_category.loc[df_category["PropertyDefinitionId"]==f, \
-                                    'PropertyDefinitionOptionId'].dropna().drop_duplicates().values
-        valuesProp = df_category.loc[df_category["PropertyDefinitionId"]==f, \
-                                    'PropertyValue'].dropna().drop_duplicates().values
-        
-        # Case filter is of 'option' type (i.e. answer is in defined set of possibilities)
-        if (len(valuesProp)==0 and len(values_defOpt)>0):
-            filters_def_dict.update({str(f): values_defOpt})
-            type_filters.update({str(f): 'option'}) #case only optionId
-        
-        # Case filter is of type 'value' or 'bin' (i.e. answer is a value not an id)
-        elif (len(values_defOpt)==0 and len(valuesProp)>0): 
-            # Case over than 10 possibles values
-            # New answers are 10 bins constructed based on percentiles.
-            if len(valuesProp) > 10:
-                bins = np.percentile(valuesProp, [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100])
-                filters_def_dict.update({str(f): bins})
-                type_filters.update({str(f): 'bin'})
-                q+=1
-            # Else keep the original answers
-            else:
-                filters_def_dict.update({str(f): valuesProp})
-                type_filters.update({str(f): 'value'})
-        
-        # If the answers is sometimes stored as an id and sometimes as a value 
-        # in the original dataframe. Keep the original answer.
-        elif (len(values_defOpt)>0 and len(valuesProp)>0): # both filled -> put values in optId
-            l = set(values_defOpt)
-            l2 = set(valuesProp)
-            filters_def_dict.update({str(f): np.array(l.union(l2))})
-            type_filters.update({str(f): 'mixed'})
-        # If there are no answer.
-        else:
-            print('No answer is provided for filter {}'.format(f))
-            type_filters.update({str(f): 'no_answer'})
-    print('Have to categorize {} filters out of {}'.format(q,c))
+    position = definitions["filter"].values
+    bounds = np.searchsorted(position, np.arange(position[-1] + 2 if len(position) else 1))
+    ids = definitions["PropertyDefinitionId"].values
+    types = np.asarray(definitions["type"].values)
+    answers = definitions["answer"].values
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        f, t = str(ids[start]), types[start]
+        type_filters.update({f: t})
+        if t == 'mixed':
+            filters_def_dict.update({f: np.array(set(answers[start:end]))})
+        elif t != 'no_answer':
+            filters_def_dict.update({f: answers[start:end]})
     return(filters_def_dict, type_filters)
 
+def create_categories(df_category):
+    """ Defines the new answers. 
+    Note:
+        This is a helper function, see answer_definitions for the
+        compact table of the new answers it is built from.
+    Args:
+        df_category: the product table restricted to one single category.
+
+    Returns:
+        filters_def_dict: a dict mapping filtersId to new set of possible answers
+        type_filters: a dict mapping filters to type of filters (option, bin or value or mixed)
+                      {'questionid':'option'|'bin'|'value'|'mixed'|'no_answer'}
+    """
+    return definitions_to_dicts(answer_definitions(df_category))
+
 def eliminate_filters_no_answers(df, type_filters):
     """To eliminate questions for which there are no 
     value available in the catalog.
@@ -121,11 +209,48 @@ def eliminate_filters_no_answers(df, type_filters):
             new = new.drop(ind_temp)
     return(new)
 
+def bin_values(bins, values):
+    """ Maps values to the lower edge of their bin, in one search over the edges.
+    Note:
+        The last edge only closes the last bin. As for the original loop,
+        values under the first edge (and missing values) are mapped to the last edge.
+    Args:
+        bins: sorted bin edges of one question (as in filters_def_dict for 'bin' questions)
+        values: array of values
+    Returns:
+        answers: array of the bins of the values
+    """
+    values = np.asarray(values, dtype=float)
+    j = np.searchsorted(bins[:len(bins)-1], values, side='right')
+    j[np.isnan(values)] = 0
+    return bins[j-1]
+
+def bin_ranges(bins, min_values, max_values):
+    """ Maps ranges of values (min/max selections) to the bins they overlap,
+    in one search over the edges for all the ranges.
+    Args:
+        bins: sorted bin edges of one question
+        min_values: array of the lower ends of the ranges
+        max_values: array of the upper ends of the ranges
+    Returns:
+        start: array, the range i covers the bins bins[start[i]:stop[i]]
+        stop: array
+        valid: array of bool, False if min > max or if the range is out of the bins
+    """
+    min_values = np.asarray(min_values, dtype=float)
+    max_values = np.asarray(max_values, dtype=float)
+    n = len(bins)
+    start = np.searchsorted(bins[1:n-1], min_values, side='right')
+    stop = np.maximum(start, np.searchsorted(bins, max_values, side='right'))
+    valid = (min_values <= max_values) & (min_values <= bins[n-1]) & (max_values >= bins[0])
+    return start, stop, valid
+
 def map_origAnswer_newAnswer(df, filters_def_dict, type_filters):
     """ Function to construct the final 'answer' column.
     Note:
         First run create_category to get filters_def_dcit and 
-        type_filters
+        type_filters. The column is built question by question
+        with array operations (see bin_values for the 'bin' questions).
     
     Args:
         df: input product_catalog with the row answers
@@ -141,30 +266,26 @@ def map_origAnswer_newAnswer(df, filters_def_dict, type_filters):
         >>> filters_def_dict, type_filters = create_categories(df)
         >>> df['answer'] = map_origAnswer_newAnswer(df, filters_def_dict, type_filters)
     """
-    answers = []
-    for i in df.index.values:
-        # get current question
-        filter = df.loc[i, "PropertyDefinitionId"]
+    options = df["PropertyDefinitionOptionId"].values
+    values = df["PropertyValue"].values
+    answers = np.full(len(df), np.nan, dtype=object)
+    codes, filters = pd.factorize(df["PropertyDefinitionId"].values)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(filters) + 1))
+    for k, filter in enumerate(filters):
+        rows = order[bounds[k]:bounds[k+1]]
         # construct the new answer depending on the type of question
         if type_filters[str(filter)]=='option':
-            answers.append(df.loc[i,"PropertyDefinitionOptionId"])
+            answers[rows] = options[rows]
         elif type_filters[str(filter)]=='value':
-            answers.append(df.loc[i,"PropertyValue"])
+            answers[rows] = values[rows]
         # if bin filter map original answer to corresponding bin
         elif type_filters[str(filter)]=='bin':
-            bins = filters_def_dict[str(filter)]
-            n = len(bins)-1
-            j = 0
-            while (df.loc[i,"PropertyValue"]>=bins[j] and j<n):
-                j=j+1
-            answers.append(bins[j-1])
+            answers[rows] = bin_values(filters_def_dict[str(filter)], values[rows])
         # if mixed and answer is in id use id otherwise use value
         elif type_filters[str(filter)]=='mixed':
-            if np.isnan(df.loc[i,"PropertyDefinitionOptionId"]):
-                answers.append(df.loc[i,"PropertyValue"])
-            else:
-                answers.append(df.loc[i,"PropertyDefinitionOptionId"]) 
-    return(answers)
+            answers[rows] = np.where(pd.isnull(options[rows]), values[rows], options[rows])
+    return(answers.tolist())
 
 def map_text_new_answer(df, answer_text_df, type_filters, filters_def_dict):
     """ Finds the string corresponding to the new answer.
@@ -186,26 +307,31 @@ def map_text_new_answer(df, answer_text_df, type_filters, filters_def_dict):
         >>> df['answer'] = map_origAnswer_newAnswer(df, filters_def_dict, type_filters)
         >>> text_answer = map_text_new_answer(df, answer_text_df, type_filters, filters_def_dict)
     """
-    text_answers = []
-    for i in df.index.values:
-        filter = df.loc[i, "PropertyDefinitionId"] 
-        if (type_filters[str(filter)]=='option' or type_filters[str(filter)]=='mixed'):
-            if len(answer_text_df.loc[answer_text_df["PropertyDefinitionOptionId"] == str(int(float(df.loc[i, "answer"]))),"PropertyDefinitionOption"].values) == 0:
-                text_answers.append(str(df.loc[i, "answer"]))
-            else:
-                text_answers.append(answer_text_df.loc[answer_text_df["PropertyDefinitionOptionId"] == str(int(float(df.loc[i, "answer"]))),"PropertyDefinitionOption"].values[0])
-                #print(answer_text_df.loc[answer_text_df["PropertyDefinitionOptionId"] == str(int(df.loc[i, "answer"])),"PropertyDefinitionOption"].values[0])
-        elif type_filters[str(filter)]=='bin':
-            bins = filters_def_dict[str(filter)]
-            idx = np.where(bins == df.loc[i, "answer"])[0]
-            try:
-                my_string = '[{}-{}]'.format(bins[idx], bins[idx+1])
-            except(IndexError):
-                my_string = 'over {}'.format(bins[idx])
-            text_answers.append(my_string)
-        else:
-            text_answers.append(str(df.loc[i, "answer"]))
-    return(text_answers)
+    # The text only depends on the (question, answer) pair: it is found once per distinct pair
+    pairs = df[["PropertyDefinitionId", "answer"]].drop_duplicates()
+    filters = pairs["PropertyDefinitionId"].values
+    answers = pairs["answer"].values
+    kinds = np.array([type_filters[str(f)] for f in filters], dtype=object)
+    texts = [str(a) for a in answers]
+    # Options (and mixed): hash join of the answers with the first text of each option id
+    options = answer_text_df.drop_duplicates("PropertyDefinitionOptionId")
+    option_ids = pd.Index(options["PropertyDefinitionOptionId"].values)
+    option_texts = options["PropertyDefinitionOption"].values
+    rows = np.flatnonzero((kinds == 'option') | (kinds == 'mixed'))
+    positions = option_ids.get_indexer([str(int(float(answers[r]))) for r in rows])
+    for r, pos in zip(rows, positions):
+        if pos >= 0:
+            texts[r] = option_texts[pos]
+    # Bins: one label per bin
+    for r in np.flatnonzero(kinds == 'bin'):
+        bins = filters_def_dict[str(filters[r])]
+        idx = np.where(bins == answers[r])[0]
+        try:
+            texts[r] = '[{}-{}]'.format(bins[idx], bins[idx+1])
+        except(IndexError):
+            texts[r] = 'over {}'.format(bins[idx])
+    pairs["text"] = texts
+    return(df[["PropertyDefinitionId", "answer"]].merge(pairs, how="left")["text"].tolist())
 
 def filters_answers_per_requestURL(RequestUrl):
     """ Gets the filters and corresponding answers used in one RequestUrl
@@ -264,11 +390,7 @@ def hist_to_new(filtername, filters_def_dict, type_filters, min_value=None, max_
                 return([min_value]) # nothing has to be done
             elif (type_filters[filtername]=="bin"):
                 bins = filters_def_dict[filtername]
-                n= len(bins)-1
-                j=0
-                while (float(min_value)>=bins[j] and j<n):
-                    j=j+1
-                return([bins[j-1]]) # find the right bin corresponding to the chosen value
+                return(list(bin_values(bins, [float(min_value)]))) # find the right bin corresponding to the chosen value
         elif min_value > max_value:
             return(np.nan)
         else:
@@ -279,13 +401,8 @@ def hist_to_new(filtername, filters_def_dict, type_filters, min_value=None, max_
             elif max_value < bins[0]:
                 return(np.nan)
             else:
-                i = 1
-                while (min_value >= bins[i] and i<(n-1)):
-                    i+=1
-                j = i-1
-                while (j<n and max_value >= bins[j]):
-                    j+=1
-                return(bins[(i-1):j]) #find the bins corresponding to the chosen range
+                start, stop, _ = bin_ranges(bins, [min_value], [max_value])
+                return(bins[start[0]:stop[0]]) #find the bins corresponding to the chosen range
     except KeyError:
         print('The filter {} is not in the current product database'.format(filtername))
         return(np.nan)
@@ -359,6 +476,8 @@ def process_all_traffic_answers(traffic_df, purchased_cat, filters_def_dict, typ
     # assuming you have eliminated all invalid urls
     idx = traffic_df.index.values
     urlsList = traffic_df["RequestUrl"].values
+    # one dict per row (set with at, loc would store the list in recent pandas versions)
+    traffic_df["answer"] = None
     for i, url in zip(idx, urlsList):
         ans_d = {}
         try:
@@ -367,11 +486,11 @@ def process_all_traffic_answers(traffic_df, purchased_cat, filters_def_dict, typ
                 tmp_new_ans = process_answers_filter(f, dict_dict_answers, filters_def_dict, type_filters)
                 ans_d.update({f: tmp_new_ans})
             if bool(ans_d):
-                traffic_df.loc[i, "answer"] = [ans_d]
+                traffic_df.at[i, "answer"] = ans_d
             else:
-                traffic_df.loc[i, "answer"] = [dict()]
+                traffic_df.at[i, "answer"] = dict()
         except TypeError:
-            traffic_df.loc[i, "answer"] =  [dict()]
+            traffic_df.at[i, "answer"] = dict()
     session_array = traffic_df["SessionId"].drop_duplicates().values
     res = pd.DataFrame()
     res["SessionId"] = session_array
@@ -420,6 +539,19 @@ def question_text_to_id(question_text, question_df):
         question_text = 'No id equivalent for question'
     return question_text
 
+def _keyed_answer_text(answer, question, answer_df):
+    """ Text of one answer in an answer_text table indexed by (question_id, answer_id). """
+    try:
+        if answer != answer:
+            # NaN never equals an answer_id
+            raise KeyError(answer)
+        return str(answer_df["answer_text"].values[answer_df.index.get_loc((int(float(question)), answer))])
+    except TypeError:
+        return answer
+    except KeyError:
+        return 'Not Found: ' + str(answer)
+
+
 def answer_id_to_text(answer, question, answer_df):
     """Returns the answer string given its id. 
 
@@ -428,10 +560,13 @@ def answer_id_to_text(answer, question, answer_df):
         question: questionId
         answer_df: dataframe with columns question_id
                    answer_id and answer_text as constructed
-                   in init_dataframe()
+                   in init_dataframe(), indexed by (question_id, answer_id)
+                   for a direct lookup
     Returns:
         answer_list: list of corresponding strings.      
     """
+    if answer_df.index.names == ["question_id", "answer_id"]:
+        return [a if a in ('idk', 'none') else _keyed_answer_text(a, question, answer_df) for a in answer]
     answer_list = []
     for i in answer:
         if i == 'idk':
@@ -0,0 +1,490 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+This module defines the compiled catalog index.
+
+The long-format product table (one row per product and question) is
+compiled once into integer arrays: products and questions are replaced
+by their position in the catalog and the answers of each question are
+dictionary-encoded to small integers.
+
+On top of it, an inverted index maps every (question, answer code) pair
+to a packed bitmap of product positions. The state of an algorithm is a
+packed bitmap of the remaining products (the "mask") instead of a filtered
+copy of the product table: applying an answer is an OR over the bitmaps
+of the given answers followed by an AND with the mask, and the number of
+remaining products is a popcount.
+
+Products having the same answers to every question and the same number of
+items sold cannot be distinguished by any question nor by the purchase
+history: given purchased_cat, the index keeps one position per class of such
+products with its number of members (product_weight), and the scoring kernels
+weight each position by it. The ProductIds are only expanded back for the
+final set of products (see products).
+"""
+import os
+import sys
+import hashlib
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import numpy as np
+import pandas as pd
+
+from utils.load_utils import load_obj, save_obj
+
+# Arrays written by CatalogIndex.save
+_ARRAYS = ['product_ids', 'question_ids', 'q_offsets', 'row_product', 'row_question', 'row_code',
+           'row_count', 'row_first', 'code_offsets', 'row_answer', 'answer_question', 'bitmaps',
+           'product_weight', 'member_ids', 'member_position', 'missing_bitmaps']
+
+# Code of a missing (NaN) answer, see CatalogIndex.encode_answers
+MISSING = -1
+
+# Number of bits set in each possible byte
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+
+def popcount(bits):
+    """ Returns the number of bits set in a packed bitmap. """
+    return int(_POPCOUNT[bits].sum())
+
+
+def _is_missing(answer):
+    """ Returns True for a NaN answer (str(answer) is 'nan' as in algo_utils.select_subset). """
+    try:
+        return np.isnan(float(answer))
+    except (TypeError, ValueError):
+        return False
+
+
+def _answer_key(answer):
+    """ Normalizes an answer so that '5767', 5767 and 5767.0 share the same key.
+    Args:
+        answer: answer as stored in the catalog, in the traffic data or sampled.
+    Returns:
+        key: float value of the answer if possible, the string otherwise.
+    """
+    try:
+        return float(answer)
+    except (TypeError, ValueError):
+        return str(answer)
+
+
+class CatalogIndex(object):
+    """ Integer-coded view of the product table.
+
+    Attributes:
+        products_cat: product table the index was built from
+        product_ids: array of ProductId, position i is product i of the masks
+                     (the representative of class i if the catalog is compressed)
+        product_weight: number of products of the table behind each position
+        member_ids: array of all the ProductIds of the table
+        member_position: position of each of member_ids
+        question_ids: array of PropertyDefinitionId, position j is question j
+        answer_values: list, answer_values[j] is the array of the distinct answers
+                       of question j (the answer code is the index in this array)
+        bitmaps: bitmaps[g] is the packed bitmap of the products having the
+                 global answer id g (see code_offsets)
+        missing_bitmaps: missing_bitmaps[j] is the packed bitmap of the products
+                         having a missing (NaN) answer to question j
+        q_offsets: rows of question j are rows q_offsets[j]:q_offsets[j+1]
+        row_product: product position of each (product, question, answer) row
+        row_question: question position of each row
+        row_code: answer code of each row (MISSING if the answer is NaN)
+        row_count: number of rows of the original table collapsed in this row
+        row_first: True for the first row of each (product, question) pair
+        code_offsets: answer code c of question j has the global answer id code_offsets[j] + c
+        row_answer: global answer id of each row (-1 if the answer is missing)
+        answer_question: question position of each global answer id
+
+    Example:
+        >>> catalog = CatalogIndex(products_cat)
+        >>> mask = catalog.full_mask()
+        >>> mask = catalog.select(mask, 7302, [5767.0])
+        >>> catalog.count(mask)
+    """
+    def __init__(self, products_cat, purchased_cat=None):
+        """
+        Args:
+            products_cat: product table [ProductId, BrandId, ProductTypeId, PropertyValue,
+                                         PropertyDefinitionId, PropertyDefinitionOptionId, answer]
+            purchased_cat (default None): purchased table [ProductId, UserId, OrderId, SessionId,
+                                          Items_ProductId, Items_ItemCount], if given the products
+                                          are compressed to their equivalence classes
+        """
+        self.products_cat = products_cat
+        self._build_rows(products_cat)
+        self.member_ids = self.product_ids
+        self.member_position = np.arange(len(self.product_ids), dtype=np.int64)
+        self.product_weight = np.ones(len(self.product_ids), dtype=np.int64)
+        self._init_lookups()
+        if purchased_cat is not None:
+            self._compress(self.purchase_counts(purchased_cat))
+        self._build_bitmaps()
+
+    def _build_rows(self, products_cat):
+        """ Compiles the product table to the row arrays (one position per ProductId). """
+        self.product_ids = products_cat["ProductId"].drop_duplicates().values
+        self.question_ids = products_cat["PropertyDefinitionId"].drop_duplicates().values
+        n_products = len(self.product_ids)
+        n_questions = len(self.question_ids)
+
+        # Sort the rows by question (stable, to keep the order of appearance)
+        p_pos = pd.Index(self.product_ids).get_indexer(products_cat["ProductId"].values)
+        q_pos = pd.Index(self.question_ids).get_indexer(products_cat["PropertyDefinitionId"].values)
+        order = np.argsort(q_pos, kind='stable')
+        p_pos, q_pos = p_pos[order], q_pos[order]
+        answers = products_cat["answer"].values[order]
+        if answers.dtype == object:
+            answers = np.asarray([_answer_key(a) for a in answers], dtype=object)
+        bounds = np.searchsorted(q_pos, np.arange(n_questions + 1))
+
+        # Dictionary-encode the answers of each question and
+        # collapse duplicated (product, question, answer) rows
+        self.answer_values = []
+        rows_p, rows_q, rows_c, rows_n = [], [], [], []
+        for j in range(n_questions):
+            codes, uniques = pd.factorize(answers[bounds[j]:bounds[j+1]])
+            self.answer_values.append(np.asarray(uniques))
+            keys = p_pos[bounds[j]:bounds[j+1]].astype(np.int64) * (len(uniques) + 1) + (codes + 1)
+            _, first, counts = np.unique(keys, return_index=True, return_counts=True)
+            keep = np.argsort(first, kind='stable')
+            first, counts = first[keep], counts[keep]
+            rows_p.append(p_pos[bounds[j]:bounds[j+1]][first])
+            rows_q.append(np.repeat(j, len(first)))
+            rows_c.append(codes[first])
+            rows_n.append(counts)
+        self.row_product = np.concatenate(rows_p).astype(np.int32) if rows_p else np.zeros(0, np.int32)
+        self.row_question = np.concatenate(rows_q).astype(np.int32) if rows_q else np.zeros(0, np.int32)
+        self.row_code = np.concatenate(rows_c).astype(np.int32) if rows_c else np.zeros(0, np.int32)
+        self.row_count = np.concatenate(rows_n).astype(np.int32) if rows_n else np.zeros(0, np.int32)
+        self.q_offsets = np.concatenate([[0], np.cumsum([len(r) for r in rows_p])]).astype(np.int64)
+        pairs = self.row_question.astype(np.int64) * n_products + self.row_product
+        self.row_first = np.zeros(len(pairs), dtype=bool)
+        self.row_first[np.unique(pairs, return_index=True)[1]] = True
+
+        # Global answer ids: the answers of all the questions side by side
+        n_codes = np.asarray([len(v) for v in self.answer_values], dtype=np.int64)
+        self.code_offsets = np.concatenate([[0], np.cumsum(n_codes)]).astype(np.int64)
+        self.row_answer = np.where(self.row_code >= 0, self.code_offsets[self.row_question] + self.row_code, -1)
+        self.answer_question = np.repeat(np.arange(n_questions), n_codes)
+
+    def _compress(self, sold):
+        """ Keeps one position per class of products with the same answers and the same sales.
+        Args:
+            sold: number of items sold per product position
+        """
+        # Signature of a product: its sorted (question, answer code, multiplicity) rows and its sales
+        order = np.lexsort((self.row_code, self.row_question, self.row_product))
+        triples = np.stack([self.row_question, self.row_code, self.row_count], axis=1)[order]
+        offsets = self._product_offsets
+        signatures = [triples[offsets[i]:offsets[i+1]].tobytes() + np.float64(sold[i]).tobytes()
+                      for i in range(self.n_products)]
+        classes, _ = pd.factorize(pd.Series(signatures))
+        if classes.max(initial=-1) + 1 == self.n_products:
+            # every product is its own class
+            return
+        representatives = np.unique(classes, return_index=True)[1]
+        member_ids = self.product_ids
+        self._build_rows(self.products_cat.loc[self.products_cat["ProductId"].isin(member_ids[representatives])])
+        self.member_ids = member_ids
+        self.member_position = classes.astype(np.int64)
+        self.product_weight = np.bincount(classes).astype(np.int64)
+        self._init_lookups()
+
+    def _build_bitmaps(self):
+        """ Builds the inverted index (question, answer code) -> packed bitmap of products. """
+        self.bitmaps = np.zeros((self.code_offsets[-1], self.n_bytes), dtype=np.uint8)
+        self.missing_bitmaps = np.zeros((self.n_questions, self.n_bytes), dtype=np.uint8)
+        for j in range(self.n_questions):
+            rows = slice(self.q_offsets[j], self.q_offsets[j+1])
+            known = self.row_code[rows] >= 0
+            dense = np.zeros((len(self.answer_values[j]) + 1, self.n_products), dtype=bool)
+            # the missing answers go to the last line
+            dense[self.row_code[rows][known], self.row_product[rows][known]] = True
+            dense[-1, self.row_product[rows][~known]] = True
+            packed = np.packbits(dense, axis=1)
+            self.bitmaps[self.code_offsets[j]:self.code_offsets[j+1]] = packed[:-1]
+            self.missing_bitmaps[j] = packed[-1]
+
+    def save(self, folder):
+        """ Saves the arrays of the index as .npy files so that they can be memory-mapped.
+        Args:
+            folder: existing folder where to write the files
+        """
+        for name in _ARRAYS:
+            np.save(os.path.join(folder, name + '.npy'), getattr(self, name))
+        save_obj(self.answer_values, os.path.join(folder, 'answer_values'))
+
+    @classmethod
+    def load(cls, folder, mmap_mode='r'):
+        """ Loads an index saved with save. The products table is not restored.
+        Args:
+            folder: folder given to save
+            mmap_mode (default 'r'): passed to np.load, the arrays are shared
+                                     between the processes loading the same files
+        Returns:
+            catalog: CatalogIndex
+        """
+        catalog = cls.__new__(cls)
+        catalog.products_cat = None
+        for name in _ARRAYS:
+            setattr(catalog, name, np.load(os.path.join(folder, name + '.npy'),
+                                           mmap_mode=mmap_mode, allow_pickle=True))
+        catalog.answer_values = load_obj(os.path.join(folder, 'answer_values'))
+        catalog._init_lookups()
+        return catalog
+
+    def fingerprint(self):
+        """ Returns a hash of the content of the index (products, questions and answers). """
+        md5 = hashlib.md5()
+        md5.update(repr([list(self.product_ids), list(self.question_ids)]).encode())
+        for name in ['row_product', 'row_question', 'row_code', 'row_count', 'product_weight']:
+            md5.update(np.ascontiguousarray(getattr(self, name)).tobytes())
+        md5.update(repr([list(values) for values in self.answer_values]).encode())
+        return md5.hexdigest()
+
+    def _init_lookups(self):
+        """ Builds the dictionaries and constants derived from the arrays. """
+        self.n_products = len(self.product_ids)
+        self.n_questions = len(self.question_ids)
+        self.n_bytes = (self.n_products + 7) // 8
+        self.compressed = len(self.member_ids) != self.n_products
+        self._product_index = pd.Index(self.member_ids)
+        self._question_pos = {int(float(q)): j for j, q in enumerate(self.question_ids)}
+        self._answer_codes = [{_answer_key(a): c for c, a in enumerate(values)} for values in self.answer_values]
+        self._empty = np.zeros(self.n_bytes, dtype=np.uint8)
+        self._full = np.packbits(np.ones(self.n_products, dtype=bool))
+        # rows grouped by product (see product_rows)
+        self._rows_by_product = np.argsort(self.row_product, kind='stable')
+        self._product_offsets = np.concatenate([[0], np.cumsum(np.bincount(self.row_product,
+                                                                            minlength=self.n_products))])
+
+    def full_mask(self):
+        """ Returns the state where every product of the catalog is still available. """
+        return self._full.copy()
+
+    def mask_of(self, product_ids):
+        """ Returns the mask selecting the given ProductIds.
+        Args:
+            product_ids: iterable of ProductId (unknown ids are ignored)
+        Returns:
+            mask: packed bitmap over the products of the catalog
+        """
+        dense = np.zeros(self.n_products, dtype=bool)
+        pos = self.positions(product_ids)
+        dense[pos[pos >= 0]] = True
+        return np.packbits(dense)
+
+    def positions(self, product_ids):
+        """ Returns the position of each ProductId in the catalog (-1 if unknown). """
+        idx = self._product_index.get_indexer(np.asarray(product_ids))
+        return np.where(idx >= 0, self.member_position[idx], -1)
+
+    def product_rows(self, positions, return_owner=False):
+        """ Returns the rows of the given product positions (all their questions).
+        Args:
+            positions: product positions (may be repeated)
+            return_owner (default False): also return, for each row, its index in positions
+        """
+        starts = self._product_offsets[positions]
+        lengths = self._product_offsets[np.asarray(positions) + 1] - starts
+        idx = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        if return_owner:
+            return self._rows_by_product[idx], np.repeat(np.arange(len(lengths)), lengths)
+        return self._rows_by_product[idx]
+
+    def to_bool(self, mask):
+        """ Unpacks a mask to a boolean array over the products of the catalog. """
+        return np.unpackbits(mask, count=self.n_products).astype(bool)
+
+    def question_index(self, question):
+        """ Returns the position of a question in the catalog or -1 if unknown.
+        Args:
+            question: questionId (int, float or str)
+        """
+        return self._question_pos.get(int(float(question)), -1)
+
+    def question_rows(self, question):
+        """ Returns the slice of the rows of one question. """
+        j = self.question_index(question)
+        if j < 0:
+            return slice(0, 0)
+        return slice(self.q_offsets[j], self.q_offsets[j+1])
+
+    def encode_answers(self, question, answers):
+        """ Maps answers of a question to their integer code.
+        Args:
+            question: questionId
+            answers: list of answers (unknown answers and 'idk' are dropped)
+        Returns:
+            codes: array of answer codes, MISSING for a NaN answer (matched with
+                   missing_bitmaps, it has no global answer id)
+        """
+        j = self.question_index(question)
+        if j < 0:
+            return np.zeros(0, dtype=np.int32)
+        mapping = self._answer_codes[j]
+        codes = [MISSING if _is_missing(a) else mapping.get(_answer_key(a), None) for a in answers]
+        return np.asarray([c for c in codes if c is not None], dtype=np.int32)
+
+    def answer_ids(self, question, answers):
+        """ Maps answers of a question to their global answer id (see code_offsets).
+        Args:
+            question: questionId
+            answers: list of answers
+        Returns:
+            ids: array aligned with answers, -1 for the answers unknown to the catalog
+        """
+        j = self.question_index(question)
+        if j < 0:
+            return np.full(len(answers), -1, dtype=np.int64)
+        mapping = self._answer_codes[j]
+        codes = np.asarray([mapping.get(_answer_key(a), -1) for a in answers], dtype=np.int64)
+        return np.where(codes >= 0, self.code_offsets[j] + codes, -1)
+
+    def decode_answers(self, question, codes):
+        """ Maps answer codes of a question back to the answers of the catalog (NaN for MISSING). """
+        codes = np.asarray(codes, dtype=np.int64)
+        values = self.answer_values[self.question_index(question)]
+        known = codes != MISSING
+        if known.all():
+            return values[codes]
+        answers = np.full(len(codes), np.nan, dtype=values.dtype if values.dtype.kind == 'f' else object)
+        answers[known] = values[codes[known]]
+        return answers
+
+    def match(self, question, answers):
+        """ Finds the products matching one of the answers to a question.
+        Args:
+            question: questionId
+            answers: list of answers, ['idk'] matches every product
+        Returns:
+            mask: packed bitmap over the products of the catalog (OR of the answer bitmaps)
+        """
+        if np.array_equal(["idk"], answers):
+            return self.full_mask()
+        j = self.question_index(question)
+        codes = self.encode_answers(question, answers)
+        if j < 0 or len(codes) == 0:
+            return self._empty.copy()
+        bitmaps = self.bitmaps[self.code_offsets[j] + codes[codes != MISSING]]
+        if (codes == MISSING).any():
+            bitmaps = np.vstack([bitmaps, self.missing_bitmaps[j]])
+        return np.bitwise_or.reduce(bitmaps, axis=0)
+
+    def select(self, mask, question, answers):
+        """ Equivalent of algo_utils.select_subset on a mask.
+        Args:
+            mask: current state (packed bitmap of the remaining products)
+            question: filter used
+            answers: answers given to the filter
+        Returns:
+            mask: restricted state
+        """
+        if np.array_equal(["idk"], answers):
+            return mask
+        return np.bitwise_and(mask, self.match(question, answers))
+
+    def count(self, mask):
+        """ Returns the number of products still available in the state. """
+        if not self.compressed:
+            return popcount(mask)
+        return int(self.product_weight[self.to_bool(mask)].sum())
+
+    def products(self, mask):
+        """ Returns the ProductIds still available in the state (all the members of the classes). """
+        if not self.compressed:
+            return self.product_ids[self.to_bool(mask)]
+        return self.member_ids[self.to_bool(mask)[self.member_position]]
+
+    def questions(self, mask):
+        """ Equivalent of algo_utils.get_questions on a mask.
+        Returns:
+            questions: questionIds answered by at least one remaining product
+        """
+        used = np.unique(self.row_question[self.to_bool(mask)[self.row_product]])
+        return self.question_ids[used]
+
+    def informative_questions(self, mask, questions, priority=None):
+        """ Pre-pass on the candidate questions of a state.
+
+        Note:
+            A question is dropped if no answer can change the state (every
+            remaining product has the same single answer, or no answer at all)
+            or if another candidate splits the remaining products into exactly
+            the same groups: of such questions only the one with the highest
+            priority (the first in the order of the catalog among equals) is
+            kept. On the full mask this is the pre-pass at build time, after
+            each answer it drops the questions made useless by it.
+
+        Args:
+            mask: current state
+            questions: candidate questionIds
+            priority (default None): array aligned with questions, e.g. the history
+                                     prior of opt_step which weights the score of the
+                                     questions splitting the products the same way
+        Returns:
+            questions: kept questionIds, in the given order
+        """
+        questions = list(questions)
+        if priority is None:
+            priority = np.zeros(len(questions))
+        kept = set()
+        splits = set()
+        for i in sorted(range(len(questions)), key=lambda i: (-priority[i], self.question_index(questions[i]))):
+            j = self.question_index(questions[i])
+            if j < 0:
+                continue
+            groups = np.bitwise_and(np.vstack([self.bitmaps[self.code_offsets[j]:self.code_offsets[j+1]],
+                                               self.missing_bitmaps[j]]), mask)
+            groups = groups[groups.any(axis=1)]
+            if len(groups) == 0 or (len(groups) == 1 and np.array_equal(groups[0], mask)):
+                continue
+            split = b''.join(sorted(g.tobytes() for g in groups))
+            if split not in splits:
+                splits.add(split)
+                kept.add(i)
+        return [q for i, q in enumerate(questions) if i in kept]
+
+    def answer_set(self, mask, question):
+        """ Returns the distinct answers to a question among the remaining products (NaN included). """
+        rows = self.question_rows(question)
+        codes = pd.unique(self.row_code[rows][self.to_bool(mask)[self.row_product[rows]]])
+        return self.decode_answers(question, codes)
+
+    def restrict(self, table, mask, column="Items_ProductId"):
+        """ Restricts the traffic or purchased table to the products of the state.
+        Args:
+            table: traffic or purchased table (or [] if not used)
+            mask: current state
+            column: column of table holding the ProductId
+        Returns:
+            table: restricted table
+        """
+        if len(table) == 0:
+            return table
+        pos = self.positions(table[column].values)
+        keep = (pos >= 0) & self.to_bool(mask)[np.maximum(pos, 0)]
+        return table.loc[keep]
+
+    def purchase_counts(self, purchased_set):
+        """ Aggregates the purchased table to the number of items sold per product.
+        Args:
+            purchased_set: purchased table [ProductId, UserId, OrderId, SessionId,
+                                            Items_ProductId, Items_ItemCount] (or [])
+        Returns:
+            sold: array aligned with product_ids (total of the members of each class)
+        """
+        if len(purchased_set) == 0:
+            return np.zeros(self.n_products)
+        pos = self.positions(purchased_set["ProductId"].values)
+        known = pos >= 0
+        return np.bincount(pos[known], weights=purchased_set["Items_ItemCount"].values[known],
+                           minlength=self.n_products)
+
+    def product_table(self, mask):
+        """ Returns the rows of the product table for the products of the state. """
+        return self.products_cat.loc[self.products_cat["ProductId"].isin(self.products(mask))]
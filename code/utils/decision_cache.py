@@ -0,0 +1,206 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+This module defines the cache of the greedy next-question decisions.
+
+The question chosen by opt_step only depends on the state (the questions
+asked so far with their answers) and on the history parameters, the tables
+being fixed for a run. Simulated users and DAgger episodes share many
+states (typically the first questions with 'idk' or popular answers), so
+the decisions are memoized with a least recently used eviction and can
+be saved to disk to be reused by later runs. When the tables were refreshed
+with new purchases since the decisions were saved (see utils/refresh.py),
+only the decisions of the states where a product got new data are dropped.
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import hashlib
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+from utils.load_utils import load_obj, save_obj
+
+
+def _canonical_answer(answer):
+    """ Answers are compared as floats when possible, as strings otherwise ('idk'). """
+    try:
+        return float(answer)
+    except (TypeError, ValueError):
+        return str(answer)
+
+
+def answers_key(answers):
+    """ Canonical encoding of the answers given to a question.
+    Args:
+        answers: single answer or list of answers
+    Returns:
+        key: sorted tuple of the distinct answers
+    """
+    if isinstance(answers, str) or not hasattr(answers, '__iter__'):
+        answers = [answers]
+    return tuple(sorted(set(_canonical_answer(a) for a in answers), key=lambda a: (isinstance(a, str), a)))
+
+
+def history_digest(df_history):
+    """ Hash of the content of the history table (None if there is no history table). """
+    if not isinstance(df_history, pd.DataFrame):
+        return None
+    return hashlib.md5(pd.util.hash_pandas_object(df_history, index=False).values.tobytes()).hexdigest()
+
+
+def tables_tag(catalog, n_traffic, n_purchased, df_history=None):
+    """ Description of the tables the decisions are computed on.
+    Args:
+        catalog: CatalogIndex of the product table (and of the purchases)
+        n_traffic: number of rows of the traffic table
+        n_purchased: number of rows of the purchased table
+        df_history (default None): history table of the filters (the df_history artifact)
+    """
+    return (catalog.fingerprint(), n_traffic, n_purchased, history_digest(df_history))
+
+
+def state_mask(catalog, key):
+    """ Returns the mask of the products remaining in the state of a key (see state_key). """
+    mask = catalog.full_mask()
+    for question, answers in key[0]:
+        mask = catalog.select(mask, question, list(answers))
+    return mask
+
+
+def state_key(state, a_hist=0, alpha=1, scoring='exact'):
+    """ Canonical encoding of a state.
+    Args:
+        state: {question1: answers1, question2: answers2, ...}, the answers
+               being a single answer or a list of answers
+        a_hist (default 0): importance of the history filters used by opt_step
+        alpha (default 1): weight of the history in the answer distribution
+        scoring (default 'exact'): how the decision is computed, 'exact' for the
+                                   modes of opt_step scoring every question exactly,
+                                   otherwise the approximate step (e.g. 'sample'),
+                                   so that approximate decisions are never served as exact
+    Returns:
+        key: hashable key, independent of the order of the questions and answers
+             and of the types used for the ids (int, float or str)
+    """
+    items = [(int(float(q)), answers_key(answers)) for q, answers in state.items()]
+    return (tuple(sorted(items)), float(a_hist), float(alpha), scoring)
+
+
+def _refreshed(saved_tag, tag, refresh_log, catalog):
+    """ Follows the refreshes from the tables of saved_tag to the ones of tag.
+    Returns:
+        stale: function telling if the decision of a key is affected by the refreshes,
+               None if the tables of tag are not refreshed from the ones of saved_tag
+    """
+    products = set()
+    history = False
+    for refresh in refresh_log:
+        size = len(refresh["from"])
+        if tuple(saved_tag[:size]) == refresh["from"]:
+            saved_tag = refresh["to"] + tuple(saved_tag[size:])
+            products.update(refresh["products"])
+            history = history or refresh["history"]
+    if saved_tag != tag:
+        return None
+    products = np.asarray(sorted(products))
+
+    def stale(key):
+        # the prior on the questions is built from the whole history
+        if history and key[1] > 0:
+            return True
+        return np.isin(catalog.products(state_mask(catalog, key)), products).any()
+    return stale
+
+
+class DecisionCache(object):
+    """ LRU cache of the next question to ask given a state.
+
+    Example:
+        >>> cache = DecisionCache(maxsize=10000, filename='../data/decision_cache')
+        >>> key = state_key({}, a_hist)
+        >>> next_question = cache.get(key)
+        >>> if next_question is None:
+        ...     next_question = opt_step(...)
+        ...     cache.put(key, next_question)
+        >>> cache.save()
+    """
+    def __init__(self, maxsize=10000, filename=None, tag=None, refresh_log=None, catalog=None):
+        """
+        Args:
+            maxsize (default 10000): maximal number of decisions kept in memory
+            filename (default None): file (without .pkl) where the cache is
+                                     persisted, loaded if it exists
+            tag (default None): description of the tables the decisions were
+                                computed on (see tables_tag, possibly followed by
+                                options), a saved cache with another tag is ignored
+            refresh_log (default None): refreshes of the tables (see utils/refresh.py),
+                                        a saved cache whose tables were refreshed to the
+                                        current ones only loses the decisions they affect
+            catalog (default None): CatalogIndex of the current tables, needed with refresh_log
+        """
+        self.maxsize = maxsize
+        self.filename = filename
+        self.tag = tag
+        self.hits = 0
+        self.misses = 0
+        self._decisions = OrderedDict()
+        if filename is not None and os.path.exists(filename + '.pkl'):
+            saved = load_obj(filename)
+            stale = None
+            if saved["tag"] != tag and refresh_log is not None:
+                stale = _refreshed(saved["tag"], tag, refresh_log, catalog)
+            if saved["tag"] == tag or stale is not None:
+                for key, question in saved["decisions"]:
+                    if stale is None or not stale(key):
+                        self.put(key, question)
+                print("Loaded {} cached decisions from {}".format(len(self), filename))
+                if stale is not None:
+                    print("Dropped {} decisions affected by the refreshes of the tables".format(
+                        len(saved["decisions"]) - len(self)))
+            else:
+                print("Cached decisions in {} were computed on other tables, ignoring them".format(filename))
+
+    def __len__(self):
+        return len(self._decisions)
+
+    def __contains__(self, key):
+        return key in self._decisions
+
+    def get(self, key):
+        """ Returns the cached question for key (None if unknown) and counts the hit or miss. """
+        question = self._decisions.get(key)
+        if question is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._decisions.move_to_end(key)
+        return question
+
+    def put(self, key, question):
+        """ Stores the question to ask for key, evicting the least recently used decision if full. """
+        self._decisions[key] = question
+        self._decisions.move_to_end(key)
+        while len(self._decisions) > self.maxsize:
+            self._decisions.popitem(last=False)
+
+    def stats(self):
+        """ Returns a dict with the number of hits, misses, the hit rate and the size of the cache. """
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / float(total) if total > 0 else 0.0,
+                "size": len(self)}
+
+    def save(self, filename=None):
+        """ Saves the decisions (from the least to the most recently used) to filename.pkl.
+        Args:
+            filename (default None): defaults to the filename given at creation
+        """
+        filename = filename if filename is not None else self.filename
+        if filename is None:
+            raise ValueError("No filename given to save the decision cache")
+        save_obj({"tag": self.tag, "decisions": list(self._decisions.items())}, filename)
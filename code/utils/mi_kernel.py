@@ -0,0 +1,655 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+This module defines the vectorized mutual information kernel used by
+the maxMI algorithm on the compiled catalog (see utils.catalog_index).
+
+MaxMI_Algo.mutual_inf calls conditional_entropy once per possible answer
+and every call filters the tables again. Here all the answers of a
+question are scored in one pass over the rows of the question: the
+answer probabilities and the conditional entropies are grouped sums
+(np.bincount) over the answer codes of the remaining products.
+"""
+import time
+import numpy as np
+import pandas as pd
+
+
+class TrafficHistory(object):
+    """ Answers selected in the traffic table, exploded once to integer arrays.
+
+    Note:
+        history_answer_counts_all scans the answers_selected dict of every
+        remaining session at every step. Here the traffic table is exploded
+        once to one entry per (session, question, selected answer) holding the
+        catalog position of the purchased product, the position of the question
+        and the global answer id (-1 if the answer is unknown to the catalog).
+        The historical answers of the sessions of the remaining products (the
+        rows kept by catalog.restrict) are then a masked bincount.
+
+    Example:
+        >>> history = TrafficHistory(catalog, traffic_cat)
+        >>> counts, totals = history.answer_counts(mask)
+    """
+    def __init__(self, catalog, traffic_cat):
+        """
+        Args:
+            catalog: compiled catalog
+            traffic_cat: traffic table [SessionId, answers_selected, Items_ProductId] (or [])
+        """
+        self.catalog = catalog
+        keys = {str(q): j for j, q in enumerate(catalog.question_ids)}
+        products, questions, answers = [], [], []
+        if len(traffic_cat) > 0:
+            session_product = catalog.positions(traffic_cat["Items_ProductId"].values)
+            for product, r_dict in zip(session_product, traffic_cat["answers_selected"].values):
+                if product < 0:
+                    continue
+                for k, selected in r_dict.items():
+                    j = keys.get(k, -1)
+                    if j >= 0:
+                        products.extend([product] * len(selected))
+                        questions.extend([j] * len(selected))
+                        answers.extend(selected)
+        self.entry_product = np.asarray(products, dtype=np.int64)
+        self.entry_question = np.asarray(questions, dtype=np.int64)
+        self.entry_answer = np.full(len(answers), -1, dtype=np.int64)
+        # encode the answers question by question
+        answers = np.asarray(answers, dtype=object)
+        for j, entries in pd.Series(self.entry_question).groupby(self.entry_question).indices.items():
+            self.entry_answer[entries] = catalog.answer_ids(catalog.question_ids[j], answers[entries])
+
+    def __len__(self):
+        return len(self.entry_product)
+
+    def answer_counts(self, mask):
+        """ Counts the historical answers of the sessions of the remaining products.
+        Args:
+            mask: packed bitmap of the remaining products
+        Returns:
+            counts: number of times each global answer id was selected
+            totals: total number of historical answers per question position
+        """
+        catalog = self.catalog
+        keep = catalog.to_bool(mask)[self.entry_product]
+        known = keep & (self.entry_answer >= 0)
+        counts = np.bincount(self.entry_answer[known], minlength=catalog.code_offsets[-1]).astype(float)
+        totals = np.bincount(self.entry_question[keep], minlength=catalog.n_questions).astype(float)
+        return counts, totals
+
+
+def history_answer_counts(catalog, question, traffic_set, history=None, mask=None):
+    """ Counts the historical answers given to a question.
+    Args:
+        catalog: compiled catalog
+        question: questionId
+        traffic_set: traffic table restricted to the remaining products
+                     [SessionId, answers_selected, Items_ProductId]
+        history (default None): exploded traffic table (see TrafficHistory), if given
+                                the sessions are selected by mask and traffic_set is ignored
+        mask (default None): packed bitmap of the remaining products, used with history
+    Returns:
+        counts: number of times each answer code was selected
+        total: total number of historical answers (including answers
+               that are not in the catalog)
+    """
+    j = catalog.question_index(question)
+    n_codes = len(catalog.answer_values[j]) if j >= 0 else 0
+    if history is not None and j >= 0:
+        counts, totals = history.answer_counts(mask)
+        return counts[catalog.code_offsets[j]:catalog.code_offsets[j+1]], totals[j]
+    counts = np.zeros(n_codes)
+    if len(traffic_set) == 0 or j < 0:
+        return counts, 0
+    history_answered = []
+    for r_dict in traffic_set["answers_selected"].values:
+        if str(question) in r_dict:
+            history_answered.extend(r_dict[str(question)])
+    codes = catalog.encode_answers(question, history_answered)
+    counts += np.bincount(codes[codes >= 0], minlength=n_codes)
+    return counts, len(history_answered)
+
+
+def answer_tables(catalog, mask, question, sold, hist_counts=None, hist_total=0, alpha=1, alpha_y=1):
+    """ Computes, in one pass, the answer distribution of a question and the
+    conditional negative entropy of the product distribution given each answer.
+
+    Note:
+        Same definitions as algo_utils.get_proba_A_distribution_none and
+        MaxMI_Algo.conditional_entropy: the products are weighted by
+        1/n + alpha_y * sold/total_sold within each answer, and the 'idk'
+        bucket keeps every remaining product with a uniform distribution.
+        On a compressed catalog every row stands for product_weight members,
+        the items sold of a class being shared equally by its members.
+
+    Args:
+        catalog: compiled catalog
+        mask: packed bitmap of the remaining products
+        question: questionId
+        sold: per-product number of items sold (aligned with catalog.product_ids)
+        hist_counts (default None): historical counts per answer code (see history_answer_counts)
+        hist_total (default 0): total number of historical answers
+        alpha (default 1): weight of the history in the answer distribution
+        alpha_y (default 1): weight of the purchases in the product distribution
+    Returns:
+        codes: answer codes present among the remaining products
+        proba_a: probability of each answer in codes
+        neg_entropy_a: sum of p log p of the products given each answer in codes
+        proba_idk: probability of the 'idk' answer
+        neg_entropy_idk: sum of p log p of the products given 'idk'
+    """
+    in_mask = catalog.to_bool(mask)
+    n = catalog.count(mask)
+    rows = catalog.question_rows(question)
+    keep = in_mask[catalog.row_product[rows]]
+    products = catalog.row_product[rows][keep]
+    codes = catalog.row_code[rows][keep]
+    multiplicity = catalog.row_count[rows][keep]
+    has_answer = np.zeros(catalog.n_products, dtype=bool)
+    has_answer[products] = True
+    nb_prod_without_answer = n - catalog.product_weight[has_answer].sum()
+
+    known = codes >= 0
+    products, codes, multiplicity = products[known], codes[known], multiplicity[known]
+    n_codes = len(catalog.answer_values[catalog.question_index(question)]) if len(codes) else 0
+
+    # Answer distribution: fraction of rows per answer + alpha * history
+    members = catalog.product_weight[products].astype(float)
+    nb_rows = np.bincount(codes, weights=multiplicity * members, minlength=n_codes)
+    present = np.nonzero(nb_rows)[0]
+    proba_a = nb_rows[present] / float(n)
+    if hist_counts is not None and hist_total > 0:
+        proba_a = proba_a + alpha * hist_counts[present] / float(hist_total)
+    proba_idk = nb_prod_without_answer / float(n) if n > 0 else 0.0
+    norm = proba_a.sum() + proba_idk
+    proba_a = proba_a / norm
+    proba_idk = proba_idk / norm
+
+    # Product distribution given each answer: segment sums over the answer codes
+    weights = sold[products].astype(float)
+    n_a = np.bincount(codes, weights=members, minlength=n_codes)
+    sold_a = np.bincount(codes, weights=weights, minlength=n_codes)
+    has_sold = sold_a > 0
+    history_part = np.where(has_sold[codes], weights / members / np.where(has_sold, sold_a, 1.0)[codes], 0.0)
+    p_y = (1.0 / n_a[codes] + alpha_y * history_part) / (1.0 + alpha_y * has_sold[codes])
+    neg_entropy_a = np.bincount(codes, weights=members * p_y * np.log(p_y), minlength=n_codes)[present]
+    neg_entropy_idk = -np.log(n) if n > 0 else 0.0
+    return present, proba_a, neg_entropy_a, proba_idk, neg_entropy_idk
+
+
+def mutual_inf_kernel(catalog, mask, question, sold, traffic_set=[], alpha=1, history=None):
+    """ Vectorized equivalent of MaxMI_Algo.mutual_inf on the compiled catalog.
+    Args:
+        catalog: compiled catalog
+        mask: packed bitmap of the remaining products
+        question: questionId
+        sold: per-product number of items sold (see CatalogIndex.purchase_counts)
+        traffic_set (default []): traffic table restricted to the remaining products
+        alpha (default 1): weight of the history in the answer distribution
+        history (default None): exploded traffic table replacing traffic_set (see TrafficHistory)
+    Returns:
+        short_mutual_info: mutual info for that given question
+    """
+    hist_counts, hist_total = history_answer_counts(catalog, question, traffic_set, history, mask)
+    _, proba_a, neg_entropy_a, proba_idk, neg_entropy_idk = answer_tables(catalog, mask, question, sold,
+                                                                          hist_counts, hist_total, alpha)
+    return np.sum(proba_a * neg_entropy_a) + proba_idk * neg_entropy_idk
+
+
+def history_answer_counts_all(catalog, questions, traffic_set, history=None, mask=None):
+    """ Counts the historical answers of several questions in one scan of the traffic table.
+    Args:
+        catalog: compiled catalog
+        questions: list of questionIds
+        traffic_set: traffic table restricted to the remaining products
+        history (default None): exploded traffic table (see TrafficHistory), if given
+                                the sessions are selected by mask and traffic_set is ignored
+        mask (default None): packed bitmap of the remaining products, used with history
+    Returns:
+        counts: number of times each global answer id was selected
+        totals: total number of historical answers per question position
+                (with history, all the questions are counted)
+    """
+    if history is not None:
+        return history.answer_counts(mask)
+    counts = np.zeros(catalog.code_offsets[-1])
+    totals = np.zeros(catalog.n_questions)
+    if len(traffic_set) == 0:
+        return counts, totals
+    keys = {str(q): q for q in questions if catalog.question_index(q) >= 0}
+    history_answered = dict((k, []) for k in keys)
+    for r_dict in traffic_set["answers_selected"].values:
+        for k in r_dict:
+            if k in history_answered:
+                history_answered[k].extend(r_dict[k])
+    for k, answers in history_answered.items():
+        j = catalog.question_index(keys[k])
+        codes = catalog.encode_answers(keys[k], answers)
+        np.add.at(counts, catalog.code_offsets[j] + codes[codes >= 0], 1)
+        totals[j] += len(answers)
+    return counts, totals
+
+
+def score_questions(catalog, mask, questions, sold, traffic_set=[], alpha=1, alpha_y=1, history=None):
+    """ Batched equivalent of MaxMI_Algo.mutual_inf for several questions.
+
+    Note:
+        The rows of the catalog index are the non-zero entries of the
+        product x question answer-code matrix. All the candidate questions
+        are scored with a few bincounts over the global answer ids of these
+        rows (see answer_tables for the definitions).
+
+    Args:
+        catalog: compiled catalog
+        mask: packed bitmap of the remaining products
+        questions: list of candidate questionIds
+        sold: per-product number of items sold (see CatalogIndex.purchase_counts)
+        traffic_set (default []): traffic table restricted to the remaining products
+        alpha (default 1): weight of the history in the answer distribution
+        alpha_y (default 1): weight of the purchases in the product distribution
+        history (default None): exploded traffic table replacing traffic_set (see TrafficHistory)
+    Returns:
+        mutual_array: mutual info of each question, in the order of questions
+    """
+    n_q = catalog.n_questions
+    n_g = catalog.code_offsets[-1]
+    in_mask = catalog.to_bool(mask)
+    n = catalog.count(mask)
+    q_pos = np.asarray([catalog.question_index(q) for q in questions], dtype=np.int64)
+    candidate = np.zeros(n_q, dtype=bool)
+    candidate[q_pos[q_pos >= 0]] = True
+
+    keep = in_mask[catalog.row_product] & candidate[catalog.row_question]
+    r_question = catalog.row_question[keep]
+    r_answer = catalog.row_answer[keep]
+    r_product = catalog.row_product[keep]
+    r_count = catalog.row_count[keep]
+    r_members = catalog.product_weight[r_product].astype(float)
+    first = catalog.row_first[keep]
+    nb_with_answer = np.bincount(r_question[first], weights=r_members[first], minlength=n_q)
+    known = r_answer >= 0
+    r_answer, r_product, r_count, r_members = r_answer[known], r_product[known], r_count[known], r_members[known]
+
+    # Answer distributions of all the questions
+    nb_rows = np.bincount(r_answer, weights=r_count * r_members, minlength=n_g)
+    present = np.nonzero(nb_rows)[0]
+    present_q = catalog.answer_question[present]
+    proba_a = nb_rows[present] / float(n)
+    hist_counts, hist_totals = history_answer_counts_all(catalog, questions, traffic_set, history, mask)
+    with_hist = hist_totals[present_q] > 0
+    proba_a[with_hist] += alpha * hist_counts[present][with_hist] / hist_totals[present_q][with_hist]
+    proba_idk = (n - nb_with_answer) / float(n)
+    norm = np.bincount(present_q, weights=proba_a, minlength=n_q) + proba_idk
+    norm[norm == 0] = 1.0
+    proba_a = proba_a / norm[present_q]
+    proba_idk = proba_idk / norm
+
+    # Product distributions given every answer of every question
+    weights = sold[r_product].astype(float)
+    n_a = np.bincount(r_answer, weights=r_members, minlength=n_g)
+    sold_a = np.bincount(r_answer, weights=weights, minlength=n_g)
+    has_sold = sold_a > 0
+    history_part = np.where(has_sold[r_answer], weights / r_members / np.where(has_sold, sold_a, 1.0)[r_answer], 0.0)
+    p_y = (1.0 / n_a[r_answer] + alpha_y * history_part) / (1.0 + alpha_y * has_sold[r_answer])
+    neg_entropy_a = np.bincount(r_answer, weights=r_members * p_y * np.log(p_y), minlength=n_g)
+
+    mutual = np.bincount(present_q, weights=proba_a * neg_entropy_a[present], minlength=n_q)
+    mutual += proba_idk * -np.log(n)
+    # questions unknown to the catalog only have the 'idk' answer
+    return np.where(q_pos >= 0, mutual[np.maximum(q_pos, 0)], -np.log(n))
+
+
+def sample_score_questions(catalog, mask, questions, sold, sample_size, traffic_set=[], alpha=1, alpha_y=1,
+                           rng=None, history=None):
+    """ Estimates score_questions from a sample of the remaining products.
+
+    Note:
+        The products are drawn with replacement from the product distribution
+        1/n + alpha_y * sold/total_sold (as algo_utils.get_proba_Y_distribution)
+        and every draw is weighted by 1/(sample_size * proba) so that the sums
+        over the sampled rows are unbiased estimates of the sums over all the
+        remaining products (number of products per answer, items sold per
+        answer and sum of P(a) p log p). The standard error of each question
+        is estimated from the spread of its per-draw contributions.
+
+    Args:
+        catalog: compiled catalog
+        mask: packed bitmap of the remaining products
+        questions: list of candidate questionIds
+        sold: per-product number of items sold (see CatalogIndex.purchase_counts)
+        sample_size: number of draws
+        traffic_set (default []): traffic table restricted to the remaining products
+        alpha (default 1): weight of the history in the answer distribution
+        alpha_y (default 1): weight of the purchases in the product distribution
+        rng (default None): np.random.RandomState used for the draws
+        history (default None): exploded traffic table replacing traffic_set (see TrafficHistory)
+    Returns:
+        mutual_array: estimated mutual info of each question, in the order of questions
+        std_error: standard error of each estimate
+    """
+    rng = rng if rng is not None else np.random
+    n_q = catalog.n_questions
+    n_g = catalog.code_offsets[-1]
+    positions = np.nonzero(catalog.to_bool(mask))[0]
+    members = catalog.product_weight[positions].astype(float)
+    n = members.sum()
+    q_pos = np.asarray([catalog.question_index(q) for q in questions], dtype=np.int64)
+    candidate = np.zeros(n_q, dtype=bool)
+    candidate[q_pos[q_pos >= 0]] = True
+
+    # Draws and their weights
+    sold_left = np.asarray(sold, dtype=float)[positions]
+    proba_y = members / n
+    if sold_left.sum() > 0:
+        proba_y = proba_y + alpha_y * sold_left / sold_left.sum()
+    proba_y = proba_y / proba_y.sum()
+    draws = rng.choice(len(positions), size=sample_size, p=proba_y)
+    weights = 1.0 / (sample_size * proba_y[draws])
+    rows, row_draw = catalog.product_rows(positions[draws], return_owner=True)
+    keep = candidate[catalog.row_question[rows]]
+    rows, row_draw = rows[keep], row_draw[keep]
+    row_weight = weights[row_draw] * members[draws][row_draw]
+    nb_with_answer = np.bincount(catalog.row_question[rows[catalog.row_first[rows]]],
+                                 weights=row_weight[catalog.row_first[rows]], minlength=n_q)
+    known = catalog.row_answer[rows] >= 0
+    rows, row_draw, row_weight = rows[known], row_draw[known], row_weight[known]
+    r_answer = catalog.row_answer[rows]
+
+    # Estimated answer distributions
+    nb_rows = np.bincount(r_answer, weights=row_weight * catalog.row_count[rows], minlength=n_g)
+    proba_a = nb_rows / float(n)
+    hist_counts, hist_totals = history_answer_counts_all(catalog, questions, traffic_set, history, mask)
+    with_hist = (hist_totals[catalog.answer_question] > 0) & (nb_rows > 0)
+    proba_a[with_hist] += alpha * hist_counts[with_hist] / hist_totals[catalog.answer_question][with_hist]
+    proba_idk = np.maximum(n - nb_with_answer, 0.0) / float(n)
+    norm = np.bincount(catalog.answer_question, weights=proba_a, minlength=n_q) + proba_idk
+    norm[norm == 0] = 1.0
+    proba_a = proba_a / norm[catalog.answer_question]
+    proba_idk = proba_idk / norm
+
+    # Estimated product distributions given the answers
+    row_sold = np.asarray(sold, dtype=float)[catalog.row_product[rows]] / catalog.product_weight[catalog.row_product[rows]]
+    n_a = np.bincount(r_answer, weights=row_weight, minlength=n_g)
+    sold_a = np.bincount(r_answer, weights=row_weight * row_sold, minlength=n_g)
+    has_sold = sold_a > 0
+    history_part = np.where(has_sold[r_answer], row_sold / np.where(has_sold, sold_a, 1.0)[r_answer], 0.0)
+    p_y = (1.0 / n_a[r_answer] + alpha_y * history_part) / (1.0 + alpha_y * has_sold[r_answer])
+    contribution = proba_a[r_answer] * p_y * np.log(p_y)
+
+    # Per-draw contributions of each question: mean and standard error
+    keys, inverse = np.unique(row_draw.astype(np.int64) * n_q + catalog.row_question[rows], return_inverse=True)
+    per_draw = np.bincount(inverse, weights=sample_size * row_weight * contribution)
+    key_question = keys % n_q
+    mean = np.bincount(key_question, weights=per_draw, minlength=n_q) / sample_size
+    second = np.bincount(key_question, weights=per_draw ** 2, minlength=n_q) / sample_size
+    std_error = np.sqrt(np.maximum(second - mean ** 2, 0.0) / sample_size)
+    mutual = mean + proba_idk * -np.log(n)
+    known_q = q_pos >= 0
+    return (np.where(known_q, mutual[np.maximum(q_pos, 0)], -np.log(n)),
+            np.where(known_q, std_error[np.maximum(q_pos, 0)], 0.0))
+
+
+class AnswerHistograms(object):
+    """ Answer histograms of every question under a product mask, updated incrementally.
+
+    Note:
+        score_questions groups all the rows of the remaining products at every
+        step. Here the answer counts and the purchase-weighted sums of every
+        answer are kept between the steps: when the mask changes only the rows
+        of the removed (or added) products are subtracted (or added). Within an
+        answer the products that were never sold share the same probability, so
+        only the rows of the sold products are visited to get the entropies.
+        On a compressed catalog the counts are weighted by the number of
+        members of each class (see CatalogIndex.product_weight).
+
+    Example:
+        >>> histograms = AnswerHistograms(catalog, catalog.purchase_counts(purchased_cat))
+        >>> histograms.update(mask)
+        >>> mutual_array = histograms.score(questions, traffic_set)
+    """
+    def __init__(self, catalog, sold, mask=None, alpha_y=1, history=None):
+        """
+        Args:
+            catalog: compiled catalog
+            sold: per-product number of items sold (see CatalogIndex.purchase_counts)
+            mask (default None): initial remaining products, full catalog if None
+            alpha_y (default 1): weight of the purchases in the product distribution
+            history (default None): exploded traffic table (see TrafficHistory), if given the
+                                    historical answers are counted under the current mask
+                                    and the traffic_set given to the scoring methods is ignored
+        """
+        self.catalog = catalog
+        self.history = history
+        self.sold = np.asarray(sold, dtype=float)
+        self.members = catalog.product_weight.astype(float)
+        self.alpha_y = alpha_y
+        n_g = catalog.code_offsets[-1]
+        self.nb_rows = np.zeros(n_g)            # rows (with multiplicity) per answer
+        self.n_a = np.zeros(n_g)                # products per answer
+        self.sold_a = np.zeros(n_g)             # items sold per answer
+        self.n_sold_a = np.zeros(n_g)           # products sold at least once per answer
+        self.nb_with_answer = np.zeros(catalog.n_questions)
+        self.n = 0
+        self.in_mask = np.zeros(catalog.n_products, dtype=bool)
+        self.mask = np.zeros(catalog.n_bytes, dtype=np.uint8)
+        is_sold = self.sold[catalog.row_product] > 0
+        self.sold_rows = np.nonzero(is_sold & (catalog.row_answer >= 0))[0]
+        self.update(mask if mask is not None else catalog.full_mask())
+
+    def _apply(self, positions, sign):
+        """ Adds (sign=1) or subtracts (sign=-1) the rows of the given products. """
+        catalog = self.catalog
+        n_g = len(self.nb_rows)
+        rows = catalog.product_rows(positions)
+        first = rows[catalog.row_first[rows]]
+        self.nb_with_answer += sign * np.bincount(catalog.row_question[first],
+                                                  weights=self.members[catalog.row_product[first]],
+                                                  minlength=catalog.n_questions)
+        rows = rows[catalog.row_answer[rows] >= 0]
+        answers = catalog.row_answer[rows]
+        weights = self.sold[catalog.row_product[rows]]
+        members = self.members[catalog.row_product[rows]]
+        self.nb_rows += sign * np.bincount(answers, weights=catalog.row_count[rows] * members, minlength=n_g)
+        self.n_a += sign * np.bincount(answers, weights=members, minlength=n_g)
+        self.sold_a += sign * np.bincount(answers, weights=weights, minlength=n_g)
+        self.n_sold_a += sign * np.bincount(answers, weights=members * (weights > 0), minlength=n_g)
+
+    def update(self, mask):
+        """ Moves the histograms to a new mask, visiting only the products that changed.
+        Args:
+            mask: packed bitmap of the remaining products
+        """
+        removed = np.nonzero(self.catalog.to_bool(self.mask & ~mask))[0]
+        added = np.nonzero(self.catalog.to_bool(mask & ~self.mask))[0]
+        if len(removed) > 0:
+            self._apply(removed, -1)
+            self.in_mask[removed] = False
+        if len(added) > 0:
+            self._apply(added, 1)
+            self.in_mask[added] = True
+        self.n += self.members[added].sum() - self.members[removed].sum()
+        self.mask = mask.copy()
+
+    def _answer_distributions(self, q_pos, questions, traffic_set, alpha):
+        """ Answer distributions of the candidate questions (see score_questions).
+        Returns:
+            candidate: boolean array, True for the positions of the candidate questions
+            present: global answer ids of the candidates present among the remaining products
+            proba_a: probability of each answer in present
+            proba_idk: probability of the 'idk' answer per question position
+        """
+        catalog = self.catalog
+        n_q = catalog.n_questions
+        candidate = np.zeros(n_q, dtype=bool)
+        candidate[q_pos[q_pos >= 0]] = True
+        present = np.nonzero((self.nb_rows > 0) & candidate[catalog.answer_question])[0]
+        present_q = catalog.answer_question[present]
+        proba_a = self.nb_rows[present] / float(self.n)
+        hist_counts, hist_totals = history_answer_counts_all(catalog, questions, traffic_set, self.history, self.mask)
+        with_hist = hist_totals[present_q] > 0
+        proba_a[with_hist] += alpha * hist_counts[present][with_hist] / hist_totals[present_q][with_hist]
+        proba_idk = (self.n - self.nb_with_answer) / float(self.n)
+        norm = np.bincount(present_q, weights=proba_a, minlength=n_q) + proba_idk
+        norm[norm == 0] = 1.0
+        return candidate, present, proba_a / norm[present_q], proba_idk / norm
+
+    def _unsold_neg_entropy(self, present):
+        """ Sum of p log p of the never-sold products of each answer in present.
+        Returns:
+            neg_entropy: sum over the never-sold products
+            sold_mass: total probability of the sold products of each answer
+        """
+        n_a = self.n_a[present]
+        has_sold = self.n_sold_a[present] > 0
+        p_0 = 1.0 / (n_a * (1.0 + self.alpha_y * has_sold))
+        n_unsold = n_a - self.n_sold_a[present]
+        return n_unsold * p_0 * np.log(p_0), np.maximum(1.0 - n_unsold * p_0, 0.0)
+
+    def _sold_neg_entropy(self, rows):
+        """ p log p of the given rows of sold products, and their global answer ids. """
+        catalog = self.catalog
+        rows = rows[self.in_mask[catalog.row_product[rows]]]
+        answers = catalog.row_answer[rows]
+        members = self.members[catalog.row_product[rows]]
+        weights = self.sold[catalog.row_product[rows]] / members
+        p_y = (1.0 / self.n_a[answers] + self.alpha_y * weights / self.sold_a[answers]) / (1.0 + self.alpha_y)
+        return members * p_y * np.log(p_y), answers
+
+    def score(self, questions, traffic_set=[], alpha=1):
+        """ Same as score_questions for the current mask.
+        Args:
+            questions: list of candidate questionIds
+            traffic_set (default []): traffic table restricted to the remaining products
+            alpha (default 1): weight of the history in the answer distribution
+        Returns:
+            mutual_array: mutual info of each question, in the order of questions
+        """
+        catalog = self.catalog
+        n_q = catalog.n_questions
+        n_g = catalog.code_offsets[-1]
+        q_pos = np.asarray([catalog.question_index(q) for q in questions], dtype=np.int64)
+        candidate, present, proba_a, proba_idk = self._answer_distributions(q_pos, questions, traffic_set, alpha)
+
+        # Products never sold: same probability within an answer
+        neg_entropy_a, _ = self._unsold_neg_entropy(present)
+        # Products sold: rows of the sold products still in the mask
+        rows = self.sold_rows[candidate[catalog.row_question[self.sold_rows]]]
+        p_log_p, answers = self._sold_neg_entropy(rows)
+        neg_entropy_a += np.bincount(answers, weights=p_log_p, minlength=n_g)[present]
+
+        mutual = np.bincount(catalog.answer_question[present], weights=proba_a * neg_entropy_a, minlength=n_q)
+        mutual += proba_idk * -np.log(self.n)
+        return np.where(q_pos >= 0, mutual[np.maximum(q_pos, 0)], -np.log(self.n))
+
+    def _step_tables(self, questions, traffic_set, alpha):
+        """ Quantities shared by the questions of a step, with the upper bound of every question.
+
+        Note:
+            The answer distributions are exact. Within an answer the never-sold
+            products are exact as well and the sold products, of total
+            probability m, have sum(p log p) <= m log m. This bounds the mutual
+            info of every question from above.
+
+        Returns:
+            tables: dict with q_pos, present, proba_a, unsold, idk_part and bounds
+        """
+        catalog = self.catalog
+        n_q = catalog.n_questions
+        q_pos = np.asarray([catalog.question_index(q) for q in questions], dtype=np.int64)
+        candidate, present, proba_a, proba_idk = self._answer_distributions(q_pos, questions, traffic_set, alpha)
+        unsold, sold_mass = self._unsold_neg_entropy(present)
+        bound_a = unsold + np.where(sold_mass > 0, sold_mass * np.log(np.where(sold_mass > 0, sold_mass, 1.0)), 0.0)
+        idk_part = proba_idk * -np.log(self.n)
+        bounds = np.bincount(catalog.answer_question[present], weights=proba_a * bound_a, minlength=n_q) + idk_part
+        bounds = np.where(q_pos >= 0, bounds[np.maximum(q_pos, 0)], -np.log(self.n))
+        return {"q_pos": q_pos, "present": present, "proba_a": proba_a, "unsold": unsold,
+                "idk_part": idk_part, "bounds": bounds}
+
+    def _question_score(self, tables, i):
+        """ Exact mutual info of the i-th question of the step (see _step_tables). """
+        catalog = self.catalog
+        j = tables["q_pos"][i]
+        if j < 0:
+            return -np.log(self.n)
+        present = tables["present"]
+        # answers and sold rows of question j (both are grouped by question)
+        a_lo, a_hi = np.searchsorted(present, catalog.code_offsets[j:j+2])
+        r_lo, r_hi = np.searchsorted(self.sold_rows, catalog.q_offsets[j:j+2])
+        p_log_p, answers = self._sold_neg_entropy(self.sold_rows[r_lo:r_hi])
+        offset = catalog.code_offsets[j]
+        sold_part = np.bincount(answers - offset, weights=p_log_p, minlength=catalog.code_offsets[j+1] - offset)
+        neg_entropy_a = tables["unsold"][a_lo:a_hi] + sold_part[present[a_lo:a_hi] - offset]
+        return np.sum(tables["proba_a"][a_lo:a_hi] * neg_entropy_a) + tables["idk_part"][j]
+
+    def upper_bounds(self, questions, traffic_set=[], alpha=1):
+        """ Upper bounds of the mutual info of the questions (see _step_tables).
+        Args:
+            questions: list of candidate questionIds
+            traffic_set (default []): traffic table restricted to the remaining products
+            alpha (default 1): weight of the history in the answer distribution
+        Returns:
+            bounds: upper bound of each question, in the order of questions
+        """
+        return self._step_tables(questions, traffic_set, alpha)["bounds"]
+
+    def score_pruned(self, questions, traffic_set=[], alpha=1, prior=None):
+        """ Branch and bound version of score: only the questions that can still
+        beat the best one are scored.
+
+        Note:
+            The questions are scored by decreasing upper bound (see _step_tables)
+            until the best score is larger than every remaining bound, so the
+            argmax is the one of the exhaustive search.
+
+        Args:
+            questions: list of candidate questionIds
+            traffic_set (default []): traffic table restricted to the remaining products
+            alpha (default 1): weight of the history in the answer distribution
+            prior (default None): positive weight of each question multiplying
+                                  its mutual info (see algo_utils.get_proba_Q_distribution)
+        Returns:
+            mutual_array: mutual info of each question, -inf for the pruned questions
+            n_pruned: number of questions that were not scored
+        """
+        tables = self._step_tables(questions, traffic_set, alpha)
+        prior = np.ones(len(questions)) if prior is None else np.asarray(prior, dtype=float)
+        bounds = tables["bounds"] * prior
+        mutual_array = np.full(len(questions), -np.inf)
+        best = -np.inf
+        n_scored = 0
+        for i in np.argsort(-bounds, kind='stable'):
+            if best > bounds[i]:
+                break
+            mutual_array[i] = self._question_score(tables, i)
+            n_scored += 1
+            best = max(best, mutual_array[i] * prior[i])
+        return mutual_array, len(questions) - n_scored
+
+    def score_anytime(self, questions, deadline, traffic_set=[], alpha=1, order=None, prior=None):
+        """ Scores the questions one by one until the deadline.
+        Args:
+            questions: list of candidate questionIds
+            deadline: time.time() after which no new question is scored
+                      (at least one question is always scored)
+            traffic_set (default []): traffic table restricted to the remaining products
+            alpha (default 1): weight of the history in the answer distribution
+            order (default None): indices of the questions in the order they are
+                                  scored, by decreasing upper bound if None
+            prior (default None): positive weight of each question multiplying its
+                                  upper bound to get the default order
+        Returns:
+            mutual_array: mutual info of each question, -inf for the questions not scored
+            n_scored: number of questions scored
+        """
+        tables = self._step_tables(questions, traffic_set, alpha)
+        if order is None:
+            prior = np.ones(len(questions)) if prior is None else np.asarray(prior, dtype=float)
+            order = np.argsort(-tables["bounds"] * prior, kind='stable')
+        mutual_array = np.full(len(questions), -np.inf)
+        n_scored = 0
+        for i in order:
+            if n_scored > 0 and time.time() > deadline:
+                break
+            mutual_array[i] = self._question_score(tables, i)
+            n_scored += 1
+        return mutual_array, n_scored
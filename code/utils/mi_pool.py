@@ -0,0 +1,99 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+This module defines the persistent worker pool for the maxMI algorithm.
+
+opt_step with parmap starts new processes and pickles the product,
+traffic and purchased tables to every worker at every greedy step.
+Here the workers are started once: the arrays of the compiled catalog
+are written to a folder and memory-mapped by every worker (the pages are
+shared between the processes), the traffic table and the purchase counts
+are sent once when the worker starts. Each step then only sends the
+packed mask of the remaining products and the candidate question ids.
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import multiprocessing
+import shutil
+import tempfile
+import numpy as np
+
+from utils.catalog_index import CatalogIndex
+import utils.mi_kernel as mi_kernel
+
+# State of a worker process (set once by _init_worker)
+_worker = {}
+
+
+def _init_worker(folder, traffic_cat):
+    """ Attaches a worker to the catalog saved in folder. """
+    catalog = CatalogIndex.load(folder, mmap_mode='r')
+    _worker["catalog"] = catalog
+    _worker["sold"] = np.load(os.path.join(folder, 'sold.npy'), mmap_mode='r')
+    # the traffic table is exploded once, the sessions are then selected by mask
+    _worker["history"] = mi_kernel.TrafficHistory(catalog, traffic_cat)
+
+
+def _score_chunk(args):
+    """ Scores a chunk of questions in a worker.
+    Args:
+        args: (mask, questions, alpha)
+    Returns:
+        mutual_array: mutual info of each question of the chunk
+    """
+    mask, questions, alpha = args
+    catalog = _worker["catalog"]
+    sold = _worker["sold"] * catalog.to_bool(mask)
+    return mi_kernel.score_questions(catalog, mask, questions, sold, alpha=alpha, history=_worker["history"])
+
+
+class MaxMIPool(object):
+    """ Long-lived pool of workers scoring questions on the compiled catalog.
+
+    Note:
+        The workers score the questions for the full traffic and purchased
+        tables restricted to the mask, as max_info_algorithm does with a catalog.
+
+    Example:
+        >>> pool = MaxMIPool(catalog, traffic_cat, purchased_cat)
+        >>> next_question = opt_step(question_set, products_cat, traffic_cat, purchased_cat,
+        ...                          catalog=catalog, mask=mask, pool=pool)
+        >>> pool.close()
+    """
+    def __init__(self, catalog, traffic_cat=[], purchased_cat=[], processes=None):
+        """
+        Args:
+            catalog: compiled catalog (see utils.catalog_index.CatalogIndex)
+            traffic_cat: full traffic table [SessionId, answers_selected, Items_ProductId]
+            purchased_cat: full purchased table [ProductId, UserId, OrderId, SessionId,
+                                                 Items_ProductId, Items_ItemCount]
+            processes (default None): number of workers, cpu_count() if None
+        """
+        self.processes = processes if processes else multiprocessing.cpu_count()
+        self.folder = tempfile.mkdtemp(prefix='maxmi_pool_')
+        catalog.save(self.folder)
+        np.save(os.path.join(self.folder, 'sold.npy'), catalog.purchase_counts(purchased_cat))
+        self.pool = multiprocessing.Pool(self.processes, initializer=_init_worker,
+                                         initargs=(self.folder, traffic_cat))
+
+    def score(self, mask, questions, alpha=1):
+        """ Scores the candidate questions in the workers.
+        Args:
+            mask: packed bitmap of the remaining products
+            questions: list of candidate questionIds
+            alpha (default 1): weight of the history in the answer distribution
+        Returns:
+            mutual_array: mutual info of each question, in the order of questions
+        """
+        chunks = [c for c in np.array_split(np.asarray(list(questions)), self.processes) if len(c) > 0]
+        results = self.pool.map(_score_chunk, [(mask, c, alpha) for c in chunks])
+        return np.concatenate(results) if results else np.zeros(0)
+
+    def close(self):
+        """ Stops the workers and removes the memory-mapped files. """
+        self.pool.close()
+        self.pool.join()
+        shutil.rmtree(self.folder, ignore_errors=True)
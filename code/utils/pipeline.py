@@ -0,0 +1,155 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+This module defines the incremental preprocessing pipeline.
+
+The preprocessing is a list of declared stages, each reading named
+artifacts and writing named artifacts to the artifact store (see
+utils/artifact_store.py). A stage is identified by a hash of its code (and
+of the helper functions it declares), of its parameters and of the content
+of its inputs. A stage whose outputs were written with the same hash is
+skipped, so changing one step (e.g. the binning of the answers) only reruns
+this step and the stages depending on what it changed, from the artifacts
+cached upstream. Resources such as the database connection are only
+created if a stage using them actually runs. Stages streaming their outputs
+(see utils/sql_extract.py) write them to the store themselves.
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import hashlib
+import inspect
+import time
+
+from utils.load_utils import load_obj, save_obj
+
+
+def _describe(value):
+    """ Stable description of a parameter, functions are described by their code. """
+    if callable(value):
+        return inspect.getsource(value)
+    if isinstance(value, (list, tuple)):
+        return [_describe(v) for v in value]
+    if isinstance(value, dict):
+        return sorted((k, _describe(v)) for k, v in value.items())
+    return repr(value)
+
+
+class Stage(object):
+    """ One step of the preprocessing.
+
+    Example:
+        >>> Stage('answers', build_answers, inputs=['products_with_derived'],
+        ...       outputs=['filters_def_dict', 'type_filters', 'products_table'],
+        ...       depends_on=[create_categories])
+    """
+    def __init__(self, name, func, inputs=(), outputs=(), params=None, resources=(), depends_on=(),
+                 stream=False):
+        """
+        Args:
+            name: name of the stage
+            func: function called with the inputs, the resources and the params as keyword
+                  arguments, returning the outputs (a tuple if there are several)
+            inputs (default ()): names of the artifacts read
+            outputs (default ()): names of the artifacts written
+            params (default None): dict of parameters passed to func (functions in the
+                                   parameters are part of the hash by their code)
+            resources (default ()): names of the resources passed to func (see Pipeline)
+            depends_on (default ()): helper functions whose code is part of the hash of the stage
+            stream (default False): if True, func also gets the store (keyword store) and writes
+                                    the outputs itself instead of returning them
+        """
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params if params is not None else {}
+        self.resources = list(resources)
+        self.depends_on = list(depends_on)
+        self.stream = stream
+
+    def key(self, input_hashes):
+        """ Hash of the code, parameters and inputs of the stage. """
+        md5 = hashlib.md5()
+        for func in [self.func] + self.depends_on:
+            md5.update(inspect.getsource(func).encode())
+        md5.update(repr(_describe(self.params)).encode())
+        md5.update(repr([input_hashes[name] for name in self.inputs]).encode())
+        return md5.hexdigest()
+
+
+class Pipeline(object):
+    """ Stages run in order, skipping the ones that are up to date.
+
+    Example:
+        >>> pipeline = Pipeline(stages, ArtifactStore('../data'), resources={'connection': connect})
+        >>> timings = pipeline.run()
+        >>> products_cat = pipeline.store['products_table']
+    """
+    def __init__(self, stages, store, resources=None, state_file='pipeline_state'):
+        """
+        Args:
+            stages: list of Stage, in an order where every input is written by an earlier stage
+            store: ArtifactStore where the artifacts are written
+            resources (default None): dict name -> function creating the resource on first use
+            state_file (default 'pipeline_state'): file (without .pkl) of the store folder
+                                                   holding the hashes of the stages
+        """
+        self.stages = stages
+        self.store = store
+        self.resources = resources if resources is not None else {}
+        self.state_file = os.path.join(store.folder, state_file)
+        self._created = {}
+
+    def _resource(self, name):
+        if name not in self._created:
+            self._created[name] = self.resources[name]()
+        return self._created[name]
+
+    def _load_state(self):
+        if os.path.exists(self.state_file + '.pkl'):
+            return load_obj(self.state_file)
+        return {}
+
+    def run(self, force=()):
+        """ Runs the stages that are not up to date.
+        Args:
+            force (default ()): names of stages to rerun even if they are up to date
+        Returns:
+            timings: dict stage name -> seconds spent (0 for the skipped stages)
+        """
+        state = self._load_state()
+        hashes = {}
+        timings = {}
+        for stage in self.stages:
+            key = stage.key(hashes)
+            previous = state.get(stage.name)
+            up_to_date = (previous is not None and previous["key"] == key
+                          and all(name in self.store for name in stage.outputs))
+            if up_to_date and stage.name not in force:
+                hashes.update(previous["outputs"])
+                timings[stage.name] = 0.0
+                print("Stage {}: up to date, skipped".format(stage.name))
+                continue
+
+            start_time = time.time()
+            kwargs = dict((name, self.store.load(name)) for name in stage.inputs)
+            kwargs.update((name, self._resource(name)) for name in stage.resources)
+            kwargs.update(stage.params)
+            if stage.stream:
+                stage.func(store=self.store, **kwargs)
+            else:
+                results = stage.func(**kwargs)
+                if len(stage.outputs) == 1:
+                    results = (results,)
+                for name, obj in zip(stage.outputs, results):
+                    self.store.save(name, obj)
+            outputs = dict((name, self.store.digest(name)) for name in stage.outputs)
+            hashes.update(outputs)
+            state[stage.name] = {"key": key, "outputs": outputs}
+            save_obj(state, self.state_file)
+            timings[stage.name] = time.time() - start_time
+            print("Stage {}: done in {:.1f}s".format(stage.name, timings[stage.name]))
+        return timings
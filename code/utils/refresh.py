@@ -0,0 +1,128 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+This module refreshes the tables with the new purchases.
+
+Rebuilding the tables with init_dataframes.py scales with the whole history.
+A refresh only extracts the single-item orders after the last OrderId
+processed (the watermark) and the traffic of their sessions, maps this
+traffic to the answers with the current answer definition (filters_def_dict
+and type_filters) and appends the new rows to purchased_table,
+raw_traffic_table and traffic_table. The watermark is the last OrderId of
+purchased_table, so it follows the tables when they are rebuilt. The filter
+counts of the history are kept with the digest of the traffic table they
+were counted on, so df_history is rebuilt from them without reading the
+traffic table again, unless init_dataframes.py rewrote it since. The purchase counts and the traffic answer tensor
+are computed from the tables when they are loaded (see
+CatalogIndex.purchase_counts and mi_kernel.TrafficHistory).
+
+Every refresh is logged with the products that got new purchases: a saved
+decision cache (see utils/decision_cache.py) only drops the decisions of
+the states where one of these products remains.
+
+Usage:
+    python refresh.py                               # from the utils folder
+    python refresh.py -u sqlite:///digitec.db       # from a local copy of the database
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import argparse
+import time
+import pandas as pd
+
+from utils import algo_utils
+from utils.artifact_store import ArtifactStore
+from utils.build_answers_utils import process_all_traffic_answers
+from utils.catalog_index import CatalogIndex
+from utils.decision_cache import tables_tag
+from utils.init_dataframes import CATEGORY, DATABASE_URL, connect, extract_purchased, extract_traffic, \
+                                  extract_purchased_pushdown, extract_traffic_pushdown
+
+
+def refresh(folder='../data', url=DATABASE_URL, cat=CATEGORY, batch_size=2000, chunksize=50000, pushdown=False):
+    """ Appends the purchases newer than the watermark, and their traffic, to the tables of folder.
+    Args:
+        folder (default '../data'): artifact store of the tables
+        url (default DATABASE_URL): database to extract the new purchases from
+        cat (default CATEGORY): category of the products
+        batch_size (default 2000): number of sessions per traffic query
+        chunksize (default 50000): maximum number of rows read at once
+        pushdown (default False): join in the database during the extraction (see init_dataframes.py)
+    Returns:
+        n_new: number of new purchases
+    """
+    t1 = time.time()
+    store = ArtifactStore(folder, mmap_mode=None)
+    products_cat = store['products_table']
+    purchased_cat = store['purchased_table']
+    watermark = int(purchased_cat["OrderId"].max())
+    state = store['refresh_state'] if 'refresh_state' in store else {}
+    if state.get("traffic_digest") != store.digest('traffic_table'):
+        # First refresh, or traffic table rebuilt since: counts of the whole table
+        state = {"history_counts": algo_utils.history_counts(store['traffic_table'])}
+    tag_before = tables_tag(CatalogIndex(products_cat, purchased_cat),
+                            store.length('traffic_table'), len(purchased_cat),
+                            store['df_history'] if 'df_history' in store else None)
+
+    connection = connect(url)
+    if pushdown:
+        extract_purchased_pushdown(connection, store, cat, chunksize, name='purchased_delta', since=watermark)
+    else:
+        extract_purchased(connection, store, cat, chunksize, name='purchased_delta', since=watermark)
+    new_purchased = store.load('purchased_delta')
+    if len(new_purchased) > 0:
+        # the orders already in the table are not added twice
+        new_purchased = new_purchased.loc[~new_purchased["OrderId"].isin(purchased_cat["OrderId"].values)]
+    if len(new_purchased) == 0:
+        print('No new purchases after OrderId {}'.format(watermark))
+        return 0
+    if pushdown:
+        extract_traffic_pushdown(connection, store, new_purchased, cat, chunksize, name='traffic_delta')
+    else:
+        extract_traffic(connection, store, new_purchased, cat, batch_size, chunksize, name='traffic_delta')
+    raw_traffic = store.load('traffic_delta')
+    if len(raw_traffic) > 0:
+        new_traffic = process_all_traffic_answers(raw_traffic.copy(), new_purchased,
+                                                  store['filters_def_dict'], store['type_filters'])
+    else:
+        new_traffic = pd.DataFrame(columns=["SessionId", "answers_selected", "Items_ProductId"])
+
+    # Merge the delta into the tables
+    store.append('purchased_table', new_purchased)
+    if 'raw_traffic_table' in store:
+        # the sessions of earlier purchases are already there
+        known = store.column('raw_traffic_table', 'SessionId')
+        store.append('raw_traffic_table', raw_traffic.loc[~raw_traffic["SessionId"].isin(known)])
+    store.append('traffic_table', new_traffic)
+    state["history_counts"].update(algo_utils.history_counts(new_traffic))
+    state["traffic_digest"] = store.digest('traffic_table')
+    if len(new_traffic) > 0:
+        store.save('df_history', algo_utils.history_from_counts(state["history_counts"], store['question_text_df']))
+    store.save('refresh_state', state)
+
+    # Log the refresh for the decision caches
+    tag_after = tables_tag(CatalogIndex(products_cat, store.load('purchased_table')),
+                           store.length('traffic_table'), store.length('purchased_table'),
+                           store.load('df_history') if 'df_history' in store else None)
+    refresh_log = store['refresh_log'] if 'refresh_log' in store else []
+    refresh_log.append({"from": tag_before, "to": tag_after,
+                        "products": set(new_purchased["ProductId"].values.tolist()),
+                        "history": len(new_traffic) > 0})
+    store.save('refresh_log', refresh_log)
+    print('Added {} purchases and {} traffic rows in {:.1f}s'.format(len(new_purchased), len(new_traffic),
+                                                                    time.time() - t1))
+    return len(new_purchased)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--data", default='../data', help="artifact store of the tables")
+    parser.add_argument("-u", "--url", default=DATABASE_URL,
+                        help="database to extract from, e.g. sqlite:///digitec.db for a local copy")
+    parser.add_argument("-p", "--pushdown", action='store_true',
+                        help="join in the database to transfer less data")
+    args = parser.parse_args()
+    refresh(args.data, args.url, pushdown=args.pushdown)
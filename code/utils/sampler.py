@@ -14,7 +14,7 @@ import os.path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
 
 import utils.algo_utils as algo_utils
-from utils.load_utils import load_obj, save_obj
+from utils.artifact_store import ArtifactStore
 
 
 def get_all_answers(question, product_set):
@@ -89,8 +89,9 @@ def sample_answers(y, product_set, p_idk = 0.1, p_2a = 0.3, p_3a = 0.15):
 # =========== TESTING FUNCTION ========== #
 if __name__=='__main__':
     from init_dataframes import init_df
+    store = ArtifactStore('../data')
     try:
-        products_cat = load_obj('../data/products_table')
+        products_cat = store['products_table']
         print("Loaded datsets")
     except:
         print("Create datasets first")   
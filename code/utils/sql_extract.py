@@ -0,0 +1,165 @@
+""" Data Science Lab Project - FALL 2018
+Mélanie Bernhardt - Mélanie Gaillochet - Laura Manduchi
+
+This module defines the streaming extraction of the tables from the database.
+
+The queries are read through server-side cursors (stream_results) in chunks
+of bounded size, and every chunk is written to the artifact store as soon as
+it is read (see ChunkWriter in utils/artifact_store.py), so neither the
+result set nor the extracted table is held in memory. The rows are read in
+the order of a key column and the last key fully written is committed as a
+watermark: an interrupted extraction continues after it when run again.
+Lists of values used to filter a query (e.g. the sessions of the purchases)
+are uploaded to a temporary table and joined (see upload_values).
+Only standard SQL is used, so the extraction also runs against a local
+SQLite file with the same schema (product_purchase, product_only_ids,
+traffic, product).
+"""
+import sys
+import os.path
+# To import from sibling directory ../utils
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils.artifact_store import ChunkWriter
+from utils.load_utils import batch
+
+
+def stream_query(connection, query, params=None, chunksize=50000):
+    """ Reads a query through a server-side cursor.
+    Args:
+        connection: SQLAlchemy connection
+        query: SQL query (string, with :name parameters)
+        params (default None): dict of the query parameters
+        chunksize (default 50000): maximum number of rows per chunk
+    Returns:
+        Iterator over DataFrames of at most chunksize rows.
+    """
+    result = connection.execution_options(stream_results=True).execute(text(query), params or {})
+    columns = list(result.keys())
+    try:
+        while True:
+            rows = result.fetchmany(chunksize)
+            if len(rows) == 0:
+                break
+            yield pd.DataFrame.from_records(rows, columns=columns)
+    finally:
+        result.close()
+
+
+def read_query(connection, query, params=None, chunksize=50000):
+    """ Reads the whole result of a (small) query, see stream_query. """
+    chunks = list(stream_query(connection, query, params, chunksize))
+    if len(chunks) == 0:
+        result = connection.execute(text(query), params or {})
+        columns = list(result.keys())
+        result.close()
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def extract_ordered(connection, store, name, query, key, params=None, chunksize=50000, transform=None,
+                    key_sql=None, signature=None):
+    """ Extracts a query ordered by key to the artifact name of the store, resuming after
+    the watermark of a previous interrupted extraction of the same query.
+
+    Example:
+        >>> extract_ordered(connection, store, 'raw_products_table', \'\'\'
+        ...     SELECT "ProductId", "BrandId" FROM product_only_ids
+        ...     WHERE "ProductTypeId" = :cat {after} ORDER BY "ProductId"\'\'\',
+        ...     key='ProductId', params={'cat': 6})
+
+    Args:
+        connection: SQLAlchemy connection
+        store: ArtifactStore
+        name: name of the artifact
+        query: SQL query ordered by key, where {after} is replaced by the condition on the
+               watermark (starting with AND)
+        key: column ordering the rows
+        params (default None): dict of the query parameters
+        chunksize (default 50000): maximum number of rows read at once
+        transform (default None): function applied to every chunk before writing it
+        key_sql (default None): SQL expression of key in the query (e.g. 't."SessionId"' if
+                                the query joins several tables), the quoted key if None
+        signature (default None): what else the result depends on (e.g. the uploaded values),
+                                  the progress of an extraction with another signature is discarded
+    Returns:
+        length: number of rows of the artifact
+    """
+    params = dict(params or {})
+    key_sql = key_sql if key_sql is not None else '"{}"'.format(key)
+    writer = ChunkWriter(store, name, signature=(query, key, sorted(params.items()), signature))
+    after = ''
+    if writer.watermark is not None:
+        print('Resuming extraction of {} after {} = {}'.format(name, key, writer.watermark))
+        after = 'AND {} > :watermark'.format(key_sql)
+        params['watermark'] = writer.watermark
+    pending = None
+    for chunk in stream_query(connection, query.format(after=after), params, chunksize):
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+        # The rows of the last key may continue in the next chunk: they are written with it
+        last = chunk[key].iloc[-1]
+        complete = (chunk[key] != last).values
+        pending = chunk[~complete].reset_index(drop=True)
+        if complete.any():
+            written = chunk[complete].reset_index(drop=True)
+            writer.write(transform(written) if transform is not None else written)
+            writer.commit(written[key].tolist()[-1])
+    if pending is not None and len(pending) > 0:
+        writer.write(transform(pending) if transform is not None else pending)
+    length = writer.close()
+    print('Extracted {} rows to {}'.format(length, name))
+    return length
+
+
+def upload_values(connection, table, column, values):
+    """ Creates a temporary table holding the values, to join them in the queries
+    instead of sending them in batches of IN (...) lists.
+    Args:
+        connection: SQLAlchemy connection
+        table: name of the temporary table (replaced if it exists)
+        column: name of its column
+        values: integer values
+    """
+    connection.execute(text('DROP TABLE IF EXISTS {}'.format(table)))
+    connection.execute(text('CREATE TEMPORARY TABLE {} ("{}" BIGINT PRIMARY KEY)'.format(table, column)))
+    rows = [{'value': int(v)} for v in pd.unique(values)]
+    if len(rows) > 0:
+        connection.execute(text('INSERT INTO {} VALUES (:value)'.format(table)), rows)
+
+
+def extract_batches(connection, store, name, query, key, values, batch_size=2000,
+                    chunksize=50000, transform=None):
+    """ Extracts a query restricted to batches of values of key (e.g. the SessionIds of the purchases)
+    to the artifact name of the store. The last value of every extracted batch is committed as
+    watermark, an interrupted extraction resumes with the next batch.
+    Args:
+        connection: SQLAlchemy connection
+        store: ArtifactStore
+        name: name of the artifact
+        query: SQL query where {values} is replaced by the values of the batch
+        key: column of the values
+        values: values of key to extract
+        batch_size (default 2000): number of values per query
+        chunksize (default 50000): maximum number of rows read at once
+        transform (default None): function applied to every chunk before writing it
+    Returns:
+        length: number of rows of the artifact
+    """
+    writer = ChunkWriter(store, name, signature=(query, key, batch_size, tuple(values)))
+    values = sorted(values)
+    if writer.watermark is not None:
+        print('Resuming extraction of {} after {} = {}'.format(name, key, writer.watermark))
+        values = [v for v in values if v > writer.watermark]
+    for i, b in enumerate(batch(values, n=batch_size)):
+        print("Processing batch: {}".format(i))
+        for chunk in stream_query(connection, query.format(values=', '.join(map(str, b))),
+                                  chunksize=chunksize):
+            writer.write(transform(chunk) if transform is not None else chunk)
+        writer.commit(b[-1])
+    length = writer.close()
+    print('Extracted {} rows to {}'.format(length, name))
+    return length